@@ -15,9 +15,11 @@ import os
 from configuration import Configuration
 
 
-def start(logger_name):
+def start(logger_name, logfile="sensor_app.log"):
     """
     Set up logging for the application using the sensor_monitor logger
+    :param logger_name: Name of the logger to be configured
+    :param logfile: Name of the log file
     :return:
     """
 
@@ -64,7 +66,6 @@ def start(logger_name):
         logger.addHandler(ch)
 
     # Always log to a file
-    logfile = "sensor_app.log"
     fh = logging.handlers.TimedRotatingFileHandler(logfile, when='midnight', backupCount=3)
     fh.setLevel(loglevel)
     fh.setFormatter(formatter)
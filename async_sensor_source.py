@@ -0,0 +1,214 @@
+#
+# async_sensor_source.py - asyncio facade for a sensor data source
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Lets consumers be written as coroutines on one event loop:
+#
+#   source = AsyncSensorSource(data_source)
+#   async for sample in source.stream():
+#       ...
+#   history = await source.get_sensor_history(mac, start, end)
+#
+# Samples arrive on the data source's thread. Each stream has a bounded
+# asyncio.Queue and samples are handed to the event loop with
+# call_soon_threadsafe. When a stream's queue is full, the oldest sample is
+# dropped (and counted), so a slow consumer never stalls data collection.
+# A stream created with block=True applies backpressure instead: the
+# listener's thread waits (up to block_timeout) for room in the queue. With
+# SensorDataSourceHandler that is the listener's own bus subscriber thread,
+# so reception itself is not held up.
+#
+# DB queries run on a dedicated single thread executor, so they never
+# block the event loop and never compete with each other for the DB.
+#
+
+
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+from threading import Lock
+from sensor_db import SensorDB
+import sensor_clock
+
+
+class AsyncSensorSource:
+    """
+    asyncio facade for SensorDataSourceHandler, CollectorDataSource or any
+    data source with the same interface
+    """
+    DEFAULT_QUEUE_SIZE = 1000
+    _END = object()
+
+    def __init__(self, data_source):
+        """
+        :param data_source: An open sensor data source
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._data_source = data_source
+        self._sensor_db = SensorDB()
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncSensorDB")
+        # (loop, queue) of every active stream
+        self._streams = set()
+        self._dropped = 0
+        self._dropped_lock = Lock()
+
+    async def stream(self, maxsize=DEFAULT_QUEUE_SIZE, block=False, block_timeout=5.0):
+        """
+        Iterate over live samples
+        :param maxsize: Capacity of the stream's queue
+        :param block: When the queue is full, False drops the oldest sample and
+        True makes the data source thread wait for room
+        :param block_timeout: Maximum time in seconds the data source thread waits.
+        The sample is dropped after that.
+        :return: An async iterator of sensor data dicts, each including "mac"
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+        entry = (loop, queue)
+
+        def listener(mac, data):
+            sample = dict(data)
+            sample["mac"] = mac
+            try:
+                if block:
+                    future = asyncio.run_coroutine_threadsafe(queue.put(sample), loop)
+                    try:
+                        future.result(timeout=block_timeout)
+                    except concurrent.futures.TimeoutError:
+                        future.cancel()
+                        self._count_dropped()
+                else:
+                    loop.call_soon_threadsafe(self._put_drop_oldest, queue, sample)
+            except RuntimeError:
+                # The event loop is closed
+                pass
+
+        self._streams.add(entry)
+        self._data_source.add_sample_listener(listener)
+        try:
+            while True:
+                sample = await queue.get()
+                if sample is AsyncSensorSource._END:
+                    return
+                yield sample
+        finally:
+            self._data_source.remove_sample_listener(listener)
+            self._streams.discard(entry)
+
+    @property
+    def dropped(self):
+        """
+        The number of samples dropped because a stream was full
+        """
+        return self._dropped
+
+    def close(self):
+        """
+        End all streams and shut down the DB executor. The data source
+        itself is not closed.
+        :return: None
+        """
+        for loop, queue in list(self._streams):
+            try:
+                loop.call_soon_threadsafe(self._put_drop_oldest, queue, AsyncSensorSource._END)
+            except RuntimeError:
+                pass
+        self._db_executor.shutdown(wait=True)
+
+    async def get_latest(self):
+        """
+        The latest sample of every sensor
+        :return: A dict of sensor data dicts keyed by mac
+        """
+        sensor_list = self._data_source.lock_sensor_list()
+        latest = {mac: dict(data) for mac, data in sensor_list.items()}
+        self._data_source.unlock_sensor_list()
+        return latest
+
+    async def get_sensor_history(self, mac, start_time=None, end_time=None, bucket_seconds=None):
+        """
+        The history of a sensor for a time range
+        :param mac: The sensor of interest
+        :param start_time: Start of the range. The default is 24 hours before end_time.
+        :param end_time: End of the range. The default is now.
+        :param bucket_seconds: If given, samples are averaged into time buckets of this length
+        :return: A SensorHistoryColumns instance or None if the query failed
+        """
+        if end_time is None:
+            end_time = sensor_clock.now()
+        if start_time is None:
+            start_time = end_time - datetime.timedelta(hours=24)
+        if bucket_seconds is None:
+            return await self._run_query(self._sensor_db.get_sensor_history_range, mac, start_time, end_time)
+        return await self._run_query(self._sensor_db.get_sensor_history_buckets, mac, start_time, end_time,
+                                     bucket_seconds)
+
+    async def get_multi_sensor_history(self, macs):
+        """
+        The full history of several sensors
+        :param macs: A list of the sensors of interest
+        :return: A dict of SensorHistoryColumns keyed by mac or None if the query failed
+        """
+        return await self._run_query(self._sensor_db.get_multi_sensor_history, macs)
+
+    async def _run_query(self, query, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, query, *args)
+
+    def _put_drop_oldest(self, queue, item):
+        """
+        Queue an item, dropping the oldest item if the queue is full. Runs on the event loop.
+        """
+        if queue.full():
+            queue.get_nowait()
+            if item is not AsyncSensorSource._END:
+                self._count_dropped()
+        queue.put_nowait(item)
+
+    def _count_dropped(self):
+        self._dropped_lock.acquire()
+        self._dropped += 1
+        self._dropped_lock.release()
+
+
+if __name__ == "__main__":
+    # Print live samples and a history summary. Uses the configured data source.
+    from configuration import Configuration
+    import app_logger
+    from sensor_data_source_handler import create_data_source
+
+    Configuration.load_configuration()
+    app_logger.start("sensor_app")
+
+    async def main():
+        data_source = create_data_source()
+        data_source.open_data_source()
+        source = AsyncSensorSource(data_source)
+        try:
+            count = 0
+            async for sample in source.stream():
+                print(f"{sample['timestamp']} {sample['mac']} {sample.get('name')} {sample.get('temperature')}")
+                count += 1
+                if count == 10:
+                    history = await source.get_sensor_history(sample["mac"], bucket_seconds=3600)
+                    print(f"{sample['mac']} hourly history: {len(history) if history is not None else 0} buckets")
+                    break
+        finally:
+            source.close()
+            data_source.close_data_source()
+
+    asyncio.run(main())
+    app_logger.shut_down()
@@ -0,0 +1,293 @@
+#
+# bench_pipeline.py - End-to-end sensor data pipeline benchmark
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Drives a headless SensorDataSourceHandler (test mode load generator or a
+# replayed capture) against a temporary sensor DB and measures, per sample:
+#   list_ms    adapter callback -> visible in the sensor list (and published)
+#   commit_ms  adapter callback -> committed to the DB
+# as p50/p99/max, plus CPU time per sample by stage:
+#   source     generating (or replaying) samples
+#   receive    the handler's inline work on the adapter thread
+#   db_write   the DB writer subscriber
+#   other      everything else in the process
+#
+# The synthetic load is stepped up through --rates (total samples/s). A step
+# is sustained when the source kept up, nothing was dropped and the DB
+# writer's backlog did not grow during the step. The ramp stops at the first
+# step that is not sustained. The highest sustained rate, divided by the
+# advertising rate of a tag, sizes the hardware for a tag count.
+#
+# Usage (from the project root, where sensor_app.conf is):
+#   python benchmarks/bench_pipeline.py [--rates 100,500,1000,2000,5000]
+#       [--sensors 100] [--duration 10] [--out results.json]
+#   python benchmarks/bench_pipeline.py --replay capture.jsonl.gz [--speed 0]
+#
+
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# Run from the project root or from the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from configuration import Configuration
+from sensor_data_source_handler import SensorDataSourceHandler
+
+
+# Key used to carry the callback time through the pipeline
+_T_CALLBACK = "_bench_t_callback"
+
+
+def percentiles(values):
+    """
+    :param values: Latencies in seconds
+    :return: A dict of p50, p99 and max in ms
+    """
+    if len(values) == 0:
+        return {"p50": None, "p99": None, "max": None}
+    values = sorted(values)
+    n = len(values) - 1
+    return {
+        "p50": values[int(0.50 * n)] * 1e3,
+        "p99": values[int(0.99 * n)] * 1e3,
+        "max": values[-1] * 1e3,
+    }
+
+
+def thread_cpu(thread):
+    """
+    CPU time used by another thread, where the platform can tell
+    :return: Seconds or None
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError, TypeError):
+        return None
+
+
+class InstrumentedHandler(SensorDataSourceHandler):
+    """
+    SensorDataSourceHandler with timing hooks at the adapter callback and DB commit
+    """
+    def __init__(self):
+        super().__init__()
+        self.list_latencies = []
+        self.commit_latencies = []
+        self.received = 0
+        self.committed = 0
+        self.receive_cpu = 0.0
+        self.db_write_cpu = 0.0
+        db_write = self._sensor_db.add_sensor_data_batch
+
+        def timed_db_write(samples):
+            cpu = time.thread_time()
+            count = db_write(samples)
+            now = time.perf_counter()
+            self.db_write_cpu += time.thread_time() - cpu
+            self.committed += count
+            self.commit_latencies.extend(now - data[_T_CALLBACK] for _, data in samples)
+            return count
+
+        self._sensor_db.add_sensor_data_batch = timed_db_write
+
+    def _handle_sensor_data(self, mac, data):
+        t = time.perf_counter()
+        cpu = time.thread_time()
+        data[_T_CALLBACK] = t
+        super()._handle_sensor_data(mac, data)
+        self.list_latencies.append(time.perf_counter() - t)
+        self.receive_cpu += time.thread_time() - cpu
+        self.received += 1
+
+    @property
+    def db_backlog(self):
+        return self.bus_stats.get("db_writer", {}).get("depth", 0)
+
+    @property
+    def db_dropped(self):
+        return self.bus_stats.get("db_writer", {}).get("dropped", 0)
+
+
+def run_step(config, duration, target_rate=None, replay=False):
+    """
+    Run the pipeline for one load step
+    :return: A dict of results
+    """
+    handler = InstrumentedHandler()
+    process_cpu = time.process_time()
+    opened = time.perf_counter()
+    handler.open_data_source()
+    adapter = handler._sensor_data_source
+    # The step is timed from when the data source is open, so startup doesn't lower the input rate
+    start = time.perf_counter()
+    startup_elapsed = start - opened
+    received_at_start = handler.received
+
+    # Sample the DB writer backlog through the step
+    backlogs = []
+    while True:
+        time.sleep(0.25)
+        backlogs.append(handler.db_backlog)
+        elapsed = time.perf_counter() - start
+        if replay and adapter.wait_finished(0):
+            break
+        if not replay and elapsed >= duration:
+            break
+    elapsed = time.perf_counter() - start
+    received = handler.received - received_at_start
+    source_cpu = thread_cpu(adapter)
+    db_thread_cpu = thread_cpu(handler._db_writer._thread)
+    dropped = handler.db_dropped
+
+    handler.close_data_source()
+    drain_elapsed = time.perf_counter() - opened
+    total_cpu = time.process_time() - process_cpu
+
+    count = max(handler.committed, 1)
+    cpu = {
+        "receive_us": handler.receive_cpu * 1e6 / count,
+        "db_write_us": (db_thread_cpu if db_thread_cpu is not None else handler.db_write_cpu) * 1e6 / count,
+    }
+    if source_cpu is not None:
+        cpu["source_us"] = (source_cpu - handler.receive_cpu) * 1e6 / count
+        cpu["other_us"] = (total_cpu - source_cpu - (db_thread_cpu or handler.db_write_cpu)) * 1e6 / count
+    cpu["total_us"] = total_cpu * 1e6 / count
+
+    # The backlog grew if the second half of the step ends well above the first half's peak
+    half = len(backlogs) // 2
+    first_peak = max(backlogs[:half]) if half > 0 else 0
+    backlog_grew = len(backlogs) > 1 and backlogs[-1] > max(first_peak * 1.5, 0.5 * (target_rate or 0))
+    input_rate = received / elapsed
+    result = {
+        "target_rate": target_rate,
+        "startup_ms": startup_elapsed * 1e3,
+        "input_rate": input_rate,
+        "committed": handler.committed,
+        "commit_rate": handler.committed / drain_elapsed,
+        "dropped": dropped,
+        "max_db_backlog": max(backlogs) if len(backlogs) > 0 else 0,
+        "final_db_backlog": backlogs[-1] if len(backlogs) > 0 else 0,
+        "list_ms": percentiles(handler.list_latencies),
+        "commit_ms": percentiles(handler.commit_latencies),
+        "cpu_per_sample": cpu,
+    }
+    result["sustained"] = dropped == 0 and not backlog_grew and \
+        (target_rate is None or input_rate >= 0.95 * target_rate)
+    return result
+
+
+def print_result(result):
+    target = f"{result['target_rate']:8.0f}" if result["target_rate"] is not None else "  replay"
+    lm = result["list_ms"]
+    cm = result["commit_ms"]
+    cpu = result["cpu_per_sample"]
+    print(f"{target} {result['input_rate']:9.0f} {result['commit_rate']:9.0f} "
+          f"{lm['p50'] or 0:7.3f} {lm['p99'] or 0:7.3f} {lm['max'] or 0:8.2f} "
+          f"{cm['p50'] or 0:8.1f} {cm['p99'] or 0:8.1f} {cm['max'] or 0:8.1f} "
+          f"{result['max_db_backlog']:7d} {result['dropped']:7d} "
+          f"{_cpu_str(cpu.get('source_us')):>21s} {cpu['receive_us']:7.1f} {cpu['db_write_us']:7.1f} "
+          f"{_cpu_str(cpu.get('other_us')):>7s}  {'yes' if result['sustained'] else 'NO'}")
+
+
+def _cpu_str(value):
+    # Not available when the platform can't read another thread's CPU time
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end sensor data pipeline benchmark")
+    parser.add_argument("--rates", default="100,500,1000,2000,5000,10000",
+                        help="Comma separated total sample rates (samples/s) to step through")
+    parser.add_argument("--sensors", type=int, default=100, help="Number of emulated sensors")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per step")
+    parser.add_argument("--replay", default=None, help="Replay this capture instead of the synthetic load")
+    parser.add_argument("--speed", type=float, default=0.0, help="Replay speed (0 is maximum)")
+    parser.add_argument("--tag-rate", type=float, default=1.0,
+                        help="Samples per second one tag produces, for sizing (default 1.0)")
+    parser.add_argument("--all", action="store_true", help="Run every step, even after one is not sustained")
+    parser.add_argument("--out", default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    Configuration.load_configuration()
+    config = Configuration.get_configuration()
+    if config is None:
+        print("Run from the folder containing sensor_app.conf")
+        return 2
+
+    folder = tempfile.mkdtemp(prefix="bench_pipeline_")
+    # A private DB and nothing but the DB writer on the bus
+    config[Configuration.CFG_SENSOR_DATABASE] = os.path.join(folder, "bench.sqlite3")
+    config[Configuration.CFG_HTTP_API_PORT] = 0
+    config[Configuration.CFG_FORWARD_URL] = ""
+    config[Configuration.CFG_CAPTURE_FILE] = ""
+
+    print(f"{'target':>8s} {'input/s':>9s} {'commit/s':>9s} "
+          f"{'list ms p50':>11s} {'p99':>7s} {'max':>8s} {'commit ms p50':>13s} {'p99':>8s} {'max':>8s} "
+          f"{'backlog':>7s} {'dropped':>7s} {'cpu us/sample: source':>21s} {'receive':>7s} {'db':>7s} "
+          f"{'other':>7s}  sustained")
+    results = []
+    try:
+        if args.replay is not None:
+            config[Configuration.CFG_REPLAY_FILE] = args.replay
+            config[Configuration.CFG_REPLAY_SPEED] = args.speed
+            result = run_step(config, None, replay=True)
+            print_result(result)
+            results.append(result)
+        else:
+            config[Configuration.CFG_REPLAY_FILE] = ""
+            config[Configuration.CFG_USE_TEST_DATA] = "true"
+            config[Configuration.CFG_TEST_SENSOR_COUNT] = args.sensors
+            config[Configuration.CFG_TEST_SEED] = 1
+            config[Configuration.CFG_TEST_DUPLICATE_RATIO] = 0.0
+            config[Configuration.CFG_TEST_BURST_INTERVAL] = 0.0
+            for rate in [float(r) for r in args.rates.split(",")]:
+                config[Configuration.CFG_TEST_SAMPLE_RATE] = rate / args.sensors
+                result = run_step(config, args.duration, target_rate=rate)
+                print_result(result)
+                results.append(result)
+                if not result["sustained"] and not args.all:
+                    break
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    sustained = [r["target_rate"] for r in results if r["sustained"] and r["target_rate"] is not None]
+    if len(sustained) > 0:
+        print(f"Highest sustained rate: {max(sustained):.0f} samples/s, "
+              f"about {max(sustained) / args.tag_rate:.0f} tags at {args.tag_rate:g} samples/s each")
+    elif args.replay is None:
+        print("No rate was sustained")
+
+    if args.out is not None:
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "machine": platform.machine(),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "sensors": args.sensors,
+                "duration": args.duration,
+                "replay": args.replay,
+            },
+            "results": results,
+            "max_sustained_rate": max(sustained) if len(sustained) > 0 else None,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
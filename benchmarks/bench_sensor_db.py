@@ -0,0 +1,307 @@
+#
+# bench_sensor_db.py - SensorDB benchmarks at production data sizes
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# For each DB size (hours of data x sensors, one sample per sensor every
+# --sample-interval seconds, like a RuuviTag advertising) a synthetic sensor
+# DB is built in a temporary folder and these are measured:
+#   insert_single_us       add_sensor_data(), per sample
+#   insert_batch_us        add_sensor_data_batch() with --batch samples, per sample
+#   add_sensor_us          add_sensor() for a known sensor, per call
+#   history_ms             get_sensor_history() of one sensor
+#   history_peak_mb        Peak Python memory allocated by get_sensor_history()
+#   history_columns_ms     get_sensor_history_columns() of one sensor
+#   history_columns_peak_mb
+#   trim_ms                trim_sensor_data() deleting the older half of the DB
+# Times are the median of --repeat runs. All metrics are lower-is-better.
+#
+# Results are printed and written as JSON. When a baseline file exists the
+# results are compared with it. A metric more than --threshold (a fraction)
+# worse than the baseline is a regression and the exit status is 1.
+# Baselines are machine specific. Save one on the target machine (e.g. the
+# Pi) with --save-baseline.
+#
+# Usage (from the project root, where sensor_app.conf is):
+#   python benchmarks/bench_sensor_db.py [--sizes 1h,24h,7d] [--sensors 11]
+#       [--sample-interval 1.0] [--repeat 5] [--batch 100] [--out results.json]
+#       [--baseline benchmarks/baseline.json] [--threshold 0.25] [--save-baseline]
+#
+
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Run from the project root or from the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from configuration import Configuration
+from sensor_db import SensorDB
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Samples inserted per run of the insert benchmarks
+INSERT_SAMPLES = 1000
+ADD_SENSOR_CALLS = 1000
+
+
+def parse_size(size):
+    """
+    Convert a size like 1h, 24h or 7d to hours
+    :param size: The size string
+    :return: Hours as a float
+    """
+    if size.endswith("d"):
+        return float(size[:-1]) * 24.0
+    if size.endswith("h"):
+        return float(size[:-1])
+    return float(size)
+
+
+def make_macs(sensors):
+    return [f"BE:EF:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(sensors)]
+
+
+def make_sample(rng, timestamp):
+    """
+    A sample dict with the keys SensorDB stores
+    """
+    return {
+        "data_format": 5,
+        "temperature": 20.0 + rng.random() * 5.0,
+        "humidity": 40.0 + rng.random() * 20.0,
+        "pressure": 1000.0 + rng.random() * 20.0,
+        "tx_power": 4,
+        "battery": 2900 + rng.randint(0, 200),
+        "timestamp": timestamp,
+    }
+
+
+def build_db(path, hours, macs, sample_interval):
+    """
+    Create a sensor DB holding hours of samples from each sensor, ending now
+    :return: The number of SensorData rows
+    """
+    # Schema, indexes and WAL mode exactly as the app creates them
+    SensorDB(db_path=path)
+    rng = random.Random(1)
+    end = datetime.datetime.now()
+    samples_per_sensor = int(hours * 3600.0 / sample_interval)
+    start = end - datetime.timedelta(seconds=samples_per_sensor * sample_interval)
+
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO Sensors (mac, name) VALUES (?, ?)",
+                     [(mac, f"Bench{i}") for i, mac in enumerate(macs)])
+    sensor_ids = [r[0] for r in conn.execute("SELECT id FROM Sensors ORDER BY id")]
+
+    def rows():
+        # Interleaved in time order, as the sensors report
+        for n in range(samples_per_sensor):
+            t = str(start + datetime.timedelta(seconds=n * sample_interval))
+            for sensor_id in sensor_ids:
+                yield (sensor_id, 5, 20.0 + rng.random() * 5.0, 40.0 + rng.random() * 20.0,
+                       1000.0 + rng.random() * 20.0, 4, 2900 + rng.randint(0, 200), t)
+
+    conn.executemany(
+        "INSERT INTO SensorData (sensor_id, format, temperature, humidity, pressure, tx_power, battery, data_time) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return samples_per_sensor * len(macs)
+
+
+def median_time(fn, repeat):
+    """
+    Median elapsed time of several runs
+    :return: Seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def peak_memory(fn):
+    """
+    Peak Python memory allocated while running fn
+    :return: MB
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024.0 * 1024.0)
+
+
+def bench_size(folder, size, args):
+    """
+    Build a DB of one size and run all benchmarks on it
+    :return: A dict of metrics
+    """
+    hours = parse_size(size)
+    macs = make_macs(args.sensors)
+    path = os.path.join(folder, f"bench_{size}.sqlite3")
+    start = time.perf_counter()
+    row_count = build_db(path, hours, macs, args.sample_interval)
+    build_s = time.perf_counter() - start
+    print(f"{size}: {row_count} rows, {os.path.getsize(path) / (1024.0 * 1024.0):.1f} MB, built in {build_s:.1f} s")
+
+    db = SensorDB(db_path=path)
+    rng = random.Random(2)
+    result = {
+        "rows": row_count,
+        "db_mb": os.path.getsize(path) / (1024.0 * 1024.0),
+    }
+
+    def insert_single():
+        now = datetime.datetime.now()
+        for i in range(INSERT_SAMPLES):
+            db.add_sensor_data(macs[i % len(macs)], make_sample(rng, now))
+
+    def insert_batch():
+        now = datetime.datetime.now()
+        samples = [(macs[i % len(macs)], make_sample(rng, now)) for i in range(INSERT_SAMPLES)]
+        for i in range(0, len(samples), args.batch):
+            db.add_sensor_data_batch(samples[i:i + args.batch])
+
+    def add_sensor():
+        for i in range(ADD_SENSOR_CALLS):
+            db.add_sensor(macs[i % len(macs)])
+
+    result["insert_single_us"] = median_time(insert_single, args.repeat) * 1e6 / INSERT_SAMPLES
+    result["insert_batch_us"] = median_time(insert_batch, args.repeat) * 1e6 / INSERT_SAMPLES
+    result["add_sensor_us"] = median_time(add_sensor, args.repeat) * 1e6 / ADD_SENSOR_CALLS
+
+    mac = macs[0]
+    result["history_ms"] = median_time(lambda: db.get_sensor_history(mac), args.repeat) * 1e3
+    result["history_peak_mb"] = peak_memory(lambda: db.get_sensor_history(mac))
+    result["history_columns_ms"] = median_time(lambda: db.get_sensor_history_columns(mac), args.repeat) * 1e3
+    result["history_columns_peak_mb"] = peak_memory(lambda: db.get_sensor_history_columns(mac))
+
+    # Destructive, so it runs once and last
+    start = time.perf_counter()
+    db.trim_sensor_data(time_period_hours=hours / 2.0)
+    result["trim_ms"] = (time.perf_counter() - start) * 1e3
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline
+    :return: A list of regression descriptions
+    """
+    regressions = []
+    for size, metrics in results.items():
+        base_metrics = baseline.get("results", {}).get(size)
+        if base_metrics is None:
+            print(f"{size}: not in the baseline")
+            continue
+        for name, value in metrics.items():
+            base = base_metrics.get(name)
+            if name in ("rows", "db_mb") or base is None or base <= 0:
+                continue
+            change = (value - base) / base
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{size} {name}: {base:.3f} -> {value:.3f} ({change * 100.0:+.0f}%)")
+            print(f"  {size:>5s} {name:25s} {base:12.3f} {value:12.3f} {change * 100.0:+7.0f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SensorDB benchmarks at production data sizes")
+    parser.add_argument("--sizes", default="1h,24h", help="Comma separated DB sizes, e.g. 1h,24h,7d")
+    parser.add_argument("--sensors", type=int, default=11, help="Number of sensors")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between samples of a sensor")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per timing (the median is reported)")
+    parser.add_argument("--batch", type=int, default=100, help="Samples per add_sensor_data_batch() call")
+    parser.add_argument("--out", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, as a fraction")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the baseline")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic DBs")
+    args = parser.parse_args()
+
+    Configuration.load_configuration()
+    if Configuration.get_configuration() is None:
+        print("Run from the folder containing sensor_app.conf")
+        return 2
+
+    folder = tempfile.mkdtemp(prefix="bench_sensor_db_")
+    results = {}
+    try:
+        for size in args.sizes.split(","):
+            results[size] = bench_size(folder, size.strip(), args)
+    finally:
+        if args.keep:
+            print(f"Synthetic DBs kept in {folder}")
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": str(datetime.datetime.now()),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sensors": args.sensors,
+            "sample_interval": args.sample_interval,
+            "repeat": args.repeat,
+            "batch": args.batch,
+        },
+        "results": results,
+    }
+    for size, metrics in results.items():
+        print(f"{size}: " + ", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}"
+                                      for k, v in metrics.items()))
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline {args.baseline}. Use --save-baseline to create one.")
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    print(f"Compared with the baseline of {baseline['meta']['time']} ({baseline['meta']['machine']}), "
+          f"threshold {args.threshold * 100.0:.0f}%")
+    regressions = compare(results, baseline, args.threshold)
+    if len(regressions) > 0:
+        print(f"{len(regressions)} regression(s):")
+        for r in regressions:
+            print(f"  {r}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#
+# bench_timestamp_decode.py - Compare ways of decoding SensorData.data_time
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# data_time is stored as str(datetime), e.g. "2023-05-01 13:45:10.123456".
+# When the microseconds are zero there is no fraction. This benchmark
+# decodes a day's worth of such strings with each candidate approach and
+# reports the time per 1000 records.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_timestamp_decode.py [record_count]
+#
+
+
+import os
+import sys
+import datetime
+import sqlite3
+import time
+
+# Run from the project root or from the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sensor_history_columns import SensorHistoryColumns
+
+
+def make_data_times(count):
+    """
+    Generate data_time strings one second apart, some without a fraction
+    :param count: Number of strings
+    :return: A list of str
+    """
+    start = datetime.datetime(2023, 5, 1)
+    data_times = []
+    for i in range(count):
+        dt = start + datetime.timedelta(seconds=i, microseconds=(i * 7919) % 1000000 if i % 10 else 0)
+        data_times.append(str(dt))
+    return data_times
+
+
+def decode_strptime(data_times):
+    """
+    The original decoding: strptime with one of two formats, then relative
+    hours computed in a second loop
+    """
+    result = []
+    for v in data_times:
+        if "." in v:
+            result.append(datetime.datetime.strptime(v, "%Y-%m-%d %H:%M:%S.%f"))
+        else:
+            result.append(datetime.datetime.strptime(v, "%Y-%m-%d %H:%M:%S"))
+    start_time = result[0]
+    hours = []
+    for dt in result:
+        delta = dt - start_time
+        hours.append(float((delta.days * 3600.0 * 24.0) + delta.seconds) / 3600.0)
+    return hours
+
+
+def decode_fromisoformat(data_times):
+    """
+    datetime.fromisoformat per record, relative hours in the same pass
+    """
+    parse = datetime.datetime.fromisoformat
+    start_time = parse(data_times[0])
+    return [(parse(v) - start_time).total_seconds() / 3600.0 for v in data_times]
+
+
+def decode_columns(data_times):
+    """
+    The SensorHistoryColumns batch path used by SensorDB
+    """
+    rows = [(i, 20.0, 40.0, 1000.0, v) for i, v in enumerate(data_times)]
+    history = SensorHistoryColumns()
+    history.append_rows(rows)
+    return history.relative_hours()
+
+
+def decode_numpy(data_times):
+    """
+    Vectorized parsing into datetime64 (only if NumPy is installed)
+    """
+    import numpy
+    us = numpy.array(data_times, dtype="datetime64[us]").astype("int64")
+    return (us - us[0]) / 3.6e9
+
+
+def query_sqlite(data_times, detect_types):
+    """
+    Read the strings back from SQLite, optionally with the timestamp converter
+    """
+    conn = sqlite3.connect(":memory:", detect_types=detect_types)
+    conn.execute("CREATE TABLE t (data_time timestamp)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(v,) for v in data_times])
+    start = time.perf_counter()
+    values = [r[0] for r in conn.execute("SELECT data_time FROM t")]
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return values, elapsed
+
+
+def time_it(fn, data_times, repeat=3):
+    """
+    Best of several runs
+    :return: Elapsed seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data_times)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 86400
+    data_times = make_data_times(count)
+    print(f"Decoding {count} data_time values (best of 3, ms per 1000 records)")
+
+    results = {
+        "strptime + relative hours loop (original)": time_it(decode_strptime, data_times),
+        "fromisoformat + relative hours": time_it(decode_fromisoformat, data_times),
+        "SensorHistoryColumns.append_rows": time_it(decode_columns, data_times),
+    }
+    try:
+        results["numpy datetime64"] = time_it(decode_numpy, data_times)
+    except ImportError:
+        print("NumPy is not installed, skipping datetime64")
+
+    # The sqlite3 converter runs inside the cursor, so it is measured as
+    # the extra cost over reading plain strings
+    _, plain = query_sqlite(data_times, 0)
+    values, converted = query_sqlite(data_times, sqlite3.PARSE_DECLTYPES)
+    results["sqlite3 PARSE_DECLTYPES converter (over plain read)"] = max(converted - plain, 0.0)
+
+    baseline = results["strptime + relative hours loop (original)"]
+    for name, elapsed in results.items():
+        per_1000 = elapsed * 1000.0 * 1000.0 / count
+        print(f"  {name:55s} {per_1000:8.3f} ms  x{baseline / elapsed if elapsed > 0 else 0.0:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#
+# soak_test.py - Accelerated clock soak test for memory and DB growth
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Runs a headless SensorDataSourceHandler with the test mode load generator
+# under a ScaledClock (see sensor_clock.py), so --hours of ingestion take
+# --hours * 3600 / --speed real seconds. Each emulated tag reports --tag-rate
+# samples per simulated second. Like the GUI, the test
+#   - refreshes a sensor list snapshot every --refresh real seconds
+#   - trims the DB every simulated hour
+#   - reads one sensor's history through a SensorHistoryCache every simulated hour
+# Every simulated hour it records RSS, Python heap (tracemalloc), DB and WAL
+# file sizes, row count, trim and history latency, UI refresh time and DB
+# writer lag, so growth and latency drift over the run stand out. At the end
+# the allocation sites that grew the most since the first hour are listed.
+#
+# Usage (from the project root, where sensor_app.conf is):
+#   python benchmarks/soak_test.py [--hours 24] [--speed 360] [--sensors 11]
+#       [--tag-rate 1.0] [--refresh 1.0] [--top 10] [--no-tracemalloc] [--out soak.json]
+#
+
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Run from the project root or from the benchmarks folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from configuration import Configuration
+import sensor_clock
+from sensor_clock import ScaledClock
+from sensor_data_source_handler import SensorDataSourceHandler
+from sensor_history_cache import SensorHistoryCache
+
+
+def rss_mb():
+    """
+    Current resident set size. Falls back to the peak where /proc is not available.
+    :return: MB
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB elsewhere
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def file_mb(path):
+    return os.path.getsize(path) / (1024.0 * 1024.0) if os.path.isfile(path) else 0.0
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[int(p * (len(values) - 1))]
+
+
+def refresh_ui(data_source):
+    """
+    What the GUI does on every update: check for changes, snapshot the
+    sensor list and work out how long ago each sensor reported
+    :return: None
+    """
+    data_source.pending_changes
+    now = sensor_clock.now()
+    sensor_list = data_source.lock_sensor_list()
+    ages = [(now - data["timestamp"]).total_seconds() for data in sensor_list.values()]
+    data_source.unlock_sensor_list()
+    data_source.get_sensor_versions()
+    return ages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accelerated clock soak test")
+    parser.add_argument("--hours", type=float, default=24.0, help="Simulated hours of ingestion")
+    parser.add_argument("--speed", type=float, default=360.0, help="Simulated seconds per real second")
+    parser.add_argument("--sensors", type=int, default=11, help="Number of emulated tags")
+    parser.add_argument("--tag-rate", type=float, default=1.0, help="Samples per simulated second per tag")
+    parser.add_argument("--refresh", type=float, default=1.0, help="Real seconds between UI refreshes")
+    parser.add_argument("--top", type=int, default=10, help="Allocation sites to list")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Do not trace Python allocations")
+    parser.add_argument("--keep-db", action="store_true", help="Keep the soak DB")
+    parser.add_argument("--out", default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    Configuration.load_configuration()
+    config = Configuration.get_configuration()
+    if config is None:
+        print("Run from the folder containing sensor_app.conf")
+        return 2
+
+    folder = tempfile.mkdtemp(prefix="soak_test_")
+    db_path = os.path.join(folder, "soak.sqlite3")
+    config[Configuration.CFG_SENSOR_DATABASE] = db_path
+    config[Configuration.CFG_HTTP_API_PORT] = 0
+    config[Configuration.CFG_FORWARD_URL] = ""
+    config[Configuration.CFG_CAPTURE_FILE] = ""
+    config[Configuration.CFG_REPLAY_FILE] = ""
+    config[Configuration.CFG_USE_TEST_DATA] = "true"
+    config[Configuration.CFG_TEST_SENSOR_COUNT] = args.sensors
+    config[Configuration.CFG_TEST_SAMPLE_RATE] = args.tag_rate * args.speed
+    config[Configuration.CFG_TEST_SEED] = 1
+    config[Configuration.CFG_TEST_BURST_INTERVAL] = 0.0
+    config[Configuration.CFG_TEST_DUPLICATE_RATIO] = 0.0
+
+    trace = not args.no_tracemalloc
+    if trace:
+        tracemalloc.start()
+    clock = ScaledClock(speed=args.speed)
+    previous_clock = sensor_clock.set_clock(clock)
+    sim_start = clock.now()
+    real_start = time.perf_counter()
+    print(f"Simulating {args.hours:g} h of {args.sensors} tags at {args.tag_rate:g} samples/s "
+          f"({args.sensors * args.tag_rate * args.speed:.0f} samples/s real) "
+          f"in {args.hours * 3600.0 / args.speed / 60.0:.1f} min")
+    print(f"{'hour':>4s} {'real s':>7s} {'samples':>8s} {'rows':>9s} {'db MB':>7s} {'wal MB':>7s} "
+          f"{'rss MB':>7s} {'heap MB':>7s} {'trim ms':>8s} {'hist ms':>8s} {'ui p99 ms':>9s} "
+          f"{'lag p50 ms':>10s} {'lag p99 ms':>10s} {'dropped':>7s}")
+
+    data_source = SensorDataSourceHandler()
+    history_cache = SensorHistoryCache()
+    hours = []
+    first_snapshot = None
+    macs = []
+    try:
+        data_source.open_data_source()
+        hour = 0
+        sim_hours = 0.0
+        delivered = 0
+        refresh_times = []
+        lags = []
+        while sim_hours < args.hours:
+            time.sleep(args.refresh)
+            start = time.perf_counter()
+            refresh_ui(data_source)
+            refresh_times.append(time.perf_counter() - start)
+            stats = data_source.bus_stats.get("db_writer", {})
+            lags.append(stats.get("last_lag", 0.0))
+
+            sim_hours = (clock.now() - sim_start).total_seconds() / 3600.0
+            if int(sim_hours) <= hour:
+                continue
+            # If the hourly work fell behind the clock, hours are skipped
+            first_hour = hour == 0
+            hour = int(sim_hours)
+
+            # Hourly maintenance, as the GUI and collector do it
+            start = time.perf_counter()
+            data_source.trim_sensor_data()
+            trim_ms = (time.perf_counter() - start) * 1e3
+
+            if len(macs) == 0:
+                sensor_list = data_source.lock_sensor_list()
+                macs = sorted(sensor_list.keys())
+                data_source.unlock_sensor_list()
+            history_ms = 0.0
+            if len(macs) > 0:
+                start = time.perf_counter()
+                history_cache.get_sensor_history(macs[hour % len(macs)])
+                history_ms = (time.perf_counter() - start) * 1e3
+
+            conn = sqlite3.connect(db_path)
+            rows = conn.execute("SELECT COUNT(*) FROM SensorData").fetchone()[0]
+            conn.close()
+            record = {
+                "hour": hour,
+                "real_s": time.perf_counter() - real_start,
+                "samples": stats.get("delivered", 0) - delivered,
+                "rows": rows,
+                "db_mb": file_mb(db_path),
+                "wal_mb": file_mb(db_path + "-wal"),
+                "rss_mb": rss_mb(),
+                "heap_mb": tracemalloc.get_traced_memory()[0] / (1024.0 * 1024.0) if trace else None,
+                "trim_ms": trim_ms,
+                "history_ms": history_ms,
+                "ui_refresh_p99_ms": percentile(refresh_times, 0.99) * 1e3,
+                "db_lag_p50_ms": percentile(lags, 0.50) * 1e3,
+                "db_lag_p99_ms": percentile(lags, 0.99) * 1e3,
+                "dropped": stats.get("dropped", 0),
+            }
+            delivered = stats.get("delivered", 0)
+            refresh_times = []
+            lags = []
+            hours.append(record)
+            print(f"{hour:4d} {record['real_s']:7.1f} {record['samples']:8d} {rows:9d} {record['db_mb']:7.1f} "
+                  f"{record['wal_mb']:7.1f} {record['rss_mb']:7.1f} "
+                  f"{record['heap_mb'] if trace else 0.0:7.1f} {trim_ms:8.1f} {history_ms:8.1f} "
+                  f"{record['ui_refresh_p99_ms']:9.3f} {record['db_lag_p50_ms']:10.1f} "
+                  f"{record['db_lag_p99_ms']:10.1f} {record['dropped']:7d}")
+            # Growth is measured from the end of the first hour, after warm up
+            if trace and first_hour:
+                first_snapshot = tracemalloc.take_snapshot()
+    except KeyboardInterrupt:
+        print("Interrupted")
+    finally:
+        data_source.close_data_source()
+        sensor_clock.set_clock(previous_clock)
+
+    top = []
+    if trace and first_snapshot is not None:
+        snapshot = tracemalloc.take_snapshot()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        growth = snapshot.filter_traces(filters).compare_to(first_snapshot.filter_traces(filters), "lineno")
+        print(f"Largest allocation growth since hour {hours[0]['hour']}:")
+        for stat in growth[:args.top]:
+            frame = stat.traceback[0]
+            top.append({"site": f"{frame.filename}:{frame.lineno}", "size_diff_kb": stat.size_diff / 1024.0,
+                        "size_kb": stat.size / 1024.0, "count_diff": stat.count_diff})
+            print(f"  {frame.filename}:{frame.lineno} {stat.size_diff / 1024.0:+.1f} KB "
+                  f"({stat.size / 1024.0:.1f} KB, {stat.count_diff:+d} blocks)")
+        tracemalloc.stop()
+
+    if len(hours) > 1:
+        first = hours[0]
+        last = hours[-1]
+        span = last["hour"] - first["hour"]
+        print(f"Drift from hour {first['hour']} to {last['hour']}: "
+              f"RSS {(last['rss_mb'] - first['rss_mb']) / span:+.2f} MB/h, "
+              f"trim {first['trim_ms']:.1f} -> {last['trim_ms']:.1f} ms, "
+              f"history {first['history_ms']:.1f} -> {last['history_ms']:.1f} ms, "
+              f"DB lag p99 {first['db_lag_p99_ms']:.1f} -> {last['db_lag_p99_ms']:.1f} ms")
+
+    if args.out is not None:
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "machine": platform.machine(),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "hours": args.hours,
+                "speed": args.speed,
+                "sensors": args.sensors,
+                "tag_rate": args.tag_rate,
+                "tracemalloc": trace,
+            },
+            "hours": hours,
+            "top_allocations": top,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.keep_db:
+        print(f"Soak DB kept in {folder}")
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
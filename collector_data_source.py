@@ -0,0 +1,183 @@
+#
+# collector_data_source.py - Data source for a GUI fed by sensor_collector.py
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# When the sensor collector runs as its own process, the GUI does not
+# receive sensor data. Instead, this class follows the sensor DB the
+# collector writes. It has the same interface as SensorDataSourceHandler
+# (both are SensorDataSources), so the GUI can't tell the difference.
+#
+# When the collector publishes a shared memory table of the latest values,
+# the sensor list is refreshed from that table and the DB is only queried
+# while there are live sample listeners (e.g. an open history frame).
+#
+
+
+from threading import Thread, Event
+from configuration import Configuration
+from sensor_data_source import SensorDataSource
+from sensor_db import SensorDB
+from shared_sensor_table import SharedSensorTable
+
+
+class CollectorDataSource(SensorDataSource):
+    """
+    Client side data source that follows the DB written by the collector
+    """
+    def __init__(self):
+        super().__init__()
+        self._sensor_db = SensorDB()
+        self._poll_interval = float(self._config[Configuration.CFG_UPDATE_INTERVAL])
+        self._last_id = 0
+        self._poll_thread = None
+        self._terminate = Event()
+        # Shared memory latest values published by the collector
+        self._shared_table_name = self._config.get(Configuration.CFG_SHARED_TABLE_NAME,
+                                                   SharedSensorTable.DEFAULT_NAME)
+        self._shared_table = None
+        self._shared_versions = {}
+        self._resync_last_id = False
+
+    def open_data_source(self):
+        """
+        Load the latest sample of each sensor and start following the DB
+        :return: None
+        """
+        latest = self._sensor_db.get_latest_sensor_data()
+        if latest is not None and len(latest) > 0:
+            self._record_samples([(data["mac"], data) for data in latest])
+            self._last_id = max(self._last_id, max(data["id"] for data in latest))
+
+        self._attach_shared_table()
+        self._poll_thread = Thread(target=self._poll, name="CollectorDataSource")
+        self._poll_thread.start()
+        self._logger.info("Collector data source opened")
+
+    def close_data_source(self):
+        self._terminate.set()
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+        if self._shared_table is not None:
+            self._shared_table.close()
+            self._shared_table = None
+        self._logger.info("Collector data source closed")
+
+    def trim_sensor_data(self):
+        """
+        The collector owns the DB and trims it, so there is nothing to do here
+        :return: None
+        """
+        pass
+
+    def _poll(self):
+        """
+        Periodically pick up the samples the collector has added to the DB
+        :return: None
+        """
+        while not self._terminate.wait(self._poll_interval):
+            try:
+                if self._shared_table is None or not self._shared_table.live:
+                    self._attach_shared_table()
+
+                if self._shared_table is not None:
+                    self._update_from_shared_table()
+                    # The DB is only needed for the full sample stream
+                    if self._has_listeners():
+                        self._poll_db(update_sensor_list=False)
+                else:
+                    self._poll_db(update_sensor_list=True)
+            except Exception as ex:
+                self._logger.error("Unhandled exception caught in CollectorDataSource._poll()")
+                self._logger.error(str(ex))
+
+    def _poll_db(self, update_sensor_list):
+        """
+        Pick up the samples added to the DB since the last poll
+        :param update_sensor_list: True if the sensor list is updated from the DB
+        :return: None
+        """
+        if self._resync_last_id:
+            # The DB was not followed for a while. Start from the newest sample.
+            self._resync_last_id = False
+            latest = self._sensor_db.get_latest_sensor_data()
+            if latest is not None and len(latest) > 0:
+                self._last_id = max(self._last_id, max(data["id"] for data in latest))
+
+        new_data = self._sensor_db.get_sensor_data_since(self._last_id)
+        if new_data is not None and len(new_data) > 0:
+            samples = [(data["mac"], data) for data in new_data]
+            if update_sensor_list:
+                self._record_samples(samples)
+            self._last_id = max(self._last_id, new_data[-1]["id"])
+            self._notify_listeners(samples)
+
+    def _attach_shared_table(self):
+        """
+        Attach to the collector's shared memory table, if there is one
+        :return: None
+        """
+        if self._shared_table is not None:
+            self._shared_table.close()
+            self._shared_table = None
+            self._shared_versions = {}
+            # Back to following the DB, which was not followed for the sensor list
+            self._resync_last_id = True
+        if not self._shared_table_name:
+            return
+        try:
+            self._shared_table = SharedSensorTable.attach(name=self._shared_table_name)
+            self._logger.info(f"Attached to shared sensor table {self._shared_table_name}")
+        except (FileNotFoundError, ValueError):
+            self._shared_table = None
+
+    def _update_from_shared_table(self):
+        """
+        Record the sensors whose row in the shared table has changed
+        :return: None
+        """
+        changed = []
+        for mac, data in self._shared_table.read_all().items():
+            if self._shared_versions.get(mac) != data["version"]:
+                self._shared_versions[mac] = data["version"]
+                changed.append(data)
+        if len(changed) > 0:
+            self._record_samples([(data["mac"], data) for data in changed])
+
+    def add_sample_listener(self, listener):
+        """
+        Register an observer of the live sample stream. The listener is
+        called on the polling thread.
+        :param listener: A callable taking (mac, data)
+        :return: None
+        """
+        if not self._has_listeners() and self._shared_table is not None:
+            # The DB has not been followed while there were no listeners
+            self._resync_last_id = True
+        super().add_sample_listener(listener)
+
+    def reset_sensor_list(self):
+        """
+        Reset the sensor list to allow a clean restart
+        @return:
+        """
+        self.lock_sensor_list()
+        self._sensor_list = {}
+        self._shared_versions = {}
+        latest = self._sensor_db.get_latest_sensor_data()
+        if latest is not None:
+            for data in latest:
+                self._sensor_list[data["mac"]] = data
+        self._data_version += 1
+        self.unlock_sensor_list()
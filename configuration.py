@@ -54,6 +54,29 @@ class Configuration():
     CFG_DISPLAY_BRIGHTNESS = "display_brightness"
     CFG_SENSOR_DATABASE = "sensor_database"
     CFG_DATABASE_TIMEOUT = "database_timeout"
+    CFG_HISTORY_CACHE_MAX_ROWS = "history_cache_max_rows"  # across all cached sensors
+    CFG_DATA_SOURCE = "data_source"  # local (default) or collector
+    CFG_SHARED_TABLE_NAME = "shared_table_name"  # shared memory latest values, empty to disable
+    CFG_HTTP_API_PORT = "http_api_port"  # 0 (default) disables the HTTP API
+    CFG_FORWARD_URL = "forward_url"  # empty (default) disables forwarding
+    CFG_FORWARD_FORMAT = "forward_format"  # json (default) or line
+    CFG_FORWARD_BATCH_SIZE = "forward_batch_size"
+    CFG_FORWARD_INTERVAL = "forward_interval"  # in seconds
+    CFG_FORWARD_SPOOL_MAX_BYTES = "forward_spool_max_bytes"
+    CFG_TEST_SENSOR_COUNT = "test_sensor_count"  # 0 (default) emulates the configured ruuvitags
+    CFG_TEST_SAMPLE_RATE = "test_sample_rate"  # per sensor, 0 (default) is 2 samples/s in total
+    CFG_TEST_BURST_INTERVAL = "test_burst_interval"  # in seconds, 0 (default) disables bursts
+    CFG_TEST_BURST_DURATION = "test_burst_duration"  # in seconds
+    CFG_TEST_BURST_FACTOR = "test_burst_factor"
+    CFG_TEST_DUPLICATE_RATIO = "test_duplicate_ratio"
+    CFG_TEST_LOSS_RATIO = "test_loss_ratio"
+    CFG_TEST_SEED = "test_seed"  # null (default) for random test data
+    CFG_CAPTURE_FILE = "capture_file"  # empty (default) disables capturing raw sensor data
+    CFG_REPLAY_FILE = "replay_file"  # a capture file replayed instead of receiving sensor data
+    CFG_REPLAY_SPEED = "replay_speed"  # 1.0 (default) is real time, 0 is maximum speed
+    CFG_RECEPTION_STATS_PERIOD = "reception_stats_period"  # in seconds, 0 disables
+    CFG_PROFILER_SAMPLE_RATE = "profiler_sample_rate"  # stack samples per second, default 100
+    CFG_SLOW_QUERY_THRESHOLD_MS = "slow_query_threshold_ms"  # default 200, 0 disables the slow query log
 
     def __init__(self):
         Configuration.load_configuration()
@@ -14,45 +14,167 @@
 # You should have received a copy of the GNU General Public License
 # along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
 #
+# Test mode load can be shaped with these optional configuration keys:
+#   test_sensor_count      Number of sensors to emulate. Sensors beyond the
+#                          configured ruuvitags get made up macs. 0 (default)
+#                          emulates the configured ruuvitags.
+#   test_sample_rate       Samples per second per sensor. 0 (default) gives
+#                          2 samples per second across all sensors.
+#   test_burst_interval    Every this many seconds (0, the default, disables)...
+#   test_burst_duration    ...for this many seconds...
+#   test_burst_factor      ...the sample rate is multiplied by this factor.
+#   test_duplicate_ratio   Fraction of samples that are received twice, like a
+#                          rebroadcast advertisement (same measurement sequence
+#                          number).
+#   test_loss_ratio        Fraction of measurements that are never received
+#                          (their sequence numbers are skipped).
+#   test_seed              Seed for repeatable data. null (default) is random.
+#
+# Temperature and humidity are random walks. When NumPy is installed they are
+# generated in vectorized blocks, one block per tick, so the generator can
+# sustain thousands of samples per second. Each emulated tag has its own
+# RSSI level, weaker for tags further down the list.
+#
 
 
-from time import sleep
-from datetime import datetime, timedelta
 import random
 import logging
-from time import sleep
+import time
 from threading import Thread
 from sensor_utils import to_fahrenheit
 from configuration import Configuration
+import sensor_clock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class DummySensorAdapter(Thread):
     """
     This class serves as both a test dummy and a base class for sensor adapters.
     """
+    # Samples are generated in a block every tick (seconds)
+    TICK_INTERVAL = 0.1
+    # Total samples per second when no rate is configured
+    DEFAULT_TOTAL_RATE = 2.0
+    # Random walk steps per sample (C and %)
+    TEMPERATURE_STEP = 0.5
+    HUMIDITY_STEP = 1.0
+
     def __init__(self, handle_sensor_data=None):
         self._handle_sensor_data = handle_sensor_data
         self._terminate = False
         self._logger = logging.getLogger("sensor_app")
         self._config = Configuration.get_configuration()
-        self._sensor_list = []
-        # Keyed by mac
-        self._sensor_data_control = {}
-        random.seed()
+        self._temperature_format = self._config[Configuration.CFG_TEMPERATURE_FORMAT].lower()
+        self._sensor_list = self._create_sensor_list()
+
+        sensor_count = len(self._sensor_list)
+        rate = float(self._config.get(Configuration.CFG_TEST_SAMPLE_RATE, 0.0))
+        if rate <= 0.0:
+            rate = DummySensorAdapter.DEFAULT_TOTAL_RATE / max(sensor_count, 1)
+        self._sample_rate = rate
+        self._burst_interval = float(self._config.get(Configuration.CFG_TEST_BURST_INTERVAL, 0.0))
+        self._burst_duration = float(self._config.get(Configuration.CFG_TEST_BURST_DURATION, 0.0))
+        self._burst_factor = float(self._config.get(Configuration.CFG_TEST_BURST_FACTOR, 1.0))
+        self._duplicate_ratio = float(self._config.get(Configuration.CFG_TEST_DUPLICATE_RATIO, 0.0))
+        self._loss_ratio = float(self._config.get(Configuration.CFG_TEST_LOSS_RATIO, 0.0))
+        seed = self._config.get(Configuration.CFG_TEST_SEED, None)
+
+        # Random walk state and measurement sequence numbers, indexed like _sensor_list
+        self._random = random.Random(seed)
+        if numpy is not None:
+            self._rng = numpy.random.default_rng(seed)
+            self._temps = self._rng.random(sensor_count) * 30.0  # 30C = 86F
+            self._humids = self._rng.random(sensor_count) * 80.0  # %
+        else:
+            self._rng = None
+            self._temps = [self._random.random() * 30.0 for _ in range(sensor_count)]
+            self._humids = [self._random.random() * 80.0 for _ in range(sensor_count)]
+        self._sequence_numbers = [self._random.randint(0, 65535) for _ in range(sensor_count)]
+        # Position of the next sample in the round robin over all sensors
+        self._position = 0
+
+        super().__init__(name="DummySensorAdapter")
+
+    def _create_sensor_list(self):
+        """
+        The macs of the emulated sensors
+        :return: A list of macs
+        """
+        sensor_list = list(self._config[Configuration.CFG_RUUVITAGS].keys())
+        sensor_count = int(self._config.get(Configuration.CFG_TEST_SENSOR_COUNT, 0))
+        if sensor_count <= 0:
+            return sensor_list
+        if sensor_count <= len(sensor_list):
+            return sensor_list[:sensor_count]
+        for i in range(len(sensor_list), sensor_count):
+            sensor_list.append(f"DA:7A:00:00:{i // 256:02X}:{i % 256:02X}")
+        return sensor_list
 
-        super().__init__()
+    def _generate_block(self, count):
+        """
+        Advance the random walks for the next count samples in round robin order
+        :param count: Number of samples
+        :return: A list of (sensor index, temperature C, humidity) tuples
+        """
+        sensor_count = len(self._sensor_list)
+        offset = self._position % sensor_count
+        rounds = (offset + count + sensor_count - 1) // sensor_count
+        self._position += count
+
+        if self._rng is not None:
+            # One row per round over all sensors. A step past the end of the
+            # block advances the walk without being reported, which is harmless.
+            temp_steps = self._rng.uniform(-DummySensorAdapter.TEMPERATURE_STEP, DummySensorAdapter.TEMPERATURE_STEP,
+                                           (rounds, sensor_count))
+            humid_steps = self._rng.uniform(-DummySensorAdapter.HUMIDITY_STEP, DummySensorAdapter.HUMIDITY_STEP,
+                                            (rounds, sensor_count))
+            temps = numpy.clip(self._temps + numpy.cumsum(temp_steps, axis=0), -40.0, 85.0)
+            humids = numpy.clip(self._humids + numpy.cumsum(humid_steps, axis=0), 0.0, 100.0)
+            self._temps = temps[-1]
+            self._humids = humids[-1]
+            indexes = numpy.arange(offset, offset + count) % sensor_count
+            return zip(indexes.tolist(),
+                       temps.reshape(-1)[offset:offset + count].tolist(),
+                       humids.reshape(-1)[offset:offset + count].tolist())
 
-    def _generate_ruuvi_data(self, mac):
+        block = []
+        for position in range(offset, offset + count):
+            i = position % sensor_count
+            t = self._temps[i] + self._random.uniform(-DummySensorAdapter.TEMPERATURE_STEP,
+                                                      DummySensorAdapter.TEMPERATURE_STEP)
+            h = self._humids[i] + self._random.uniform(-DummySensorAdapter.HUMIDITY_STEP,
+                                                       DummySensorAdapter.HUMIDITY_STEP)
+            self._temps[i] = min(max(t, -40.0), 85.0)
+            self._humids[i] = min(max(h, 0.0), 100.0)
+            block.append((i, self._temps[i], self._humids[i]))
+        return block
+
+    def _generate_ruuvi_data(self, i, temperature, humidity, timestamp):
         """
         Generate dummy data for a single ruuvi tag
-        :return:
+        :param i: Index of the sensor in the sensor list
+        :param temperature: Temperature in C
+        :param humidity: Humidity in %
+        :param timestamp: Reception time
+        :return: None
         """
+        mac = self._sensor_list[i]
+        self._sequence_numbers[i] = (self._sequence_numbers[i] + 1) % 65536
+        if self._loss_ratio > 0.0 and self._random.random() < self._loss_ratio:
+            # Never received
+            return
+        if self._temperature_format == "f":
+            temperature = to_fahrenheit(temperature)
         data = {
             "name": "",
-            "timestamp": self._random_timestamp(),
+            "timestamp": timestamp,
             "data_format": 5,
-            "humidity": self._random_humid(mac),
-            "temperature": to_fahrenheit(self._random_temp(mac)),
+            "humidity": humidity,
+            "temperature": temperature,
             "pressure": 1008.72,
             "acceleration": 1018.2416216203303,
             "acceleration_x": -168,
@@ -61,7 +183,8 @@ class DummySensorAdapter(Thread):
             "tx_power": 4,
             "battery": 3027,
             "movement_counter": 43,
-            "measurement_sequence_number": 26017,
+            "measurement_sequence_number": self._sequence_numbers[i],
+            "rssi": -55 - 4 * (i % 10) + self._random.randint(-3, 3),
             "mac": mac,
             "sequence": 1,
         }
@@ -69,48 +192,20 @@ class DummySensorAdapter(Thread):
         # Notify observer
         if self._handle_sensor_data is not None:
             self._handle_sensor_data(mac, data)
-            self._logger.debug(f"Dummy data generated for {mac}")
-
-    def _random_temp(self, mac):
-        """
-        Generate a random temperature in C
-        :return:
-        """
-        # r is 0 <= r < 0.5 C
-        r = random.random() * 0.5
-        # Choose a sign for the change
-        if random.random() > 0.5:
-            r = r * -1.0
-        self._sensor_data_control[mac]["temp"] = self._sensor_data_control[mac]["temp"] + r
-        return self._sensor_data_control[mac]["temp"]
-
-    def _random_humid(self, mac):
-        """
-        Generate a random humidity
-        :return:
-        """
-        # r is 0 <= r < 1.0
-        r = random.random()
-        # Choose a sign for the change
-        if random.random() >= 0.5:
-            sign = 1.0
-        else:
-            sign = -1.0
-        self._sensor_data_control[mac]["humid"] = self._sensor_data_control[mac]["humid"] + (r * sign)
-        if self._sensor_data_control[mac]["humid"] > 100.0:
-            self._sensor_data_control[mac]["humid"] = 100.0
-        return self._sensor_data_control[mac]["humid"]
+            # A rebroadcast of the same measurement
+            if self._duplicate_ratio > 0.0 and self._random.random() < self._duplicate_ratio:
+                self._handle_sensor_data(mac, dict(data))
 
-    def _random_timestamp(self):
+    def _current_rate(self, elapsed):
         """
-        Generate a random timestamp 0-5 seconds old
-        :return: Generated timestamp
+        The total sample rate, including any burst
+        :param elapsed: Seconds since generation started
+        :return: Samples per second
         """
-        r = random.random() * 5.0
-        if r > 4.5:
-            r = 5.0
-        now = datetime.now() - timedelta(seconds=r)
-        return now
+        rate = self._sample_rate * len(self._sensor_list)
+        if self._burst_interval > 0.0 and elapsed % self._burst_interval < self._burst_duration:
+            rate *= self._burst_factor
+        return rate
 
     def open(self):
         """
@@ -137,19 +232,27 @@ class DummySensorAdapter(Thread):
         Run random sensor data generation
         @return: None
         """
-        # Create list of sensors to be emulated
-        for mac, kvn in self._config[Configuration.CFG_RUUVITAGS].items():
-            self._sensor_list.append(mac)
-            tr = random.random() * 30.0  # 30C = 86F
-            hr = random.random() * 80.0  # %
-            self._sensor_data_control[mac] = {"temp": tr, "humid": hr}
+        if len(self._sensor_list) == 0:
+            self._logger.error("No sensors to emulate")
+            return
+        self._logger.info(f"Emulating {len(self._sensor_list)} sensors at {self._sample_rate:.3f} samples/s each "
+                          f"({'NumPy' if self._rng is not None else 'Python'} random walks)")
 
-        # Every time around update one randomly chosen sensor
+        start = time.monotonic()
+        last = start
+        due = 0.0
         while not self._terminate:
-            sensor = random.randint(0, len(self._sensor_list) - 1)
-            mac = self._sensor_list[sensor]
-            self._generate_ruuvi_data(mac)
-            sleep(0.5)
+            time.sleep(DummySensorAdapter.TICK_INTERVAL)
+            now = time.monotonic()
+            due += self._current_rate(now - start) * (now - last)
+            last = now
+            count = int(due)
+            if count == 0:
+                continue
+            due -= count
+            timestamp = sensor_clock.now()
+            for i, temperature, humidity in self._generate_block(count):
+                self._generate_ruuvi_data(i, temperature, humidity, timestamp)
 
     def terminate(self):
         """
@@ -0,0 +1,122 @@
+#
+# forward_sink_server.py - Stand-in endpoint for testing sensor_forwarder.py
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# Accepts the forwarder's gzip compressed POSTs, counts the samples and
+# prints the received rate every few seconds. It can pretend to be a flaky
+# link by failing a fraction of the requests or by going down periodically.
+#
+# Usage:
+#   python forward_sink_server.py [--port 8086] [--fail-rate 0.2] [--down 30/120] [--out samples.txt]
+#     --fail-rate  Fraction of requests answered with 503
+#     --down       Be down (drop connections) for the first N seconds of every M seconds
+#     --out        Append received lines to a file
+#
+# Then set "forward_url" to http://localhost:8086/write
+#
+
+
+import argparse
+import gzip
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+
+class _SinkState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = Lock()
+        self.start = time.monotonic()
+        self.requests = 0
+        self.failed = 0
+        self.samples = 0
+        self.bytes = 0
+        self.out = open(args.out, "a") if args.out else None
+
+    def is_down(self):
+        if self.args.down is None:
+            return False
+        down_for, period = self.args.down
+        return (time.monotonic() - self.start) % period < down_for
+
+
+class _SinkRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if state.is_down():
+            # Like a link that is down: no response at all
+            self.close_connection = True
+            self.connection.close()
+            return
+        if random.random() < state.args.fail_rate:
+            with state.lock:
+                state.failed += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        lines = body.decode("utf-8").splitlines()
+        with state.lock:
+            state.requests += 1
+            state.samples += len(lines)
+            state.bytes += length
+            if state.out is not None:
+                state.out.write("\n".join(lines) + "\n")
+                state.out.flush()
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_down(value):
+    down_for, period = value.split("/")
+    return float(down_for), float(period)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in endpoint for sensor_forwarder.py")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--down", type=_parse_down, default=None)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("", args.port), _SinkRequestHandler)
+    server.daemon_threads = True
+    server.state = _SinkState(args)
+    print(f"Listening on port {args.port}")
+    try:
+        Thread(target=server.serve_forever, daemon=True).start()
+        last_samples = 0
+        while True:
+            time.sleep(5.0)
+            state = server.state
+            with state.lock:
+                rate = (state.samples - last_samples) / 5.0
+                last_samples = state.samples
+                print(f"requests {state.requests} failed {state.failed} samples {state.samples} "
+                      f"bytes {state.bytes} ({rate:.1f} samples/s){' DOWN' if state.is_down() else ''}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#
+# process_data_source.py - Sensor data source running in a child process
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# With
+#   "data_source": "process"
+# the GUI app starts a child process that runs a SensorDataSourceHandler
+# (sensor adapter, DB writer, HTTP API, forwarder). BLE decoding and SQLite
+# commits then run on a different core than GUI rendering and do not contend
+# with it for the GIL.
+#
+# The child sends samples back over a pipe in batches, one every
+# BATCH_INTERVAL seconds at most. The parent keeps the sensor list and has the
+# same interface as SensorDataSourceHandler, so the GUI can't tell the
+# difference. reset_sensor_list() and trim_sensor_data() are passed on to the
+# child.
+#
+# The child also sends a snapshot of its stage metrics (see sensor_metrics.py),
+# bus metrics and reception quality every METRICS_INTERVAL seconds. They are
+# available from child_metrics, bus_stats and reception_stats.
+#
+# The child logs to sensor_process.log. It ignores SIGINT, so Ctrl-C in the
+# terminal stops the GUI, which then stops the child. If the GUI dies the
+# pipe is closed and the child stops on its own.
+#
+
+
+import logging
+import multiprocessing
+import signal
+import time
+from threading import Thread, Lock
+from configuration import Configuration
+from sensor_data_source import SensorDataSource
+import sensor_metrics
+
+
+# Messages from parent to child
+_CMD_STOP = "stop"
+_CMD_RESET = "reset"
+_CMD_TRIM = "trim"
+# Messages from child to parent
+_MSG_SAMPLES = "samples"
+_MSG_CLOSED = "closed"
+_MSG_METRICS = "metrics"
+
+
+def _run_child(conn):
+    """
+    Child process entry point. Runs the sensor data source until told to stop.
+    :param conn: The child's end of the pipe
+    :return: None
+    """
+    # Spawned, so nothing is inherited from the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Configuration.load_configuration()
+    import app_logger
+    app_logger.start("sensor_app", logfile="sensor_process.log")
+    logger = logging.getLogger("sensor_app")
+    logger.info("Sensor data source process starting...")
+    # kill -USR1 <child pid> profiles the child
+    import sensor_profiler
+    sensor_profiler.install_signal_handler()
+
+    from sensor_data_source_handler import SensorDataSourceHandler
+    data_source = SensorDataSourceHandler()
+    pending = []
+    pending_lock = Lock()
+
+    def _queue_sample(mac, data):
+        pending_lock.acquire()
+        pending.append((mac, data))
+        pending_lock.release()
+
+    def _send_pending():
+        nonlocal pending
+        pending_lock.acquire()
+        batch = pending
+        pending = []
+        pending_lock.release()
+        if len(batch) > 0:
+            conn.send((_MSG_SAMPLES, batch))
+
+    data_source.add_sample_listener(_queue_sample)
+    data_source.open_data_source()
+    metrics_sent = time.monotonic()
+    try:
+        while True:
+            try:
+                if conn.poll(ProcessDataSource.BATCH_INTERVAL):
+                    command = conn.recv()
+                    if command == _CMD_STOP:
+                        break
+                    elif command == _CMD_RESET:
+                        data_source.reset_sensor_list()
+                    elif command == _CMD_TRIM:
+                        data_source.trim_sensor_data()
+                _send_pending()
+                if time.monotonic() - metrics_sent >= ProcessDataSource.METRICS_INTERVAL:
+                    conn.send((_MSG_METRICS, sensor_metrics.snapshot(), data_source.bus_stats,
+                               data_source.reception_stats))
+                    metrics_sent = time.monotonic()
+            except (EOFError, OSError):
+                logger.error("Lost the connection to the parent process")
+                conn = None
+                break
+    finally:
+        # Deliver whatever the data source still has queued
+        data_source.close_data_source()
+        if conn is not None:
+            try:
+                _send_pending()
+                conn.send((_MSG_CLOSED,))
+            except (EOFError, OSError):
+                pass
+            conn.close()
+        sensor_profiler.stop_profiler(wait=True)
+        logger.info("Sensor data source process ended")
+        app_logger.shut_down()
+
+
+class ProcessDataSource(SensorDataSource):
+    """
+    Parent side of a sensor data source running in a child process
+    """
+    # Maximum time in seconds samples wait in the child before being sent
+    BATCH_INTERVAL = 0.2
+    # Time in seconds between metrics snapshots from the child
+    METRICS_INTERVAL = 1.0
+    # Time in seconds to wait for the child to stop
+    STOP_TIMEOUT = 30.0
+
+    def __init__(self):
+        super().__init__()
+        self._process = None
+        self._conn = None
+        self._conn_lock = Lock()
+        self._receiver = None
+        self._child_metrics = {}
+        self._child_bus_stats = {}
+        self._child_reception_stats = []
+
+    def open_data_source(self):
+        """
+        Start the child process and the thread receiving its samples
+        :return: None
+        """
+        # spawn, so the child does not inherit the GUI toolkit's state
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_run_child, args=(child_conn,), name="SensorDataSource")
+        self._process.start()
+        # The child has its own copy
+        child_conn.close()
+        self._receiver = Thread(target=self._receive, name="ProcessDataSource")
+        self._receiver.start()
+        self._logger.info(f"Data source process {self._process.pid} started")
+
+    def close_data_source(self):
+        """
+        Stop the child process after it has delivered its remaining samples
+        :return: None
+        """
+        self._send_command(_CMD_STOP)
+        self._receiver.join(ProcessDataSource.STOP_TIMEOUT)
+        self._process.join(ProcessDataSource.STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._logger.error("Data source process did not stop, terminating it")
+            self._process.terminate()
+            self._process.join()
+        self._conn.close()
+        self._logger.info("Data source closed")
+
+    def trim_sensor_data(self):
+        """
+        Trim aged data records. The child owns the DB, so it does the trimming.
+        :return: None
+        """
+        self._send_command(_CMD_TRIM)
+
+    def _send_command(self, command):
+        self._conn_lock.acquire()
+        try:
+            self._conn.send(command)
+        except (EOFError, OSError) as ex:
+            self._logger.error(f"Unable to send {command} to the data source process")
+            self._logger.error(str(ex))
+        finally:
+            self._conn_lock.release()
+
+    def _receive(self):
+        """
+        Receive samples from the child until it closes
+        :return: None
+        """
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                self._logger.error("Data source process ended unexpectedly")
+                break
+            if message[0] == _MSG_CLOSED:
+                break
+            if message[0] == _MSG_SAMPLES:
+                try:
+                    # Listeners are called on this thread
+                    self._record_samples(message[1])
+                    self._notify_listeners(message[1])
+                except Exception as ex:
+                    self._logger.error("Unhandled exception caught in ProcessDataSource._receive()")
+                    self._logger.error(str(ex))
+            elif message[0] == _MSG_METRICS:
+                self._child_metrics = message[1]
+                self._child_bus_stats = message[2]
+                self._child_reception_stats = message[3]
+
+    @property
+    def child_metrics(self):
+        """
+        The latest metrics snapshot of the child process (see sensor_metrics.snapshot())
+        :return: A dict of metric snapshots keyed by name. Empty until the first snapshot arrives.
+        """
+        return self._child_metrics
+
+    @property
+    def bus_stats(self):
+        """
+        The child's sample bus metrics, as of its latest metrics snapshot
+        :return: A dict of subscription metrics keyed by subscriber name
+        """
+        return self._child_bus_stats
+
+    @property
+    def reception_stats(self):
+        """
+        The child's reception quality figures, as of its latest metrics snapshot
+        :return: A list of dicts (see ReceptionStats.snapshot())
+        """
+        return self._child_reception_stats
+
+    def reset_sensor_list(self):
+        """
+        Reset the sensor list to allow a clean restart
+        @return:
+        """
+        super().reset_sensor_list()
+        # Sensor names may have been edited. The child looks them up again.
+        self._send_command(_CMD_RESET)
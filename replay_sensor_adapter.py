@@ -0,0 +1,139 @@
+#
+# replay_sensor_adapter.py - Sensor adapter that replays a capture file
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Plays back a capture recorded by SensorThread (see sensor_capture.py)
+# through the same handle_sensor_data path as live sensor data, so field
+# problems can be reproduced and the pipeline benchmarked without Bluetooth.
+# When "replay_file" is set, the data source uses this adapter instead of
+# SensorThread or DummySensorAdapter.
+#
+# "replay_speed" sets the pace: 1.0 (default) is real time, N is N times
+# faster and 0 is as fast as possible. Samples get the replay time as their
+# timestamp, like live samples.
+#
+
+
+import logging
+import time
+from threading import Thread, Event
+from configuration import Configuration
+from sensor_capture import read_capture
+from sensor_utils import prepare_sensor_data
+
+
+class ReplaySensorAdapter(Thread):
+    """
+    Replays a sensor data capture. Same interface as SensorThread.
+    """
+    # Longest sleep while waiting for the next sample, so terminate() is honored promptly
+    MAX_SLEEP = 0.5
+
+    def __init__(self, handle_sensor_data=None, capture_file=None, speed=None):
+        """
+        :param handle_sensor_data: A callable taking (mac, data)
+        :param capture_file: The capture to replay. The default is the configured replay_file.
+        :param speed: Replay speed. The default is the configured replay_speed.
+        """
+        self._handle_sensor_data = handle_sensor_data
+        self._logger = logging.getLogger("sensor_app")
+        self._config = Configuration.get_configuration()
+        self._temperature_format = self._config[Configuration.CFG_TEMPERATURE_FORMAT].lower()
+        self._capture_file = capture_file if capture_file is not None \
+            else self._config[Configuration.CFG_REPLAY_FILE]
+        self._speed = float(speed if speed is not None else self._config.get(Configuration.CFG_REPLAY_SPEED, 1.0))
+        self._terminate = Event()
+        self._finished = Event()
+        self._replayed = 0
+        super().__init__(name="ReplaySensorAdapter")
+
+    def open(self):
+        """
+        Start the replay on the thread
+        Returns:
+
+        """
+        self.start()
+
+    def close(self):
+        """
+        Terminate the replay thread. This method is intended to be
+        called from another (e.g. the originating) thread.
+        Returns:
+
+        """
+        self.terminate()
+        self._logger.info("Waiting for ReplaySensorAdapter to terminate")
+        self.join()
+        self._logger.info("ReplaySensorAdapter terminated")
+
+    def terminate(self):
+        """
+        Terminate the replay
+        Returns: None
+        """
+        self._terminate.set()
+
+    def wait_finished(self, timeout=None):
+        """
+        Wait for the end of the capture
+        :param timeout: Maximum wait in seconds
+        :return: True if the whole capture has been replayed (or the replay failed)
+        """
+        return self._finished.wait(timeout)
+
+    @property
+    def replayed(self):
+        """
+        The number of samples replayed so far
+        """
+        return self._replayed
+
+    def run(self):
+        """
+        Replay the capture, paced by the recorded arrival times
+        @return: None
+        """
+        self._logger.info(f"Replaying {self._capture_file} at "
+                          f"{'maximum' if self._speed <= 0 else f'{self._speed:g}x'} speed")
+        first_arrival = None
+        start = time.monotonic()
+        try:
+            for arrival, mac, data in read_capture(self._capture_file):
+                if self._terminate.is_set():
+                    break
+                if self._speed > 0:
+                    if first_arrival is None:
+                        first_arrival = arrival
+                    due = start + (arrival - first_arrival) / self._speed
+                    while not self._terminate.is_set():
+                        delay = due - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._terminate.wait(min(delay, ReplaySensorAdapter.MAX_SLEEP))
+                    if self._terminate.is_set():
+                        break
+
+                prepare_sensor_data(mac, data, self._temperature_format)
+                if self._handle_sensor_data is not None:
+                    self._handle_sensor_data(mac, data)
+                self._replayed += 1
+        except Exception as ex:
+            self._logger.error("Unhandled exception caught in ReplaySensorAdapter.run()")
+            self._logger.error(str(ex))
+        finally:
+            self._finished.set()
+            self._logger.info(f"Replay ended after {self._replayed} samples "
+                              f"in {time.monotonic() - start:.1f} s")
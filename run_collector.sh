@@ -0,0 +1,7 @@
+#!/bin/bash
+echo Start sensor-collector
+cd /home/pi/rpi/wx-sensor-app
+# Put the venv at the front of the path
+# When its python is run, it will activate the venv
+PATH=~/Virtualenvs/sensor-app3/bin:$PATH
+exec python sensor_collector.py
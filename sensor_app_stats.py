@@ -0,0 +1,174 @@
+#
+# sensor_app_stats.py - The figures shown by the App Stats view
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Toolkit independent model of the App Stats view (wx_app_stats_dlg.py and
+# tk_app_stats_dlg.py). Everything comes from memory: the stage metrics
+# (sensor_metrics.py) and the data source's sensor versions. A refresh never
+# queries SQLite. The DB sizes are a stat() of the files.
+#
+# The sample bus and reception quality figures come from the data source's
+# bus_stats and reception_stats. With the "process" data source, they and
+# the reception and DB metrics are kept by the child process. Its latest
+# snapshot is merged in.
+#
+
+
+import time
+import sensor_metrics
+
+
+class AppStats:
+    """
+    Formatted app statistics, updated by refresh()
+    """
+    def __init__(self, data_source):
+        """
+        :param data_source: The app's sensor data source
+        """
+        self._data_source = data_source
+        # Sensor versions and time of the previous refresh, for per sensor rates
+        self._last_versions = None
+        self._last_time = None
+        self._rates = {}
+        self._metrics = {}
+        self._sensors = []
+        self._bus_stats = {}
+        # Reception quality keyed by mac
+        self._reception = {}
+
+    def refresh(self):
+        """
+        Take a new reading of the metrics and the per sensor sample rates
+        :return: None
+        """
+        self._metrics = self._merged_metrics()
+        self._bus_stats = self._data_source.bus_stats
+        self._reception = {r["mac"]: r for r in self._data_source.reception_stats}
+
+        now = time.monotonic()
+        data_version, versions = self._data_source.get_sensor_versions()
+        if self._last_versions is not None and now > self._last_time:
+            elapsed = now - self._last_time
+            self._rates = {mac: (count - self._last_versions.get(mac, 0)) / elapsed
+                           for mac, count in versions.items()}
+        self._last_versions = versions
+        self._last_time = now
+
+        sensor_list = self._data_source.lock_sensor_list()
+        names = {mac: data.get("name", "N/A") for mac, data in sensor_list.items()}
+        self._data_source.unlock_sensor_list()
+        # Sensors removed by reset_sensor_list() keep their version until they report again
+        self._sensors = sorted(
+            ((names[mac], mac, self._rates.get(mac), count) for mac, count in versions.items() if mac in names),
+            key=lambda s: (s[0], s[1]))
+
+    def _merged_metrics(self):
+        """
+        This process's metrics, with the child process's metrics where this
+        process has none of its own
+        :return: A dict of metric snapshots keyed by name
+        """
+        local = sensor_metrics.snapshot()
+        child = getattr(self._data_source, "child_metrics", None)
+        if not child:
+            return local
+        merged = dict(child)
+        for name, snap in local.items():
+            if name not in merged or AppStats._has_data(snap):
+                merged[name] = snap
+        if "process.rss_bytes" in child:
+            merged["process.child_rss_bytes"] = child["process.rss_bytes"]
+        return merged
+
+    @staticmethod
+    def _has_data(snap):
+        if snap["type"] == "histogram":
+            return snap["count"] > 0
+        return bool(snap["value"])
+
+    @property
+    def sensors(self):
+        """
+        Per sensor ingest and reception quality
+        :return: A list of (name, mac, samples/s, samples, loss %, RSSI) rows sorted by name.
+        Rates are "-" until the second refresh. Loss and RSSI are "-" where not tracked.
+        """
+        rows = []
+        for name, mac, rate, count in self._sensors:
+            reception = self._reception.get(mac, {})
+            loss_pct = reception.get("total_loss_pct")
+            rssi = reception.get("rssi_avg")
+            rows.append((name, mac, f"{rate:.2f}" if rate is not None else "-", str(count),
+                         f"{loss_pct:.1f}" if loss_pct is not None else "-",
+                         f"{rssi:.0f}" if rssi is not None else "-"))
+        return rows
+
+    @property
+    def rows(self):
+        """
+        Overall figures
+        :return: A list of (label, value) rows. A row with an empty value is a heading.
+        """
+        overall_rate = sum(rate for _, _, rate, _ in self._sensors if rate is not None) \
+            if len(self._rates) > 0 else None
+        rows = [
+            ("Ingest", ""),
+            ("Samples/s", f"{overall_rate:.1f}" if overall_rate is not None else "-"),
+            ("Samples received", self._value("samples.received")),
+            ("Samples written", self._value("db.samples_written")),
+            ("Duplicates", self._value("samples.duplicates")),
+            ("Dropped", self._value("bus.db_writer.dropped")),
+            ("DB writer queue depth", self._value("bus.db_writer.depth")),
+            ("Slow DB statements", self._value("db.slow_queries")),
+            ("Latency p50 / p99 / max (ms)", ""),
+            ("Receive", self._latency("sample.receive")),
+            ("DB write (batch)", self._latency("db.add_sensor_data_batch")),
+            ("DB write (single)", self._latency("db.add_sensor_data")),
+            ("History query", self._latency("db.history_query")),
+            ("Trim", self._latency("db.trim")),
+            ("Sensor list lock wait", self._latency("sensor_list.lock_wait")),
+            ("UI refresh", self._latency("ui.update_sensors")),
+            ("Storage and memory", ""),
+            ("DB size", self._megabytes("db.size_bytes")),
+            ("WAL size", self._megabytes("db.wal_size_bytes")),
+            ("Process RSS", self._megabytes("process.rss_bytes")),
+        ]
+        if "process.child_rss_bytes" in self._metrics:
+            rows.append(("Data source process RSS", self._megabytes("process.child_rss_bytes")))
+        if len(self._bus_stats) > 0:
+            rows.append(("Bus depth / dropped / max lag (ms)", ""))
+            for name in sorted(self._bus_stats.keys()):
+                m = self._bus_stats[name]
+                rows.append((name, f"{m['depth']} / {m['dropped']} / {m['max_lag'] * 1e3:.1f}"))
+        return rows
+
+    def _value(self, name):
+        snap = self._metrics.get(name)
+        if snap is None or snap.get("value") is None:
+            return "-"
+        return str(snap["value"])
+
+    def _latency(self, name):
+        snap = self._metrics.get(name)
+        if snap is None or snap["count"] == 0:
+            return "-"
+        return f"{snap['p50'] * 1e3:.3f} / {snap['p99'] * 1e3:.3f} / {snap['max'] * 1e3:.3f}"
+
+    def _megabytes(self, name):
+        snap = self._metrics.get(name)
+        if snap is None or snap.get("value") is None:
+            return "-"
+        return f"{snap['value'] / (1024.0 * 1024.0):.1f} MB"
@@ -0,0 +1,289 @@
+#
+# sensor_bus.py - Publish/subscribe fan-out of sensor samples
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The sensor adapter publishes each sample to the bus. Every subscriber
+# (DB writer, change feed, forwarder, ...) has its own bounded queue and
+# its own delivery thread. Publishing only appends to the queues, so a slow
+# subscriber delays neither reception nor the other subscribers.
+#
+# When a subscriber's queue is full, its overflow policy decides what
+# happens to the new sample:
+#   DROP_OLDEST  The oldest queued sample is dropped (the default)
+#   DROP_NEWEST  The new sample is dropped
+#   BLOCK        The publisher waits up to block_timeout (None is no limit)
+#                for room, then drops the new sample. Use it only for a
+#                subscriber that must not lose samples, as it can delay
+#                reception.
+# A warning is logged whenever a subscriber starts dropping samples, and
+# the number dropped is logged when its queue is down to half full again.
+#
+# Each subscription keeps metrics: samples published to it, delivered and
+# dropped, queue depth (current and maximum) and lag (time from publish to
+# delivery, last and maximum).
+#
+
+
+import logging
+import time
+from collections import deque
+from threading import Thread, Lock, Condition, current_thread
+
+
+class BusSubscription:
+    """
+    A subscriber's queue and delivery thread
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    BLOCK = "block"
+
+    def __init__(self, name, handler, maxsize, overflow, batch, block_timeout):
+        """
+        Use SensorBus.subscribe()
+        :param name: Subscriber name, used for the thread name and metrics
+        :param handler: A callable taking (mac, data) or, for a batch subscriber,
+        a list of (mac, data) tuples
+        :param maxsize: Capacity of the queue
+        :param overflow: DROP_OLDEST, DROP_NEWEST or BLOCK
+        :param batch: True to deliver everything queued (up to maxsize) in one call
+        :param block_timeout: Maximum time in seconds a BLOCK publisher waits, None for no limit
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self.name = name
+        self._handler = handler
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._batch = batch
+        self._block_timeout = block_timeout
+        self._queue = deque()
+        self._condition = Condition()
+        self._terminate = False
+        self._drain = False
+        # Samples dropped since the queue last had room, None while not dropping
+        self._dropping = None
+        self._metrics = {
+            "published": 0,
+            "delivered": 0,
+            "dropped": 0,
+            "errors": 0,
+            "max_depth": 0,
+            "last_lag": 0.0,
+            "max_lag": 0.0,
+        }
+        self._thread = Thread(target=self._run, name=f"Bus-{name}")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, drain):
+        """
+        Stop the delivery thread
+        :param drain: True to deliver what is queued first, False to discard it
+        :return: None
+        """
+        self._condition.acquire()
+        self._terminate = True
+        self._drain = drain
+        self._condition.notify_all()
+        self._condition.release()
+        # A handler may unsubscribe itself
+        if current_thread() is not self._thread:
+            self._thread.join()
+
+    def offer(self, mac, data):
+        """
+        Queue a sample (publisher side)
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: None
+        """
+        item = (time.monotonic(), mac, data)
+        self._condition.acquire()
+        if self._terminate:
+            self._condition.release()
+            return
+        self._metrics["published"] += 1
+        if len(self._queue) >= self._maxsize:
+            if self._overflow == BusSubscription.BLOCK:
+                if self._block_timeout is None:
+                    while len(self._queue) >= self._maxsize and not self._terminate:
+                        self._condition.wait()
+                else:
+                    deadline = time.monotonic() + self._block_timeout
+                    while len(self._queue) >= self._maxsize and not self._terminate:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+        if len(self._queue) >= self._maxsize:
+            if self._dropping is None:
+                self._logger.warning(f"Bus subscriber {self.name} is not keeping up. Samples are being dropped.")
+                self._dropping = 0
+            self._dropping += 1
+            self._metrics["dropped"] += 1
+            if self._overflow == BusSubscription.DROP_OLDEST:
+                self._queue.popleft()
+            else:
+                item = None
+        elif self._dropping is not None and len(self._queue) <= self._maxsize // 2:
+            self._logger.warning(f"Bus subscriber {self.name} caught up after dropping {self._dropping} samples")
+            self._dropping = None
+        if item is not None:
+            self._queue.append(item)
+            if len(self._queue) > self._metrics["max_depth"]:
+                self._metrics["max_depth"] = len(self._queue)
+            self._condition.notify_all()
+        self._condition.release()
+
+    @property
+    def metrics(self):
+        """
+        Subscription metrics
+        :return: A dict of published, delivered, dropped, errors, depth, max_depth,
+        last_lag and max_lag (seconds)
+        """
+        self._condition.acquire()
+        m = dict(self._metrics)
+        m["depth"] = len(self._queue)
+        self._condition.release()
+        return m
+
+    def _run(self):
+        """
+        Delivery thread
+        :return: None
+        """
+        while True:
+            self._condition.acquire()
+            while len(self._queue) == 0 and not self._terminate:
+                self._condition.wait()
+            if self._terminate and (not self._drain or len(self._queue) == 0):
+                self._queue.clear()
+                self._condition.release()
+                break
+            if self._batch:
+                items = list(self._queue)
+                self._queue.clear()
+            else:
+                items = [self._queue.popleft()]
+            # Room for a blocked publisher
+            self._condition.notify_all()
+            self._condition.release()
+
+            lag = time.monotonic() - items[0][0]
+            try:
+                if self._batch:
+                    self._handler([(mac, data) for _, mac, data in items])
+                else:
+                    self._handler(items[0][1], items[0][2])
+            except Exception as ex:
+                self._count_error()
+                self._logger.error(f"Unhandled exception caught in bus subscriber {self.name}")
+                self._logger.error(str(ex))
+
+            self._condition.acquire()
+            self._metrics["delivered"] += len(items)
+            self._metrics["last_lag"] = lag
+            if lag > self._metrics["max_lag"]:
+                self._metrics["max_lag"] = lag
+            self._condition.release()
+
+    def _count_error(self):
+        self._condition.acquire()
+        self._metrics["errors"] += 1
+        self._condition.release()
+
+
+class SensorBus:
+    """
+    Fans out published samples to any number of subscribers
+    """
+    DEFAULT_QUEUE_SIZE = 1000
+
+    def __init__(self):
+        self._logger = logging.getLogger("sensor_app")
+        self._subscriptions = []
+        self._lock = Lock()
+
+    def subscribe(self, name, handler, maxsize=DEFAULT_QUEUE_SIZE, overflow=BusSubscription.DROP_OLDEST,
+                  batch=False, block_timeout=1.0):
+        """
+        Add a subscriber. See BusSubscription for the parameters. A number
+        is appended to a name already in use.
+        :return: A BusSubscription instance, needed to unsubscribe
+        """
+        self._lock.acquire()
+        names = {s.name for s in self._subscriptions}
+        unique_name = name
+        n = 2
+        while unique_name in names:
+            unique_name = f"{name}-{n}"
+            n += 1
+        subscription = BusSubscription(unique_name, handler, maxsize, overflow, batch, block_timeout)
+        subscription.start()
+        self._subscriptions.append(subscription)
+        self._lock.release()
+        return subscription
+
+    def unsubscribe(self, subscription, drain=False):
+        """
+        Remove a subscriber
+        :param subscription: A BusSubscription returned by subscribe()
+        :param drain: True to deliver what is queued for the subscriber first
+        :return: None
+        """
+        self._lock.acquire()
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+        self._lock.release()
+        subscription.stop(drain)
+
+    def publish(self, mac, data):
+        """
+        Publish a sample to all subscribers. Called on the adapter thread.
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values. Subscribers must
+        treat it as read only.
+        :return: None
+        """
+        self._lock.acquire()
+        subscriptions = list(self._subscriptions)
+        self._lock.release()
+        for subscription in subscriptions:
+            subscription.offer(mac, data)
+
+    def close(self):
+        """
+        Deliver everything queued and stop all subscribers
+        :return: None
+        """
+        self._lock.acquire()
+        subscriptions = list(self._subscriptions)
+        self._subscriptions = []
+        self._lock.release()
+        for subscription in subscriptions:
+            subscription.stop(drain=True)
+
+    @property
+    def stats(self):
+        """
+        Metrics of every subscription
+        :return: A dict of subscription metrics keyed by subscriber name
+        """
+        self._lock.acquire()
+        subscriptions = list(self._subscriptions)
+        self._lock.release()
+        return {s.name: s.metrics for s in subscriptions}
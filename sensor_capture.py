@@ -0,0 +1,107 @@
+#
+# sensor_capture.py - Record raw sensor callbacks for later replay
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# When "capture_file" is set, SensorThread appends every callback it gets
+# from ruuvitag_sensor to the file, before any processing. Each line is a
+# JSON object:
+#   {"t": arrival time (epoch seconds), "mac": mac, "data": raw data dict}
+# A file name ending in .gz is gzip compressed. ReplaySensorAdapter (see
+# replay_sensor_adapter.py) plays a capture back.
+#
+# Usage:
+#   python sensor_capture.py CAPTURE_FILE
+# prints a summary of a capture.
+#
+
+
+import gzip
+import json
+import logging
+import sys
+
+
+def _open_capture(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class CaptureWriter:
+    """
+    Appends sensor callbacks to a capture file
+    """
+    def __init__(self, path):
+        """
+        :param path: The capture file. It is appended to if it exists.
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._path = path
+        self._file = _open_capture(path, "a")
+        self._count = 0
+        self._logger.info(f"Capturing sensor data to {path}")
+
+    def record(self, mac, data, arrival):
+        """
+        Append a callback
+        :param mac: The mac of the sensor
+        :param data: The raw data dict, as received
+        :param arrival: Arrival time in epoch seconds
+        :return: None
+        """
+        self._file.write(json.dumps({"t": arrival, "mac": mac, "data": data}, separators=(",", ":"),
+                                    default=str))
+        self._file.write("\n")
+        self._count += 1
+
+    def close(self):
+        self._file.close()
+        self._logger.info(f"{self._count} sensor callbacks captured to {self._path}")
+
+
+def read_capture(path):
+    """
+    Read a capture file
+    :param path: The capture file
+    :return: An iterator of (arrival time, mac, raw data dict) tuples
+    """
+    with _open_capture(path, "r") as f:
+        for line in f:
+            # An interrupted capture may end with a partial line
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield record["t"], record["mac"], record["data"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python sensor_capture.py CAPTURE_FILE")
+        sys.exit(2)
+    count = 0
+    first = None
+    last = None
+    per_sensor = {}
+    for t, mac, data in read_capture(sys.argv[1]):
+        count += 1
+        first = t if first is None else first
+        last = t
+        per_sensor[mac] = per_sensor.get(mac, 0) + 1
+    duration = (last - first) if count > 0 else 0.0
+    print(f"{count} callbacks from {len(per_sensor)} sensors over {duration:.1f} s "
+          f"({count / duration if duration > 0 else 0.0:.1f} callbacks/s)")
+    for mac, n in sorted(per_sensor.items()):
+        print(f"  {mac} {n}")
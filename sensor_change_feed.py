@@ -0,0 +1,242 @@
+#
+# sensor_change_feed.py - Per-sensor change deltas for push clients
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The change feed listens to the live sample stream of a data source and
+# turns each sample into a delta: only the fields of the sensor's compact
+# record that changed since its previous sample. Each subscribed client
+# has a buffer of pending deltas keyed by mac. A delta for a sensor that
+# already has one pending is merged into it, so a slow client receives one
+# coalesced update per sensor instead of every sample. The buffer is
+# bounded. If it overflows, it is dropped and the client is sent a
+# complete snapshot instead.
+#
+
+
+import datetime
+import logging
+from collections import OrderedDict
+from threading import Lock, Condition
+
+
+class FeedClient:
+    """
+    One subscriber of the change feed
+    """
+    # Outcomes of offer()
+    QUEUED = 0
+    COALESCED = 1
+    OVERFLOW = 2
+
+    def __init__(self, max_pending):
+        """
+        :param max_pending: Maximum number of sensors with a pending delta
+        """
+        self._max_pending = max_pending
+        self._pending = OrderedDict()
+        self._needs_snapshot = True
+        self._closed = False
+        self._condition = Condition()
+
+    def offer(self, mac, delta):
+        """
+        Queue a delta for the client (change feed side)
+        :param mac: The mac of the sensor
+        :param delta: A dict of the changed fields
+        :return: One of QUEUED, COALESCED or OVERFLOW
+        """
+        result = FeedClient.QUEUED
+        self._condition.acquire()
+        if not self._needs_snapshot:
+            pending = self._pending.get(mac)
+            if pending is not None:
+                pending.update(delta)
+                result = FeedClient.COALESCED
+            elif len(self._pending) < self._max_pending:
+                self._pending[mac] = dict(delta)
+            else:
+                # Too far behind. A snapshot replaces everything pending.
+                self._pending.clear()
+                self._needs_snapshot = True
+                result = FeedClient.OVERFLOW
+        self._condition.notify()
+        self._condition.release()
+        return result
+
+    def close(self):
+        """
+        Wake and end the client
+        :return: None
+        """
+        self._condition.acquire()
+        self._closed = True
+        self._condition.notify()
+        self._condition.release()
+
+    def wait(self, timeout):
+        """
+        Wait for updates (client side)
+        :param timeout: Maximum time to wait in seconds
+        :return: A tuple of (closed, needs snapshot, dict of deltas keyed by mac).
+        All empty/False if the wait timed out.
+        """
+        self._condition.acquire()
+        if not self._closed and not self._needs_snapshot and len(self._pending) == 0:
+            self._condition.wait(timeout)
+        closed = self._closed
+        needs_snapshot = self._needs_snapshot
+        deltas = self._pending
+        self._pending = OrderedDict()
+        self._needs_snapshot = False
+        self._condition.release()
+        return closed, needs_snapshot, deltas
+
+
+class SensorChangeFeed:
+    """
+    Fans out per-sensor deltas of a data source to any number of clients
+    """
+    MAX_PENDING = 256
+    # Fields of the compact record sent to clients
+    FIELDS = ("name", "temperature", "humidity", "pressure", "battery", "timestamp")
+
+    def __init__(self, data_source):
+        """
+        :param data_source: The sensor data source to follow
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._data_source = data_source
+        self._records = {}
+        self._clients = []
+        self._lock = Lock()
+        self._coalesced = 0
+        self._overflows = 0
+
+    def open(self):
+        """
+        Start following the data source
+        :return: None
+        """
+        sensor_list = self._data_source.lock_sensor_list()
+        for mac, data in sensor_list.items():
+            self._records[mac] = SensorChangeFeed._compact_record(data)
+        self._data_source.unlock_sensor_list()
+        self._data_source.add_sample_listener(self._on_sample)
+
+    def close(self):
+        """
+        Stop following the data source and end all clients
+        :return: None
+        """
+        self._data_source.remove_sample_listener(self._on_sample)
+        self._lock.acquire()
+        clients = list(self._clients)
+        self._clients = []
+        self._lock.release()
+        for client in clients:
+            client.close()
+
+    def subscribe(self, max_pending=MAX_PENDING):
+        """
+        Add a client. Its first update is a snapshot.
+        :param max_pending: Maximum number of sensors with a pending delta
+        :return: A FeedClient instance
+        """
+        client = FeedClient(max_pending)
+        self._lock.acquire()
+        self._clients.append(client)
+        self._lock.release()
+        return client
+
+    def unsubscribe(self, client):
+        """
+        Remove a client
+        :param client: A FeedClient returned by subscribe()
+        :return: None
+        """
+        self._lock.acquire()
+        if client in self._clients:
+            self._clients.remove(client)
+        self._lock.release()
+
+    @property
+    def stats(self):
+        """
+        Feed statistics
+        :return: A dict with the keys clients, coalesced and overflows
+        """
+        self._lock.acquire()
+        s = {"clients": len(self._clients), "coalesced": self._coalesced, "overflows": self._overflows}
+        self._lock.release()
+        return s
+
+    def snapshot(self):
+        """
+        The compact record of every sensor
+        :return: A dict of compact records keyed by mac
+        """
+        self._lock.acquire()
+        records = {mac: dict(record) for mac, record in self._records.items()}
+        self._lock.release()
+        return records
+
+    def _on_sample(self, mac, data):
+        """
+        Sample listener. Runs on the data source thread, so it only computes
+        the delta and hands it to the clients.
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: None
+        """
+        record = SensorChangeFeed._compact_record(data)
+        self._lock.acquire()
+        previous = self._records.get(mac, {})
+        delta = {k: v for k, v in record.items() if previous.get(k) != v}
+        self._records[mac] = record
+        clients = list(self._clients)
+        self._lock.release()
+
+        if len(delta) > 0:
+            coalesced = 0
+            overflows = 0
+            for client in clients:
+                result = client.offer(mac, delta)
+                if result == FeedClient.COALESCED:
+                    coalesced += 1
+                elif result == FeedClient.OVERFLOW:
+                    overflows += 1
+            if coalesced > 0 or overflows > 0:
+                self._lock.acquire()
+                self._coalesced += coalesced
+                self._overflows += overflows
+                self._lock.release()
+
+    @staticmethod
+    def _compact_record(data):
+        """
+        Select and round the fields sent to clients. Rounding keeps sensor
+        noise from producing deltas nobody can see.
+        :param data: A dict of sensor data keys and values
+        :return: A dict
+        """
+        record = {}
+        for field in SensorChangeFeed.FIELDS:
+            value = data.get(field)
+            if isinstance(value, float):
+                value = round(value, 1)
+            elif isinstance(value, datetime.datetime):
+                value = value.isoformat(timespec="seconds")
+            record[field] = value
+        return record
@@ -0,0 +1,87 @@
+#
+# sensor_clock.py - The app's source of the current date and time
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Sample timestamps, trimming, offline checks and history ranges all ask
+# this module for the current time instead of calling datetime.now(). A test
+# can then install a ScaledClock to run simulated hours in minutes (see
+# benchmarks/soak_test.py):
+#
+#   sensor_clock.set_clock(ScaledClock(speed=360.0))
+#
+# Durations (timeouts, latencies) are measured with time.monotonic() or
+# time.perf_counter() and are not affected.
+#
+
+
+import datetime
+import time
+
+
+class SystemClock:
+    """
+    The real date and time
+    """
+    def now(self):
+        return datetime.datetime.now()
+
+
+class ScaledClock:
+    """
+    A clock that runs speed times faster than real time
+    """
+    def __init__(self, speed=1.0, start=None):
+        """
+        :param speed: Simulated seconds per real second
+        :param start: The simulated time to start at. The default is now.
+        """
+        self._speed = speed
+        self._start = start if start is not None else datetime.datetime.now()
+        self._real_start = time.monotonic()
+
+    @property
+    def speed(self):
+        return self._speed
+
+    def now(self):
+        elapsed = (time.monotonic() - self._real_start) * self._speed
+        return self._start + datetime.timedelta(seconds=elapsed)
+
+
+_clock = SystemClock()
+
+
+def set_clock(clock):
+    """
+    Install the clock used by the whole app
+    :param clock: An object with a now() method returning a naive datetime
+    :return: The previous clock
+    """
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+
+def get_clock():
+    return _clock
+
+
+def now():
+    """
+    The current date and time according to the installed clock
+    :return: A naive datetime
+    """
+    return _clock.now()
@@ -0,0 +1,166 @@
+#
+# sensor_collector.py - Headless sensor data collector
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The collector receives sensor data and writes it to the sensor DB without
+# any GUI. It is meant to be run as a daemon (e.g. from systemd). The wx and
+# tk apps become clients of the DB when their configuration specifies
+#   "data_source": "collector"
+#
+# The latest sample of each sensor is also published to a shared memory
+# table (see shared_sensor_table.py) so local viewers can read current
+# values without querying the DB.
+#
+# SIGTERM, SIGINT and SIGHUP cause a clean shutdown: the sensor data source is
+# closed (which waits for the receiver thread) before the process exits.
+#
+
+
+import logging
+import signal
+from threading import Event
+from configuration import Configuration
+import app_logger
+from sensor_data_source_handler import SensorDataSourceHandler
+from sensor_db import SensorDB
+from shared_sensor_table import SharedSensorTable
+import sensor_clock
+import sensor_profiler
+
+
+class SensorCollector:
+    """
+    Runs the sensor data source and DB maintenance until told to stop
+    """
+    def __init__(self):
+        self._logger = logging.getLogger("sensor_app")
+        self._data_source = None
+        self._terminate = Event()
+        self._last_trim_hour = None
+        self._shared_table = None
+        self._unpublished = set()
+
+    def run(self):
+        """
+        Collect sensor data until stop() is called
+        :return: None
+        """
+        self._data_source = SensorDataSourceHandler()
+        self._open_shared_table()
+        self._data_source.open_data_source()
+        self._logger.info("Sensor collector running")
+
+        try:
+            # Check once a minute for DB maintenance
+            while not self._terminate.wait(60.0):
+                self._trim_sensor_db()
+        finally:
+            self._data_source.close_data_source()
+            self._close_shared_table()
+            self._logger.info("Sensor collector stopped")
+
+    def stop(self):
+        """
+        Ask the collector to stop. Safe to call from a signal handler.
+        :return: None
+        """
+        self._terminate.set()
+
+    def _open_shared_table(self):
+        """
+        Create the shared memory latest values table and seed it with the
+        latest sample of each sensor in the DB
+        :return: None
+        """
+        config = Configuration.get_configuration()
+        name = config.get(Configuration.CFG_SHARED_TABLE_NAME, SharedSensorTable.DEFAULT_NAME)
+        if not name:
+            return
+        try:
+            self._shared_table = SharedSensorTable.create(name=name)
+        except Exception as ex:
+            self._logger.error(f"Unable to create shared sensor table {name}")
+            self._logger.error(str(ex))
+            return
+
+        latest = SensorDB().get_latest_sensor_data()
+        if latest is not None:
+            for data in latest:
+                self._shared_table.publish(data["mac"], data)
+        # The listener's thread is the only writer
+        self._data_source.add_sample_listener(self._publish_sample)
+        self._logger.info(f"Publishing latest sensor values to shared memory {name}")
+
+    def _publish_sample(self, mac, data):
+        """
+        Sample listener that writes each sample to the shared table
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: None
+        """
+        if not self._shared_table.publish(mac, data) and mac not in self._unpublished:
+            self._unpublished.add(mac)
+            self._logger.warning(f"Shared sensor table is full, {mac} not published")
+
+    def _close_shared_table(self):
+        """
+        Remove the shared memory table
+        :return: None
+        """
+        if self._shared_table is not None:
+            self._data_source.remove_sample_listener(self._publish_sample)
+            self._shared_table.close()
+            self._shared_table = None
+
+    def _trim_sensor_db(self):
+        """
+        Once an hour, on the hour, trim the sensor DB
+        :return: None
+        """
+        now = sensor_clock.now()
+        if now.minute == 0 and now.hour != self._last_trim_hour:
+            self._last_trim_hour = now.hour
+            self._logger.debug("Starting DB trimming")
+            self._data_source.trim_sensor_data()
+
+
+if __name__ == "__main__":
+    # Load configuration
+    Configuration.load_configuration()
+
+    # Start logging. The collector has its own log file so it does not
+    # contend with a GUI client for sensor_app.log.
+    app_logger.start("sensor_app", logfile="sensor_collector.log")
+    logger = logging.getLogger("sensor_app")
+    logger.info("sensor_collector starting...")
+
+    collector = SensorCollector()
+
+    def _handle_signal(signum, frame):
+        logger.info(f"Signal {signum} received, shutting down")
+        collector.stop()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGHUP, _handle_signal)
+    # kill -USR1 <pid> toggles the profiler
+    sensor_profiler.install_signal_handler()
+
+    collector.run()
+    # Write the profile if one is running
+    sensor_profiler.stop_profiler(wait=True)
+
+    logger.info("sensor_collector ended")
+    app_logger.shut_down()
@@ -0,0 +1,188 @@
+#
+# sensor_data_source.py - Sensor list and listener bookkeeping shared by the data sources
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The GUI talks to every data source (SensorDataSourceHandler,
+# CollectorDataSource, ProcessDataSource) through the same interface. The
+# sensor list with its lock and change counters, and the list of live sample
+# listeners, are kept here so the locking contract is defined once.
+#
+
+
+from threading import Lock
+import logging
+from configuration import Configuration
+import sensor_metrics
+
+
+_LOCK_WAIT_TIME = sensor_metrics.histogram("sensor_list.lock_wait", "Waiting for the sensor list lock")
+
+
+class SensorDataSource:
+    """
+    Base class of the data sources
+    """
+    def __init__(self):
+        self._config = Configuration.get_configuration()
+        self._logger = logging.getLogger("sensor_app")
+        self._sensor_list = {}
+        self._list_lock = Lock()
+        self._pending_sensor_changes = False
+        # Change counters, per sensor and overall
+        self._sensor_versions = {}
+        self._data_version = 0
+        # Observers of the live sample stream
+        self._sample_listeners = []
+        self._listener_lock = Lock()
+
+    def open_data_source(self):
+        raise NotImplementedError()
+
+    def close_data_source(self):
+        raise NotImplementedError()
+
+    def trim_sensor_data(self):
+        raise NotImplementedError()
+
+    def _record_samples(self, samples):
+        """
+        Record the last data point of each sensor
+        :param samples: A list of (mac, data) tuples in order of reception
+        :return: None
+        """
+        self.lock_sensor_list()
+        for mac, data in samples:
+            self._sensor_list[mac] = data
+            self._sensor_versions[mac] = self._sensor_versions.get(mac, 0) + 1
+        self._data_version += 1
+        self._pending_sensor_changes = True
+        self.unlock_sensor_list()
+
+    def _has_listeners(self):
+        self._listener_lock.acquire()
+        c = len(self._sample_listeners) > 0
+        self._listener_lock.release()
+        return c
+
+    def _notify_listeners(self, samples):
+        """
+        Pass samples to the live sample observers
+        :param samples: A list of (mac, data) tuples in order of reception
+        :return: None
+        """
+        self._listener_lock.acquire()
+        listeners = list(self._sample_listeners)
+        self._listener_lock.release()
+        for mac, data in samples:
+            for listener in listeners:
+                try:
+                    listener(mac, data)
+                except Exception as ex:
+                    self._logger.error("Unhandled exception caught in sample listener")
+                    self._logger.error(str(ex))
+
+    def add_sample_listener(self, listener):
+        """
+        Register an observer of the live sample stream. The listener is
+        called on the thread that delivers the samples (see _notify_listeners()),
+        so it should do as little as possible (e.g. queue the sample for
+        later processing).
+        :param listener: A callable taking (mac, data)
+        :return: None
+        """
+        self._listener_lock.acquire()
+        if listener not in self._sample_listeners:
+            self._sample_listeners.append(listener)
+        self._listener_lock.release()
+
+    def remove_sample_listener(self, listener):
+        """
+        Unregister an observer of the live sample stream
+        :param listener: A previously registered callable
+        :return: None
+        """
+        self._listener_lock.acquire()
+        if listener in self._sample_listeners:
+            self._sample_listeners.remove(listener)
+        self._listener_lock.release()
+
+    @property
+    def bus_stats(self):
+        """
+        Metrics of the sample bus subscribers (DB writer and listeners)
+        :return: A dict of subscription metrics keyed by subscriber name (see
+        BusSubscription.metrics). Empty if the bus is in another process.
+        """
+        return {}
+
+    @property
+    def reception_stats(self):
+        """
+        Reception quality of each sensor in the current period and since the data source was opened
+        :return: A list of dicts (see ReceptionStats.snapshot()). Empty if disabled or
+        tracked in another process.
+        """
+        return []
+
+    def reset_sensor_list(self):
+        """
+        Reset the sensor list to allow a clean restart
+        @return:
+        """
+        self.lock_sensor_list()
+        self._sensor_list = {}
+        self._data_version += 1
+        self.unlock_sensor_list()
+
+    def get_sensor_versions(self):
+        """
+        Change counters of the sensor list. A sensor's version is incremented
+        every time it reports a sample. The data version is incremented on
+        any change to the list.
+        :return: A tuple of (data version, dict of version keyed by mac)
+        """
+        self._list_lock.acquire()
+        versions = (self._data_version, dict(self._sensor_versions))
+        self._list_lock.release()
+        return versions
+
+    def lock_sensor_list(self):
+        """
+        Acquire the list lock
+        :return: Locked sensor list
+        """
+        t = _LOCK_WAIT_TIME.start()
+        self._list_lock.acquire()
+        _LOCK_WAIT_TIME.stop(t)
+        return self._sensor_list
+
+    def unlock_sensor_list(self):
+        """
+        Release the list lock
+        :return:
+        """
+        self._list_lock.release()
+
+    @property
+    def pending_changes(self):
+        """
+        Answers the question: Is there unhandled sensor data
+        :return: Returns True if there are pending sensor data changes
+        """
+        self._list_lock.acquire()
+        c = self._pending_sensor_changes
+        self._pending_sensor_changes = False
+        self._list_lock.release()
+        return c
@@ -17,28 +17,66 @@
 
 
 from configuration import Configuration
+from sensor_data_source import SensorDataSource
 from sensor_db import SensorDB
-import logging
-from threading import Lock
+from sensor_bus import SensorBus, BusSubscription
+from sensor_reception_stats import ReceptionStats
+import sensor_metrics
+import os
 
 
-class SensorDataSourceHandler:
+_RECEIVE_TIME = sensor_metrics.histogram("sample.receive",
+                                         "Handling a sample on the adapter thread (name, list update, publish)")
+_SAMPLES_RECEIVED = sensor_metrics.counter("samples.received", "Samples received from the sensor adapter")
+_DUPLICATES = sensor_metrics.counter("samples.duplicates",
+                                     "Samples repeating the previous measurement sequence number of their sensor")
+
+
+class SensorDataSourceHandler(SensorDataSource):
+    # The DB writer gets a deep queue. It is only filled if the DB stalls.
+    # Then reception waits for the DB, as it did when samples were written
+    # on the adapter thread, rather than losing samples.
+    DB_WRITER_QUEUE_SIZE = 10000
+
     def __init__(self):
+        super().__init__()
         # Start up the sensor data DB
         self._sensor_db = SensorDB()
-        self._config = Configuration.get_configuration()
-        self._logger = logging.getLogger("sensor_app")
         self._sensor_data_source = None
-        self._sensor_list = {}
-        self._list_lock = Lock()
-        self._pending_sensor_changes = False
+        # Received samples are published to the bus. The DB writer and the
+        # sample listeners are bus subscribers.
+        self._bus = SensorBus()
+        self._db_writer = None
+        # Per sensor reception quality, a bus subscriber
+        self._reception_stats = None
+        # Sample listeners are bus subscribers. Their subscriptions are keyed by listener.
+        self._sample_listeners = {}
+        # Sensor names keyed by mac, so the DB is only consulted for new sensors
+        self._sensor_names = {}
+        self._http_api = None
+        self._forwarder = None
 
     def open_data_source(self):
         # Trim aged data records
         self._sensor_db.trim_sensor_data()
 
+        # Samples are written to the DB in batches
+        self._db_writer = self._bus.subscribe("db_writer", self._sensor_db.add_sensor_data_batch,
+                                              maxsize=SensorDataSourceHandler.DB_WRITER_QUEUE_SIZE,
+                                              overflow=BusSubscription.BLOCK, block_timeout=None,
+                                              batch=True)
+        self._register_gauges()
+
+        # Track reception quality, with a summary saved every period
+        period = float(self._config.get(Configuration.CFG_RECEPTION_STATS_PERIOD, 900))
+        if period > 0:
+            self._reception_stats = ReceptionStats(self._sensor_db, period)
+            self._bus.subscribe("reception_stats", self._reception_stats.add_samples, batch=True)
+
         # Start sensor data source
-        if self._config[Configuration.CFG_USE_TEST_DATA].lower() == "true":
+        if self._config.get(Configuration.CFG_REPLAY_FILE, ""):
+            from replay_sensor_adapter import ReplaySensorAdapter as SensorThread
+        elif self._config[Configuration.CFG_USE_TEST_DATA].lower() == "true":
             from dummy_sensor_adapter import DummySensorAdapter as SensorThread
         else:
             from sensor_thread import SensorThread
@@ -46,60 +84,179 @@ class SensorDataSourceHandler:
         self._sensor_data_source.open()
         self._logger.info("Data source opened")
 
+        # Serve sensor data to other tools if configured
+        from sensor_http_api import start_http_api
+        self._http_api = start_http_api(self)
+        # Forward samples to a central store if configured
+        from sensor_forwarder import start_forwarder
+        self._forwarder = start_forwarder(self)
+
     def _handle_sensor_data(self, mac, data):
         """
-        Handle (log) a sensor data sample
+        Handle a sensor data sample. Called on the data source thread, so
+        everything slow is left to the bus subscribers.
         :param mac: The mac of the sensor
         :param data: A dict of sensor data keys and values
         :return: None
         """
-        # print(f"Handling data for mac: {mac}")
-        sensor_rec = self._sensor_db.add_sensor(mac)
+        t = _RECEIVE_TIME.start()
         # Add the sensor name to the sensor data
-        data["name"] = sensor_rec["name"]
-        # Log to DB
-        self._sensor_db.add_sensor_data(mac, data)
+        data["name"] = self._get_sensor_name(mac)
 
         # Record last data point for this sensor
         self.lock_sensor_list()
+        # A tag's advertisement is often received more than once
+        sequence = data.get("measurement_sequence_number")
+        previous = self._sensor_list.get(mac)
+        if sequence is not None and previous is not None and previous.get("measurement_sequence_number") == sequence:
+            _DUPLICATES.inc()
         self._sensor_list[mac] = data
+        self._sensor_versions[mac] = self._sensor_versions.get(mac, 0) + 1
+        self._data_version += 1
         self._pending_sensor_changes = True
         self.unlock_sensor_list()
 
+        # Log to DB and notify live sample observers
+        self._bus.publish(mac, data)
+        _SAMPLES_RECEIVED.inc()
+        _RECEIVE_TIME.stop(t)
+
+    def _get_sensor_name(self, mac):
+        """
+        The name of a sensor. A sensor seen for the first time (since the last
+        reset_sensor_list()) is registered in the DB.
+        :param mac: The mac of the sensor
+        :return: The sensor's name
+        """
+        name = self._sensor_names.get(mac)
+        if name is None:
+            sensor_rec = self._sensor_db.add_sensor(mac)
+            name = sensor_rec["name"] if sensor_rec is not None else "N/A"
+            self._sensor_names[mac] = name
+        return name
+
     def close_data_source(self):
+        if self._http_api is not None:
+            self._http_api.stop()
+            self._http_api = None
         self._sensor_data_source.close()
+        # Deliver what is still queued (DB and forwarder included)
+        self._bus.close()
+        self._db_writer = None
+        self._register_gauges(remove=True)
+        if self._reception_stats is not None:
+            # Save the partial period
+            self._reception_stats.flush()
+        self._listener_lock.acquire()
+        self._sample_listeners = {}
+        self._listener_lock.release()
+        if self._forwarder is not None:
+            self._forwarder.close()
+            self._forwarder = None
         self._logger.info("Data source closed")
 
+    def _register_gauges(self, remove=False):
+        """
+        Gauges read from this data source when the metrics are read
+        :param remove: Stop reading them (the last values are kept)
+        :return: None
+        """
+        db_writer = self._db_writer
+        db_path = self._sensor_db.db_path
+        gauges = [
+            ("bus.db_writer.depth", "Samples queued for the DB writer",
+             lambda: db_writer.metrics["depth"]),
+            ("bus.db_writer.dropped", "Samples the DB writer dropped",
+             lambda: db_writer.metrics["dropped"]),
+            ("db.size_bytes", "Size of the sensor DB file",
+             lambda: os.path.getsize(db_path)),
+            ("db.wal_size_bytes", "Size of the sensor DB write-ahead log",
+             lambda: os.path.getsize(db_path + "-wal") if os.path.exists(db_path + "-wal") else 0),
+            ("sensor_list.sensors", "Sensors in the sensor list",
+             lambda: len(self._sensor_list)),
+        ]
+        for name, description, function in gauges:
+            sensor_metrics.gauge(name, description).set_function(None if remove else function)
+
+    def trim_sensor_data(self):
+        """
+        Trim aged data records. The handler owns the DB, so it does the trimming.
+        :return: None
+        """
+        self._sensor_db.trim_sensor_data()
+
+    def add_sample_listener(self, listener):
+        """
+        Register an observer of the live sample stream. The listener is a
+        bus subscriber, called on its own thread. If it falls more than
+        SensorBus.DEFAULT_QUEUE_SIZE samples behind, the oldest are dropped.
+        :param listener: A callable taking (mac, data)
+        :return: None
+        """
+        self._listener_lock.acquire()
+        if listener not in self._sample_listeners:
+            name = getattr(listener, "__qualname__", type(listener).__name__)
+            self._sample_listeners[listener] = self._bus.subscribe(name, listener)
+        self._listener_lock.release()
+
+    def remove_sample_listener(self, listener):
+        """
+        Unregister an observer of the live sample stream
+        :param listener: A previously registered callable
+        :return: None
+        """
+        self._listener_lock.acquire()
+        subscription = self._sample_listeners.pop(listener, None)
+        self._listener_lock.release()
+        if subscription is not None:
+            self._bus.unsubscribe(subscription)
+
     def reset_sensor_list(self):
         """
         Reset the sensor list to allow a clean restart
         @return:
         """
+        self.lock_sensor_list()
         self._sensor_list = {}
+        # Sensor names may have been edited. Look them up again.
+        self._sensor_names = {}
+        self._data_version += 1
+        self.unlock_sensor_list()
 
-    def lock_sensor_list(self):
-        """
-        Acquire the list lock
-        :return: Locked sensor list
-        """
-        self._list_lock.acquire()
-        return self._sensor_list
-
-    def unlock_sensor_list(self):
+    @property
+    def bus_stats(self):
         """
-        Release the list lock
-        :return:
+        Metrics of the sample bus subscribers (DB writer and listeners)
+        :return: A dict of subscription metrics keyed by subscriber name
         """
-        self._list_lock.release()
+        return self._bus.stats
 
     @property
-    def pending_changes(self):
+    def reception_stats(self):
         """
-        Answers the question: Is there unhandled sensor data
-        :return: Returns True if there are pending sensor data changes
+        Reception quality of each sensor in the current period and since the data source was opened
+        :return: A list of dicts (see ReceptionStats.snapshot()). Empty if disabled.
         """
-        self._list_lock.acquire()
-        c = self._pending_sensor_changes
-        self._pending_sensor_changes = False
-        self._list_lock.release()
-        return c
+        if self._reception_stats is None:
+            return []
+        return self._reception_stats.snapshot()
+
+
+def create_data_source():
+    """
+    Create the data source selected by the configuration. The default is
+    a SensorDataSourceHandler that collects sensor data in this process.
+    "process" collects sensor data in a child process of this process.
+    :return: A data source instance
+    """
+    config = Configuration.get_configuration()
+    data_source = config.get(Configuration.CFG_DATA_SOURCE, "local").lower()
+    if data_source == "collector":
+        # Sensor data is collected by sensor_collector.py running as a separate process
+        from collector_data_source import CollectorDataSource
+        return CollectorDataSource()
+    if data_source == "process":
+        # Sensor data is collected by a child process started here
+        from process_data_source import ProcessDataSource
+        return ProcessDataSource()
+    return SensorDataSourceHandler()
@@ -12,26 +12,62 @@
 
 import os
 import datetime
+import time
+from itertools import groupby
 from configuration import Configuration
+from sensor_history_columns import SensorHistoryColumns
+import sensor_clock
+import sensor_metrics
+import sensor_db_timing
+from sensor_db_timing import TimedConnection
 import logging
 import sqlite3
 
 
+_ADD_SENSOR_TIME = sensor_metrics.histogram("db.add_sensor", "Registering a sensor")
+_ADD_DATA_TIME = sensor_metrics.histogram("db.add_sensor_data", "Writing one sample")
+_ADD_BATCH_TIME = sensor_metrics.histogram("db.add_sensor_data_batch", "Writing a batch of samples")
+_HISTORY_TIME = sensor_metrics.histogram("db.history_query", "Querying the history of a sensor")
+_TRIM_TIME = sensor_metrics.histogram("db.trim", "Trimming aged samples")
+_SAMPLES_WRITTEN = sensor_metrics.counter("db.samples_written", "Samples written to the DB")
+
+
 class SensorDB:
     """
     Sensor model (database)
     """
-    def __init__(self):
+    # Days of reception quality summaries kept by trim_sensor_data()
+    RECEPTION_STATS_DAYS = 30
+    # Naive datetimes stored in the DB are treated as UTC by SQLite date functions
+    _EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, db_path=None):
         """
         Construct a sensor model instance
+        :param db_path: Path of the DB file. The default is the configured sensor DB.
         """
         self._config = Configuration.get_configuration()
         self._logger = logging.getLogger("sensor_app")
-        self._db = self._config[Configuration.CFG_SENSOR_DATABASE]
+        self._db = db_path if db_path is not None else self._config[Configuration.CFG_SENSOR_DATABASE]
         self._database_timeout = self._config[Configuration.CFG_DATABASE_TIMEOUT]
         self._logger.debug(f"Database timout value: {self._database_timeout:f}")
+        sensor_db_timing.set_slow_query_threshold(
+            self._config.get(Configuration.CFG_SLOW_QUERY_THRESHOLD_MS,
+                             sensor_db_timing.DEFAULT_SLOW_QUERY_THRESHOLD_MS))
         self._init_db()
 
+    @property
+    def db_path(self):
+        return self._db
+
+    @staticmethod
+    def get_statement_stats():
+        """
+        Aggregate timings of the statements executed by all SensorDB instances of this process
+        :return: A list of dicts sorted by total time (see sensor_db_timing.statement_stats())
+        """
+        return sensor_db_timing.statement_stats()
+
     def _init_db(self):
         """
         Initialize the sensor DB. If it doesn't exist, create it.
@@ -44,6 +80,9 @@ class SensorDB:
             # Database needs to be created
             self._create_database()
             self._logger.info("Created database file: %s", self._db)
+        self._create_reception_stats_table()
+        self._create_indexes()
+        self._enable_wal()
 
     def _create_database(self):
         """
@@ -85,6 +124,69 @@ class SensorDB:
 
         conn.close()
 
+    def _create_reception_stats_table(self):
+        """
+        Create the table of periodic reception quality summaries (see
+        sensor_reception_stats.py) if it is missing. This covers databases
+        created before the table was added.
+        :return: None
+        """
+        conn = self._get_connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ReceptionStats ( \
+            id integer, \
+            sensor_id integer, \
+            period_start timestamp, \
+            period_end timestamp, \
+            packets integer, \
+            duplicates integer, \
+            lost integer, \
+            expected integer, \
+            restarts integer, \
+            packets_per_minute real, \
+            loss_pct real, \
+            longest_gap real, \
+            jitter real, \
+            tx_power integer, \
+            rssi_avg real, \
+            rssi_min integer, \
+            PRIMARY KEY(id), \
+            CONSTRAINT fk_sensors \
+                FOREIGN KEY (sensor_id) REFERENCES Sensors(id) ON DELETE CASCADE \
+            )"
+        )
+        conn.commit()
+        conn.close()
+
+    def _create_indexes(self):
+        """
+        Create any missing indexes. This covers databases created before an
+        index was added.
+        :return: None
+        """
+        conn = self._get_connection()
+        # Time range queries on a sensor's history
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS SensorData_sensor_time ON SensorData (sensor_id, data_time)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ReceptionStats_period_end ON ReceptionStats (period_end)"
+        )
+        conn.commit()
+        conn.close()
+
+    def _enable_wal(self):
+        """
+        Put the DB in write-ahead log mode. The collector and the GUI
+        clients may be separate processes. In WAL mode readers do not
+        block the writer and the writer does not block readers.
+        The mode is persistent, so this only changes a DB once.
+        :return: None
+        """
+        conn = self._get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
     def update_sensor_name(self, sensor_id, name):
         """
         Update the sensor name for an existing sensor
@@ -118,6 +220,7 @@ class SensorDB:
         :param mac: The sensor's mac
         :return: The inserted record
         """
+        t = _ADD_SENSOR_TIME.start()
         # Try to use config file to determine sensor name
         if mac in self._config[Configuration.CFG_RUUVITAGS]:
             name = self._config[Configuration.CFG_RUUVITAGS][mac]["name"]
@@ -133,6 +236,7 @@ class SensorDB:
                     self.update_sensor_name(sensor_rec["id"], name)
                     self._logger.info(f"Updated sensor id {sensor_rec['id']} from {sensor_rec['name']} to {name}")
                     sensor_rec = self._get_sensor_record(mac)
+            _ADD_SENSOR_TIME.stop(t)
             return sensor_rec
 
         # Since this mac has not been registered, add it to the table
@@ -161,6 +265,7 @@ class SensorDB:
             if conn is not None:
                 conn.close()
 
+        _ADD_SENSOR_TIME.stop(t)
         return sensor_rec
 
     def add_sensor_data(self, mac, data):
@@ -170,6 +275,7 @@ class SensorDB:
         :param data: Dict of key/value pairs (the sensor data)
         :return: Returns the record id
         """
+        t = _ADD_DATA_TIME.start()
         conn = None
         # TODO Handle unregistered sensor with no entry in the config file
         try:
@@ -189,6 +295,7 @@ class SensorDB:
 
             # Get id of inserted record
             id = c.lastrowid
+            _SAMPLES_WRITTEN.inc()
         except Exception as ex:
             self._logger.error(str(ex))
             id = None
@@ -197,8 +304,106 @@ class SensorDB:
             if conn is not None:
                 conn.close()
 
+        _ADD_DATA_TIME.stop(t)
         return id
 
+    def add_sensor_data_batch(self, samples):
+        """
+        Add several sensor data records to the SensorData table in one transaction
+        :param samples: A list of (mac, data) tuples like the add_sensor_data() parameters
+        :return: Returns the number of records added
+        """
+        t = _ADD_BATCH_TIME.start()
+        conn = None
+        try:
+            conn = self._get_connection()
+            c = self._get_cursor(conn)
+            c.executemany(
+                "INSERT INTO SensorData ("
+                "sensor_id,format,temperature,humidity,pressure,tx_power,battery,data_time)"
+                "values ((SELECT id FROM Sensors WHERE mac=? LIMIT 1), ?, ?, ?, ?, ?, ?, ?) ",
+                (
+                    (
+                        mac, data["data_format"], data["temperature"], data["humidity"],
+                        data["pressure"], data["tx_power"], data["battery"],
+                        data["timestamp"],
+                    )
+                    for mac, data in samples
+                )
+            )
+            conn.commit()
+            count = len(samples)
+            _SAMPLES_WRITTEN.inc(count)
+        except Exception as ex:
+            self._logger.error(str(ex))
+            count = 0
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+
+        _ADD_BATCH_TIME.stop(t)
+        return count
+
+    def add_reception_stats(self, rows):
+        """
+        Add reception quality summaries to the ReceptionStats table in one transaction
+        :param rows: A list of dicts as produced by ReceptionStats.flush(). Each has
+        the mac of its sensor and a value for every column.
+        :return: Returns the number of records added
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            c = self._get_cursor(conn)
+            c.executemany(
+                "INSERT INTO ReceptionStats ("
+                "sensor_id,period_start,period_end,packets,duplicates,lost,expected,restarts,"
+                "packets_per_minute,loss_pct,longest_gap,jitter,tx_power,rssi_avg,rssi_min)"
+                "values ((SELECT id FROM Sensors WHERE mac=:mac LIMIT 1), :period_start, :period_end, "
+                ":packets, :duplicates, :lost, :expected, :restarts, :packets_per_minute, :loss_pct, "
+                ":longest_gap, :jitter, :tx_power, :rssi_avg, :rssi_min)",
+                rows
+            )
+            conn.commit()
+            count = len(rows)
+        except Exception as ex:
+            self._logger.error(str(ex))
+            count = 0
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+
+        return count
+
+    def get_reception_stats(self, since):
+        """
+        Fetch reception quality summaries
+        @param since: Only periods ending at or after this time (datetime) are returned
+        @return: A list of dicts (the ReceptionStats columns plus mac and name) ordered
+        by period end or None if the query failed
+        """
+        conn = None
+        result = None
+        try:
+            conn = self._get_connection()
+            c = self._get_cursor(conn)
+            rset = c.execute(
+                "SELECT s.mac, s.name, r.* FROM ReceptionStats r JOIN Sensors s ON r.sensor_id=s.id "
+                "WHERE r.period_end>=:since ORDER BY r.period_end",
+                {"since": str(since)}
+            )
+            result = SensorDB._rows_to_dict_list(rset)
+        except Exception as ex:
+            self._logger.error("Exception querying reception stats")
+            self._logger.error(str(ex))
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        return result
+
     def reset_sensor_data(self):
         """
         Delete all sensor data records
@@ -216,22 +421,40 @@ class SensorDB:
         :param time_period_hours: All records older than this value are deleted
         :return: None
         """
-        trim_time = datetime.datetime.now() - datetime.timedelta(hours=time_period_hours)
+        trim_time = sensor_clock.now() - datetime.timedelta(hours=time_period_hours)
         conn = self._get_connection()
         c = self._get_cursor(conn)
-        start = datetime.datetime.now()
+        start = time.perf_counter()
         c.execute("DELETE FROM SensorData where data_time<?", (str(trim_time),))
         conn.commit()
-        elapsed = datetime.datetime.now() - start
+        elapsed = time.perf_counter() - start
+        _TRIM_TIME.observe(elapsed)
         # It's not clear how long this will take on a RaspberryPi 3 or 4.
         # It is expected that the database will get as large as 40-50 MB.
-        self._logger.info(f"Sensor data trimmed in {elapsed.total_seconds():f} sec")
+        self._logger.info(f"Sensor data trimmed in {elapsed:f} sec")
+
+        # Reception summaries are small and kept longer, to show trends
+        stats_trim_time = sensor_clock.now() - datetime.timedelta(days=SensorDB.RECEPTION_STATS_DAYS)
+        c.execute("DELETE FROM ReceptionStats where period_end<?", (str(stats_trim_time),))
+        conn.commit()
 
         rset = c.execute("SELECT COUNT(*) as record_count FROM SensorData")
         result = rset.fetchone()["record_count"]
         self._logger.info(f"Sensor DB record count after trimming: {result}")
 
         conn.close()
+        self._log_statement_stats()
+
+    def _log_statement_stats(self, top=5):
+        """
+        Log the statements that took the most time so far
+        :param top: Number of statements logged
+        :return: None
+        """
+        for s in SensorDB.get_statement_stats()[:top]:
+            self._logger.info(f"Statement total {s['total_ms']:.1f} ms, {s['count']} times, "
+                              f"mean {s['mean_ms']:.3f} ms, max {s['max_ms']:.3f} ms, {s['slow']} slow: "
+                              f"{s['statement'][:120]}")
 
     def _get_sensor_record(self, mac):
         """
@@ -332,13 +555,117 @@ class SensorDB:
             if conn is not None:
                 conn.close()
 
-    def get_sensor_history(self, mac, progress_dlg=None):
+    def get_latest_sensor_data(self):
+        """
+        Fetch the most recent data record of every sensor
+        @return: A list of sensor data dicts (see _row_to_sensor_data) or None if the query failed
+        """
+        return self._query_sensor_data(
+            "WHERE d.id IN (SELECT MAX(id) FROM SensorData GROUP BY sensor_id)",
+            {}
+        )
+
+    def get_sensor_data_since(self, since_id):
+        """
+        Fetch all sensor data records added after a given record
+        @param since_id: Records with an id greater than this are returned
+        @return: A list of sensor data dicts (see _row_to_sensor_data) in id order
+        or None if the query failed
+        """
+        return self._query_sensor_data("WHERE d.id>:since_id", {"since_id": since_id})
+
+    def get_sensor_data_export(self, since_id, limit):
+        """
+        Fetch a chunk of sensor data records for copying to another DB
+        @param since_id: Records with an id greater than this are returned
+        @param limit: Maximum number of records
+        @return: A list of (id, mac, name, format, temperature, humidity, pressure,
+        tx_power, battery, data_time) tuples in id order or None if the query failed.
+        data_time is as stored.
+        """
+        conn = None
+        result = None
+        try:
+            conn = self._get_connection()
+            conn.row_factory = None
+            c = self._get_cursor(conn)
+            rset = c.execute(
+                "SELECT d.id, s.mac, s.name, d.format, d.temperature, d.humidity, d.pressure, "
+                "d.tx_power, d.battery, d.data_time "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                "WHERE d.id>:since_id ORDER BY d.id LIMIT :limit",
+                {"since_id": since_id, "limit": limit}
+            )
+            result = rset.fetchall()
+        except Exception as ex:
+            self._logger.error("Exception exporting sensor data")
+            self._logger.error(str(ex))
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        return result
+
+    def _query_sensor_data(self, where_clause, params):
+        """
+        Fetch sensor data records joined with their sensor
+        @param where_clause: SQL WHERE clause using d (SensorData) and s (Sensors)
+        @param params: Query parameters
+        @return: A list of sensor data dicts in id order or None if the query failed
+        """
+        conn = None
+        result = None
+        try:
+            conn = self._get_connection()
+            c = self._get_cursor(conn)
+            rset = c.execute(
+                "SELECT d.id, s.mac, s.name, d.format, d.temperature, d.humidity, d.pressure, "
+                "d.tx_power, d.battery, d.data_time "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                f"{where_clause} ORDER BY d.id",
+                params
+            )
+            result = [SensorDB._row_to_sensor_data(row) for row in rset.fetchall()]
+        except Exception as ex:
+            self._logger.error("Exception querying sensor data")
+            self._logger.error(str(ex))
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        return result
+
+    @classmethod
+    def _row_to_sensor_data(cls, row):
+        """
+        Convert a joined SensorData/Sensors row to a sensor data dict
+        with the same keys as a sample received from a sensor
+        :param row: The row to be converted
+        :return: A sensor data dict. The record id is under the "id" key.
+        """
+        return {
+            "id": row["id"],
+            "mac": row["mac"],
+            "name": row["name"],
+            "data_format": row["format"],
+            "temperature": row["temperature"],
+            "humidity": row["humidity"],
+            "pressure": row["pressure"],
+            "tx_power": row["tx_power"],
+            "battery": row["battery"],
+            "timestamp": SensorHistoryColumns.parse_data_time(row["data_time"]),
+        }
+
+    def get_sensor_history(self, mac, progress_dlg=None, since_id=0):
         """
         Fetch all of the interesting sensor history
         @param mac: The sensor of interest
         @param progress_dlg: Optional progress dialog for reporting query progress
-        @return: A list of dicts where each list item is a DB record
+        @param since_id: Only records with an id greater than this value are returned.
+        The default (0) returns all records.
+        @return: A list of dicts where each list item is a DB record, ordered by id
         """
+        t = _HISTORY_TIME.start()
         # Find the sensor record for this sensor
         sensor_rec = self._get_sensor_record(mac)
 
@@ -350,31 +677,178 @@ class SensorDB:
             conn = self._get_connection()
             c = self._get_cursor(conn)
             rset = c.execute(
-                "SELECT temperature, humidity, data_time FROM SensorData WHERE sensor_id=:id",
-                {"id": sensor_rec["id"]}
+                "SELECT id, temperature, humidity, data_time FROM SensorData "
+                "WHERE sensor_id=:id AND id>:since_id ORDER BY id",
+                {"id": sensor_rec["id"], "since_id": since_id}
             )
             if progress_dlg is not None:
                 progress_dlg.Pulse(f"Converting result rows to dictionary {mac}")
             result = SensorDB._rows_to_dict_list(rset)
-            # Convert data_time from str to a datetime
-            row_counter = 0
-            for r in result:
-                if row_counter % 100 == 0:
-                    if progress_dlg is not None:
-                        progress_dlg.Pulse(f"Processing record {row_counter} of {len(result)}")
-                # Cover case when timestamp has no fraction of a second
-                if "." in r["data_time"]:
-                    r["data_time"] = datetime.datetime.strptime(r["data_time"], "%Y-%m-%d %H:%M:%S.%f")
-                else:
-                    r["data_time"] = datetime.datetime.strptime(r["data_time"], "%Y-%m-%d %H:%M:%S")
-                row_counter += 1
+            SensorDB._convert_data_times(result, progress_dlg=progress_dlg)
+        except Exception as ex:
+            self._logger.error(f"Exception querying sensor history for {mac}")
+            self._logger.error(str(ex))
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        _HISTORY_TIME.stop(t)
+        return result
+
+    def get_sensor_history_columns(self, mac, progress_dlg=None, since_id=0):
+        """
+        Fetch the history of all stored metrics of a sensor in one pass.
+        Unlike get_sensor_history, the records are not converted to dicts.
+        @param mac: The sensor of interest
+        @param progress_dlg: Optional progress dialog for reporting query progress
+        @param since_id: Only records with an id greater than this value are returned.
+        The default (0) returns all records.
+        @return: A SensorHistoryColumns instance in data_time order or None if the query failed
+        """
+        t = _HISTORY_TIME.start()
+        conn = None
+        result = None
+        try:
+            if progress_dlg is not None:
+                progress_dlg.Pulse(f"Querying history for {mac}")
+            conn = self._get_connection()
+            # Plain tuples are all that is needed here
+            conn.row_factory = None
+            c = self._get_cursor(conn)
+            c.execute(
+                "SELECT d.id, d.temperature, d.humidity, d.pressure, d.data_time "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                "WHERE s.mac=:mac AND d.id>:since_id ORDER BY d.data_time",
+                {"mac": mac, "since_id": since_id}
+            )
+            result = SensorHistoryColumns()
+            SensorDB._fetch_columns(c, lambda row: result, progress_dlg=progress_dlg)
         except Exception as ex:
             self._logger.error(f"Exception querying sensor history for {mac}")
             self._logger.error(str(ex))
+            result = None
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        _HISTORY_TIME.stop(t)
+        return result
+
+    def get_sensor_history_range(self, mac, start_time, end_time):
+        """
+        Fetch the raw history of a sensor for a time range
+        @param mac: The sensor of interest
+        @param start_time: Start of the range (datetime, inclusive)
+        @param end_time: End of the range (datetime, exclusive)
+        @return: A SensorHistoryColumns instance or None if the query failed
+        """
+        t = _HISTORY_TIME.start()
+        conn = None
+        result = None
+        try:
+            conn = self._get_connection()
+            conn.row_factory = None
+            c = self._get_cursor(conn)
+            c.execute(
+                "SELECT d.id, d.temperature, d.humidity, d.pressure, d.data_time "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                "WHERE s.mac=:mac AND d.data_time>=:start AND d.data_time<:end ORDER BY d.data_time",
+                {"mac": mac, "start": str(start_time), "end": str(end_time)}
+            )
+            result = SensorHistoryColumns()
+            SensorDB._fetch_columns(c, lambda row: result)
+        except Exception as ex:
+            self._logger.error(f"Exception querying sensor history range for {mac}")
+            self._logger.error(str(ex))
+            result = None
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        _HISTORY_TIME.stop(t)
+        return result
+
+    def get_sensor_history_buckets(self, mac, start_time, end_time, bucket_seconds):
+        """
+        Fetch the history of a sensor for a time range, aggregated into fixed length
+        time buckets. Each bucket holds the average of each metric in the bucket.
+        Only buckets containing samples are returned.
+        @param mac: The sensor of interest
+        @param start_time: Start of the range (datetime, inclusive)
+        @param end_time: End of the range (datetime, exclusive)
+        @param bucket_seconds: Length of a bucket in seconds
+        @return: A SensorHistoryColumns instance where the id of each record is the
+        bucket number and the data_time is the start of the bucket. None if the query failed.
+        """
+        t = _HISTORY_TIME.start()
+        conn = None
+        result = None
+        try:
+            conn = self._get_connection()
+            conn.row_factory = None
+            c = self._get_cursor(conn)
+            # strftime('%s') treats the stored (local) time as UTC. That is
+            # undone when the bucket number is converted back to a datetime.
+            c.execute(
+                "SELECT CAST(strftime('%s', d.data_time) AS INTEGER) / :bucket_seconds AS bucket, "
+                "AVG(d.temperature), AVG(d.humidity), AVG(d.pressure) "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                "WHERE s.mac=:mac AND d.data_time>=:start AND d.data_time<:end "
+                "GROUP BY bucket ORDER BY bucket",
+                {"mac": mac, "start": str(start_time), "end": str(end_time),
+                 "bucket_seconds": int(bucket_seconds)}
+            )
+            result = SensorHistoryColumns()
+            for row in c.fetchall():
+                bucket_time = SensorDB._EPOCH + datetime.timedelta(seconds=row[0] * int(bucket_seconds))
+                result.append_row(row[0], row[1], row[2], row[3], bucket_time)
+        except Exception as ex:
+            self._logger.error(f"Exception querying sensor history buckets for {mac}")
+            self._logger.error(str(ex))
+            result = None
+        finally:
+            # Make sure connection is closed
+            if conn is not None:
+                conn.close()
+        _HISTORY_TIME.stop(t)
+        return result
+
+    def get_multi_sensor_history(self, macs, progress_dlg=None):
+        """
+        Fetch the history of several sensors in a single query
+        @param macs: A list of the sensors of interest
+        @param progress_dlg: Optional progress dialog for reporting query progress
+        @return: A dict keyed by mac where each value is a SensorHistoryColumns instance.
+        Sensors without history have an empty history.
+        """
+        t = _HISTORY_TIME.start()
+        conn = None
+        result = None
+        try:
+            if progress_dlg is not None:
+                progress_dlg.Pulse(f"Querying history for {len(macs)} sensors")
+            conn = self._get_connection()
+            conn.row_factory = None
+            c = self._get_cursor(conn)
+            placeholders = ",".join(["?"] * len(macs))
+            c.execute(
+                "SELECT d.id, d.temperature, d.humidity, d.pressure, d.data_time, s.mac "
+                "FROM SensorData d JOIN Sensors s ON d.sensor_id=s.id "
+                f"WHERE s.mac IN ({placeholders}) ORDER BY s.mac, d.data_time",
+                tuple(macs)
+            )
+            histories = {mac: SensorHistoryColumns() for mac in macs}
+            # The last column (mac) selects the history the row belongs to
+            SensorDB._fetch_columns(c, lambda row: histories[row[5]], progress_dlg=progress_dlg)
+            result = histories
+        except Exception as ex:
+            self._logger.error(f"Exception querying sensor history for {macs}")
+            self._logger.error(str(ex))
         finally:
             # Make sure connection is closed
             if conn is not None:
                 conn.close()
+        _HISTORY_TIME.stop(t)
         return result
 
     def _get_connection(self):
@@ -386,7 +860,8 @@ class SensorDB:
         # In the current design, a connection is opened and closed for each DB operation.
         # This may be effective enough. But, it may not.
         # TODO Make timeout value a config setting
-        conn = sqlite3.connect(self._db, timeout=self._database_timeout)
+        # Every statement is timed and slow ones are logged (sensor_db_timing.py)
+        conn = sqlite3.connect(self._db, timeout=self._database_timeout, factory=TimedConnection)
         # We use the row factory to get named row columns. Makes handling row sets easier.
         conn.row_factory = sqlite3.Row
         # The default string type is unicode. This changes it to UTF-8.
@@ -416,6 +891,44 @@ class SensorDB:
             dl.append(cls._row_to_dict(row))
         return dl
 
+    @classmethod
+    def _fetch_columns(cls, cursor, history_for_row, progress_dlg=None):
+        """
+        Append the rows of an executed history query to SensorHistoryColumns instances
+        :param cursor: A cursor on an executed query whose first five columns are
+        id, temperature, humidity, pressure and data_time
+        :param history_for_row: A callable returning the SensorHistoryColumns for a row
+        :param progress_dlg: Optional progress dialog for reporting progress
+        :return: None
+        """
+        row_counter = 0
+        while True:
+            rows = cursor.fetchmany(1000)
+            if len(rows) == 0:
+                break
+            if progress_dlg is not None:
+                progress_dlg.Pulse(f"Processing record {row_counter}")
+            # Rows are grouped by sensor, so each run of rows is appended as a batch
+            for history, run in groupby(rows, key=history_for_row):
+                history.append_rows([row[:5] for row in run])
+            row_counter += len(rows)
+
+    @classmethod
+    def _convert_data_times(cls, rows, progress_dlg=None):
+        """
+        Convert the data_time of each record from str to a datetime
+        :param rows: A list of record dicts. The records are updated in place.
+        :param progress_dlg: Optional progress dialog for reporting progress
+        :return: None
+        """
+        row_counter = 0
+        for r in rows:
+            if row_counter % 100 == 0:
+                if progress_dlg is not None:
+                    progress_dlg.Pulse(f"Processing record {row_counter} of {len(rows)}")
+            r["data_time"] = SensorHistoryColumns.parse_data_time(r["data_time"])
+            row_counter += 1
+
     @classmethod
     def _row_to_dict(cls, row):
         """
@@ -0,0 +1,298 @@
+#
+# sensor_db_sync.py - Merge the sensor DBs of several collectors
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copies new SensorData records from peer DBs into an aggregate DB. A peer
+# is either a sensor DB file or the HTTP API (see sensor_http_api.py) of a
+# collector. For each peer, the aggregate DB's SyncPeers table holds the id
+# of the last record copied (the high-water mark). Sensor ids differ from DB
+# to DB, so records are matched to the aggregate's Sensors by mac. Sensors
+# new to the aggregate are added.
+#
+# Records are copied in chunks. Each chunk and the new high-water mark are
+# committed in one transaction, so an interrupted sync resumes where the
+# last committed chunk ended without duplicating records. A DB file peer is
+# ATTACHed and copied with INSERT ... SELECT, so records never pass through
+# Python. An HTTP peer is fetched one chunk at a time.
+#
+# Usage:
+#   python sensor_db_sync.py AGGREGATE_DB PEER [PEER ...] [--chunk ROWS] [--interval SECONDS]
+#     PEER        A sensor DB file or a URL like http://garage-pi:8080
+#     --chunk     Records per transaction (default 50000)
+#     --interval  Repeat the sync every SECONDS until interrupted
+#
+
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sqlite3
+import time
+import urllib.parse
+import urllib.request
+from threading import Event
+from configuration import Configuration
+import app_logger
+from sensor_db import SensorDB
+import sensor_clock
+
+
+class SensorDBSync:
+    """
+    Incrementally copies SensorData records from peers into an aggregate DB
+    """
+    DEFAULT_CHUNK_ROWS = 50000
+    HTTP_TIMEOUT = 60.0
+
+    def __init__(self, aggregate_path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        :param aggregate_path: Path of the aggregate DB. It is created if it does not exist.
+        :param chunk_rows: Records per transaction
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._aggregate_path = aggregate_path
+        self._chunk_rows = chunk_rows
+        self._terminate = Event()
+        config = Configuration.get_configuration()
+        self._database_timeout = config[Configuration.CFG_DATABASE_TIMEOUT]
+        # Creates the sensor DB tables and indexes if needed
+        SensorDB(db_path=aggregate_path)
+        self._create_sync_table()
+
+    def sync_peer(self, peer):
+        """
+        Copy the records a peer has added since the last sync
+        :param peer: A sensor DB file path or an http(s) URL
+        :return: The number of records copied
+        """
+        if peer.startswith("http://") or peer.startswith("https://"):
+            return self._sync_http_peer(peer.rstrip("/"))
+        return self._sync_file_peer(os.path.abspath(peer))
+
+    def stop(self):
+        """
+        Stop syncing after the current chunk. Safe to call from a signal handler.
+        :return: None
+        """
+        self._terminate.set()
+
+    def get_sync_status(self):
+        """
+        The sync state of every peer
+        :return: A list of dicts with the keys peer, last_id, rows_synced and last_sync
+        """
+        conn = self._get_connection()
+        try:
+            rows = conn.execute("SELECT peer, last_id, rows_synced, last_sync FROM SyncPeers ORDER BY peer").fetchall()
+        finally:
+            conn.close()
+        return [{"peer": r[0], "last_id": r[1], "rows_synced": r[2], "last_sync": r[3]} for r in rows]
+
+    def _sync_file_peer(self, path):
+        """
+        Copy new records from a sensor DB file
+        :param path: Absolute path of the peer DB
+        :return: The number of records copied
+        """
+        if not os.path.isfile(path):
+            self._logger.error(f"Peer DB {path} does not exist")
+            return 0
+
+        total = 0
+        conn = self._get_connection()
+        try:
+            # Read only, so the peer's collector is never blocked by the sync
+            conn.execute("ATTACH DATABASE ? AS peer", (f"file:{urllib.parse.quote(path)}?mode=ro",))
+            high_water_mark = self._get_high_water_mark(conn, path)
+            peer_max_id = conn.execute("SELECT MAX(id) FROM peer.SensorData").fetchone()[0]
+            if peer_max_id is not None and peer_max_id < high_water_mark:
+                self._logger.warning(f"Peer {path} has no records past the high-water mark {high_water_mark}. "
+                                     "Was the peer DB replaced?")
+                return 0
+
+            while not self._terminate.is_set():
+                start = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("INSERT OR IGNORE INTO main.Sensors (mac, name) SELECT mac, name FROM peer.Sensors")
+                    upper_id = conn.execute(
+                        "SELECT MAX(id) FROM (SELECT id FROM peer.SensorData WHERE id>:hwm ORDER BY id LIMIT :chunk)",
+                        {"hwm": high_water_mark, "chunk": self._chunk_rows}
+                    ).fetchone()[0]
+                    if upper_id is None:
+                        conn.execute("ROLLBACK")
+                        break
+                    c = conn.execute(
+                        "INSERT INTO main.SensorData "
+                        "(sensor_id, format, temperature, humidity, pressure, tx_power, battery, data_time) "
+                        "SELECT a.id, d.format, d.temperature, d.humidity, d.pressure, d.tx_power, d.battery, "
+                        "d.data_time "
+                        "FROM peer.SensorData d JOIN peer.Sensors ps ON d.sensor_id=ps.id "
+                        "JOIN main.Sensors a ON a.mac=ps.mac "
+                        "WHERE d.id>:hwm AND d.id<=:upper ORDER BY d.id",
+                        {"hwm": high_water_mark, "upper": upper_id}
+                    )
+                    rows = c.rowcount
+                    self._set_high_water_mark(conn, path, upper_id, rows)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                high_water_mark = upper_id
+                total += rows
+                self._log_chunk(path, rows, high_water_mark, start)
+        finally:
+            conn.close()
+        return total
+
+    def _sync_http_peer(self, url):
+        """
+        Copy new records from a collector's HTTP API
+        :param url: Base URL of the peer's API
+        :return: The number of records copied
+        """
+        total = 0
+        conn = self._get_connection()
+        try:
+            high_water_mark = self._get_high_water_mark(conn, url)
+            sensor_ids = {}
+            while not self._terminate.is_set():
+                start = time.perf_counter()
+                query = urllib.parse.urlencode({"since_id": high_water_mark, "limit": self._chunk_rows})
+                with urllib.request.urlopen(f"{url}/export?{query}", timeout=SensorDBSync.HTTP_TIMEOUT) as response:
+                    chunk = json.loads(response.read())
+                rows = chunk["rows"]
+                if len(rows) == 0:
+                    break
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for row in rows:
+                        mac = row[1]
+                        if mac not in sensor_ids:
+                            conn.execute("INSERT OR IGNORE INTO Sensors (mac, name) VALUES (?, ?)", (mac, row[2]))
+                            sensor_ids[mac] = conn.execute("SELECT id FROM Sensors WHERE mac=?", (mac,)).fetchone()[0]
+                    conn.executemany(
+                        "INSERT INTO SensorData "
+                        "(sensor_id, format, temperature, humidity, pressure, tx_power, battery, data_time) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        ((sensor_ids[r[1]], r[3], r[4], r[5], r[6], r[7], r[8], r[9]) for r in rows)
+                    )
+                    self._set_high_water_mark(conn, url, chunk["last_id"], len(rows))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                high_water_mark = chunk["last_id"]
+                total += len(rows)
+                self._log_chunk(url, len(rows), high_water_mark, start)
+                if not chunk["more"]:
+                    break
+        finally:
+            conn.close()
+        return total
+
+    def _create_sync_table(self):
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS SyncPeers ( \
+                peer text, \
+                last_id integer, \
+                rows_synced integer, \
+                last_sync timestamp, \
+                PRIMARY KEY(peer) )"
+            )
+        finally:
+            conn.close()
+
+    def _get_high_water_mark(self, conn, peer):
+        row = conn.execute("SELECT last_id FROM SyncPeers WHERE peer=?", (peer,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _set_high_water_mark(self, conn, peer, last_id, rows):
+        """
+        Record the last record copied from a peer. Must be in the same
+        transaction as the copied records.
+        """
+        conn.execute(
+            "INSERT INTO SyncPeers (peer, last_id, rows_synced, last_sync) VALUES (:peer, :last_id, :rows, :now) "
+            "ON CONFLICT(peer) DO UPDATE SET last_id=:last_id, rows_synced=rows_synced+:rows, last_sync=:now",
+            {"peer": peer, "last_id": last_id, "rows": rows, "now": str(sensor_clock.now())}
+        )
+
+    def _log_chunk(self, peer, rows, high_water_mark, start):
+        elapsed = time.perf_counter() - start
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        self._logger.info(f"Synced {rows} records from {peer} up to id {high_water_mark} ({rate:.0f} records/s)")
+
+    def _get_connection(self):
+        """
+        A connection to the aggregate DB. Transactions are managed explicitly.
+        :return: A Connection instance
+        """
+        conn = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(self._aggregate_path))}",
+                               uri=True, timeout=self._database_timeout, isolation_level=None)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the sensor DBs of several collectors")
+    parser.add_argument("aggregate", help="Aggregate sensor DB file")
+    parser.add_argument("peers", nargs="+", help="Peer sensor DB files or http(s) URLs of collector HTTP APIs")
+    parser.add_argument("--chunk", type=int, default=SensorDBSync.DEFAULT_CHUNK_ROWS, help="Records per transaction")
+    parser.add_argument("--interval", type=float, default=None, help="Repeat the sync every INTERVAL seconds")
+    args = parser.parse_args()
+
+    Configuration.load_configuration()
+    app_logger.start("sensor_app", logfile="sensor_db_sync.log")
+    logger = logging.getLogger("sensor_app")
+
+    sync = SensorDBSync(args.aggregate, chunk_rows=args.chunk)
+    terminate = Event()
+
+    def _handle_signal(signum, frame):
+        terminate.set()
+        sync.stop()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    while not terminate.is_set():
+        for peer in args.peers:
+            try:
+                start = time.perf_counter()
+                rows = sync.sync_peer(peer)
+                print(f"{peer}: {rows} records in {time.perf_counter() - start:.1f} s")
+            except Exception as ex:
+                # Whatever was committed is kept. The next sync resumes from there.
+                logger.error(f"Sync of {peer} failed")
+                logger.error(str(ex))
+                print(f"{peer}: failed ({str(ex)})")
+            if terminate.is_set():
+                break
+        if args.interval is None or terminate.wait(args.interval):
+            break
+
+    for status in sync.get_sync_status():
+        print(f"{status['peer']}: last id {status['last_id']}, {status['rows_synced']} records, "
+              f"last sync {status['last_sync']}")
+    app_logger.shut_down()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#
+# sensor_db_timing.py - Statement timing and slow query log for SensorDB
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# SensorDB opens its connections with TimedConnection as the factory. Every
+# statement is timed, from execute() through the fetches of its rows (the
+# caller's own work between fetches is not counted), and so is every commit.
+# Timings are aggregated per statement shape (the SQL with whitespace
+# collapsed; parameters are bound, so the SQL is the shape).
+#
+# A statement taking longer than "slow_query_threshold_ms" is logged as a
+# warning with its parameters. The first time a shape is slow, its
+# EXPLAIN QUERY PLAN is captured and logged with it. A plan that scans a whole
+# table (e.g. "SCAN SensorData" instead of "SEARCH SensorData USING INDEX")
+# is pointed out.
+#
+# statement_stats() returns the aggregates. SensorDB logs the top statements
+# when it trims the DB.
+#
+
+
+import logging
+import sqlite3
+import time
+from threading import Lock
+import sensor_metrics
+
+
+# Default slow query threshold in ms
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 200.0
+# Longest parameter text in a slow query log entry
+MAX_PARAMS_LENGTH = 200
+
+_slow_threshold = DEFAULT_SLOW_QUERY_THRESHOLD_MS / 1000.0
+_stats = {}
+_stats_lock = Lock()
+# Statements with a query plan
+_EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+# Shape of each SQL string seen, so the SQL is only normalized once
+_shapes = {}
+
+_SLOW_QUERIES = sensor_metrics.counter("db.slow_queries", "Statements slower than slow_query_threshold_ms")
+
+
+def set_slow_query_threshold(threshold_ms):
+    """
+    :param threshold_ms: Statements taking longer than this are logged. 0 disables the log.
+    :return: None
+    """
+    global _slow_threshold
+    _slow_threshold = float(threshold_ms) / 1000.0 if threshold_ms else None
+
+
+class StatementStats:
+    """
+    Aggregate timings of one statement shape
+    """
+    __slots__ = ("shape", "count", "total", "max", "rows", "slow", "plan", "full_scan")
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        # EXPLAIN QUERY PLAN lines, captured the first time the statement is slow
+        self.plan = None
+        self.full_scan = False
+
+    def as_dict(self):
+        return {
+            "statement": self.shape,
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_ms": self.total * 1e3 / self.count if self.count > 0 else 0.0,
+            "max_ms": self.max * 1e3,
+            "rows": self.rows,
+            "slow": self.slow,
+            "plan": self.plan,
+            "full_scan": self.full_scan,
+        }
+
+
+def statement_stats():
+    """
+    Aggregate timings of every statement shape executed in this process
+    :return: A list of dicts (statement, count, total_ms, mean_ms, max_ms, rows, slow,
+    plan, full_scan) sorted by total time, highest first
+    """
+    _stats_lock.acquire()
+    result = [s.as_dict() for s in _stats.values()]
+    _stats_lock.release()
+    result.sort(key=lambda s: -s["total_ms"])
+    return result
+
+
+def reset_statement_stats():
+    _stats_lock.acquire()
+    _stats.clear()
+    _stats_lock.release()
+
+
+def _shape(sql):
+    shape = _shapes.get(sql)
+    if shape is None:
+        shape = " ".join(sql.split())
+        _shapes[sql] = shape
+    return shape
+
+
+def _params_text(params, many):
+    if many:
+        text = f"{params} rows"
+    else:
+        text = repr(params)
+    if len(text) > MAX_PARAMS_LENGTH:
+        text = text[:MAX_PARAMS_LENGTH] + "..."
+    return text
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A cursor that times its statements
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The statement being timed: shape, SQL, parameters, executemany row count and time so far
+        self._timed = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._timed = [sql, parameters, None, time.perf_counter() - start, 0]
+        # Statements without a result set are complete
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        first = []
+        count = 0
+
+        def _capture(rows):
+            # The first row of parameters is kept for the query plan
+            nonlocal count
+            for row in rows:
+                if count == 0:
+                    first.append(row)
+                count += 1
+                yield row
+
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, _capture(seq_of_parameters))
+        finally:
+            self._timed = [sql, first[0] if len(first) > 0 else (), count, time.perf_counter() - start, 0]
+            self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add_fetch(time.perf_counter() - start, 0 if row is None else 1)
+        # A single row lookup is done after its first fetch
+        self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add_fetch(time.perf_counter() - start, len(rows))
+        if len(rows) < (self.arraysize if size is None else size):
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add_fetch(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def _add_fetch(self, elapsed, rows):
+        if self._timed is not None:
+            self._timed[3] += elapsed
+            self._timed[4] += rows
+
+    def _finish(self):
+        """
+        Record the timing of the current statement
+        :return: None
+        """
+        timed = self._timed
+        if timed is None:
+            return
+        self._timed = None
+        sql, parameters, many, elapsed, rows = timed
+        _record(self.connection, sql, parameters, many, elapsed, rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection whose cursors and commits are timed
+    """
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The built in shortcuts don't create their cursor with cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        _record(self, "COMMIT", (), None, time.perf_counter() - start, 0)
+
+
+def _record(conn, sql, parameters, many, elapsed, rows):
+    """
+    Add a statement timing to the aggregates, and log it if it was slow
+    :param conn: The connection the statement ran on, for the query plan
+    :param sql: The statement
+    :param parameters: Its parameters (the first row of an executemany)
+    :param many: The row count of an executemany, otherwise None
+    :param elapsed: Seconds
+    :param rows: Rows fetched
+    :return: None
+    """
+    shape = _shape(sql)
+    _stats_lock.acquire()
+    stats = _stats.get(shape)
+    if stats is None:
+        stats = StatementStats(shape)
+        _stats[shape] = stats
+    stats.count += 1
+    stats.total += elapsed
+    stats.rows += rows
+    if elapsed > stats.max:
+        stats.max = elapsed
+    slow = _slow_threshold is not None and elapsed > _slow_threshold
+    first_slow = False
+    if slow:
+        stats.slow += 1
+        first_slow = stats.plan is None and shape[:7].upper().startswith(_EXPLAINED)
+        if first_slow:
+            # Claim the plan capture for this thread
+            stats.plan = []
+    _stats_lock.release()
+    if not slow:
+        return
+
+    _SLOW_QUERIES.inc()
+    logger = logging.getLogger("sensor_app")
+    logger.warning(f"Slow query {elapsed * 1e3:.1f} ms, {rows} rows: {shape} "
+                   f"[{_params_text(many if many is not None else parameters, many is not None)}]")
+    if first_slow:
+        plan = _explain(conn, sql, parameters)
+        stats.plan = plan
+        stats.full_scan = any(line.startswith("SCAN ") and " USING " not in line for line in plan)
+        for line in plan:
+            logger.warning(f"  Query plan: {line}")
+        if stats.full_scan:
+            logger.warning("  The plan scans a whole table. An index may be missing.")
+
+
+def _explain(conn, sql, parameters):
+    """
+    Capture the query plan of a statement
+    :return: A list of plan lines, indented by depth
+    """
+    try:
+        # A plain cursor, so the EXPLAIN is not timed itself
+        c = conn.cursor(sqlite3.Cursor)
+        rows = c.execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        c.close()
+    except Exception as ex:
+        return [f"(not available: {ex})"]
+    # Rows are (id, parent, notused, detail)
+    depths = {0: -1}
+    plan = []
+    for row in rows:
+        depth = depths.get(row[1], -1) + 1
+        depths[row[0]] = depth
+        plan.append("  " * depth + str(row[3]))
+    return plan
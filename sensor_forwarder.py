@@ -0,0 +1,423 @@
+#
+# sensor_forwarder.py - Forward sensor samples to a central store
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The forwarder listens to the live sample stream and POSTs the samples, in
+# batches, to an HTTP endpoint (e.g. a time series DB). Each sample is one
+# line, either JSON ("json") or InfluxDB line protocol ("line"), and the
+# request body is gzip compressed.
+#
+# The sample listener only formats the sample and adds it to an in-memory
+# buffer. A sender thread does all network and file I/O. When a POST fails,
+# the batch is appended to a local spool and the sender backs off
+# (exponentially, with jitter) before trying again. While the link is down,
+# full batches go straight to the spool. Once a POST succeeds, the spool is
+# replayed, oldest first, before new samples are sent.
+#
+# The spool is two append-only files: <spool> receives new batches and
+# <spool>.1 is a closed segment being replayed. The position reached in the
+# closed segment is kept in <spool>.pos so a restart does not send it again.
+# When the open segment would exceed half of the size limit, it becomes the
+# closed segment. If there already is a closed segment, it is dropped. So
+# the spool never exceeds its size limit and, when the link is down for a
+# long time, the oldest samples are lost first.
+#
+
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from threading import Thread, Condition
+from configuration import Configuration
+import sensor_clock
+
+
+class SensorForwarder:
+    """
+    Batches samples and POSTs them to an HTTP endpoint, spooling while the link is down
+    """
+    FORMAT_JSON = "json"
+    FORMAT_LINE = "line"
+    DEFAULT_SPOOL_FILE = "sensor_forwarder.spool"
+    # Retry delays in seconds
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 300.0
+    REQUEST_TIMEOUT = 10.0
+
+    def __init__(self, url, data_format=FORMAT_JSON, batch_size=100, flush_interval=10.0,
+                 spool_file=DEFAULT_SPOOL_FILE, spool_max_bytes=10000000):
+        """
+        :param url: Endpoint the batches are POSTed to
+        :param data_format: FORMAT_JSON or FORMAT_LINE
+        :param batch_size: Maximum number of samples in a POST
+        :param flush_interval: Maximum time in seconds a sample waits before it is sent
+        :param spool_file: Path of the spool. A second segment and a position file
+        are kept next to it.
+        :param spool_max_bytes: Size limit of the spool
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._url = url
+        self._data_format = data_format
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._spool_file = spool_file
+        self._closed_segment = spool_file + ".1"
+        self._position_file = spool_file + ".pos"
+        self._spool_max_bytes = spool_max_bytes
+        # Samples are dropped (oldest first) if the sender falls this far behind
+        self._max_pending = batch_size * 50
+
+        self._pending = deque()
+        self._condition = Condition()
+        self._terminate = False
+        self._sender_thread = None
+        self._backoff = SensorForwarder.MIN_BACKOFF
+        self._retry_at = 0.0
+        self._link_up = True
+        self._start_time = time.monotonic()
+        self._stats = {
+            "samples_received": 0,
+            "samples_sent": 0,
+            "batches_sent": 0,
+            "bytes_sent": 0,
+            "send_failures": 0,
+            "samples_rejected": 0,
+            "samples_spooled": 0,
+            "samples_replayed": 0,
+            "samples_dropped": 0,
+            "spool_bytes_dropped": 0,
+        }
+
+    def open(self):
+        """
+        Start the sender thread
+        :return: None
+        """
+        self._sender_thread = Thread(target=self._run, name="SensorForwarder")
+        self._sender_thread.start()
+        self._logger.info(f"Forwarding sensor data to {self._url}")
+
+    def close(self):
+        """
+        Stop the sender thread. Samples that have not been sent are spooled.
+        :return: None
+        """
+        self._condition.acquire()
+        self._terminate = True
+        self._condition.notify()
+        self._condition.release()
+        if self._sender_thread is not None:
+            self._sender_thread.join()
+            self._sender_thread = None
+        self._logger.info("Sensor forwarder closed")
+
+    def handle_sample(self, mac, data):
+        """
+        Sample listener. Runs on the data source thread, so it only formats
+        the sample and queues it.
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: None
+        """
+        line = self._format_sample(mac, data)
+        self._condition.acquire()
+        self._pending.append(line)
+        self._stats["samples_received"] += 1
+        if len(self._pending) > self._max_pending:
+            self._pending.popleft()
+            self._stats["samples_dropped"] += 1
+        if len(self._pending) >= self._batch_size:
+            self._condition.notify()
+        self._condition.release()
+
+    @property
+    def stats(self):
+        """
+        Throughput and backlog metrics
+        :return: A dict of counters plus pending (samples in memory), spool_bytes
+        (backlog on disk), link_up and samples_per_second (sent, since open)
+        """
+        self._condition.acquire()
+        s = dict(self._stats)
+        s["pending"] = len(self._pending)
+        s["link_up"] = self._link_up
+        self._condition.release()
+        s["spool_bytes"] = self._spool_bytes()
+        elapsed = time.monotonic() - self._start_time
+        s["samples_per_second"] = s["samples_sent"] / elapsed if elapsed > 0 else 0.0
+        return s
+
+    def _run(self):
+        """
+        Sender thread
+        :return: None
+        """
+        while True:
+            self._condition.acquire()
+            if not self._terminate and len(self._pending) < self._batch_size:
+                self._condition.wait(self._flush_interval)
+            terminate = self._terminate
+            batch = [self._pending.popleft() for _ in range(min(self._batch_size, len(self._pending)))]
+            self._condition.release()
+
+            try:
+                self._forward(batch)
+                # Drain whatever else is already waiting before sleeping again
+                while not terminate:
+                    self._condition.acquire()
+                    if len(self._pending) < self._batch_size:
+                        self._condition.release()
+                        break
+                    batch = [self._pending.popleft() for _ in range(self._batch_size)]
+                    self._condition.release()
+                    self._forward(batch)
+            except Exception as ex:
+                self._logger.error("Unhandled exception caught in SensorForwarder._run()")
+                self._logger.error(str(ex))
+
+            if terminate:
+                self._spool_remaining()
+                break
+
+    def _forward(self, batch):
+        """
+        Send a batch, or spool it if the link is down
+        :param batch: A list of formatted sample lines
+        :return: None
+        """
+        if time.monotonic() >= self._retry_at:
+            # The spool is older than the batch, so it goes first
+            if self._replay_spool() and (len(batch) == 0 or self._post(batch)):
+                if len(batch) > 0:
+                    self._count("samples_sent", len(batch))
+                return
+            self._link_is_down()
+        if len(batch) > 0:
+            self._append_to_spool(batch)
+
+    def _post(self, lines):
+        """
+        POST a batch
+        :param lines: A list of formatted sample lines
+        :return: True if the batch was accepted (or rejected as invalid, which
+        retrying won't fix). False if it should be retried.
+        """
+        body = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+        if self._data_format == SensorForwarder.FORMAT_LINE:
+            content_type = "text/plain; charset=utf-8"
+        else:
+            content_type = "application/x-ndjson"
+        request = urllib.request.Request(self._url, data=body, method="POST",
+                                         headers={"Content-Type": content_type, "Content-Encoding": "gzip"})
+        try:
+            with urllib.request.urlopen(request, timeout=SensorForwarder.REQUEST_TIMEOUT) as response:
+                response.read()
+            # Any progress resets the backoff
+            self._link_is_up()
+            self._count("batches_sent", 1)
+            self._count("bytes_sent", len(body))
+            return True
+        except urllib.error.HTTPError as ex:
+            if 400 <= ex.code < 500 and ex.code not in (408, 429):
+                self._logger.error(f"Forwarder batch of {len(lines)} samples rejected: {ex.code} {ex.reason}")
+                self._count("samples_rejected", len(lines))
+                self._link_is_up()
+                return True
+            self._logger.debug(f"Forwarder POST failed: {ex.code} {ex.reason}")
+        except (urllib.error.URLError, OSError) as ex:
+            self._logger.debug(f"Forwarder POST failed: {str(ex)}")
+        self._count("send_failures", 1)
+        return False
+
+    def _link_is_up(self):
+        if not self._link_up:
+            self._logger.info(f"Forwarder link to {self._url} is back up")
+        self._link_up = True
+        self._backoff = SensorForwarder.MIN_BACKOFF
+
+    def _link_is_down(self):
+        if self._link_up:
+            self._logger.warning(f"Forwarder link to {self._url} is down, spooling")
+        self._link_up = False
+        self._retry_at = time.monotonic() + (self._backoff * random.uniform(0.5, 1.0))
+        self._backoff = min(self._backoff * 2.0, SensorForwarder.MAX_BACKOFF)
+
+    def _replay_spool(self):
+        """
+        Send the spooled samples, oldest first
+        :return: True if the spool is empty, False if a POST failed
+        """
+        while True:
+            if not os.path.exists(self._closed_segment):
+                if not os.path.exists(self._spool_file) or os.path.getsize(self._spool_file) == 0:
+                    return True
+                # Close the open segment so it can be replayed
+                os.replace(self._spool_file, self._closed_segment)
+                self._write_position(0)
+
+            position = self._read_position()
+            with open(self._closed_segment, "r", encoding="utf-8") as f:
+                f.seek(position)
+                while True:
+                    lines = []
+                    for _ in range(self._batch_size):
+                        line = f.readline()
+                        if line == "":
+                            break
+                        lines.append(line.rstrip("\n"))
+                    if len(lines) == 0:
+                        break
+                    if not self._post(lines):
+                        return False
+                    self._count("samples_replayed", len(lines))
+                    self._count("samples_sent", len(lines))
+                    self._write_position(f.tell())
+            os.remove(self._closed_segment)
+            self._remove_position()
+
+    def _append_to_spool(self, lines):
+        """
+        Append a batch to the open spool segment
+        :param lines: A list of formatted sample lines
+        :return: None
+        """
+        data = "\n".join(lines) + "\n"
+        try:
+            if os.path.exists(self._spool_file) and \
+                    os.path.getsize(self._spool_file) + len(data.encode("utf-8")) > self._spool_max_bytes // 2:
+                if os.path.exists(self._closed_segment):
+                    # Full. The oldest samples are lost.
+                    dropped = os.path.getsize(self._closed_segment) - self._read_position()
+                    self._count("spool_bytes_dropped", dropped)
+                    self._logger.warning(f"Forwarder spool is full, {dropped} bytes of the oldest samples dropped")
+                os.replace(self._spool_file, self._closed_segment)
+                self._write_position(0)
+            with open(self._spool_file, "a", encoding="utf-8") as f:
+                f.write(data)
+            self._count("samples_spooled", len(lines))
+        except OSError as ex:
+            self._logger.error(f"Unable to spool {len(lines)} forwarder samples")
+            self._logger.error(str(ex))
+            self._count("samples_dropped", len(lines))
+
+    def _spool_remaining(self):
+        """
+        On close, spool the samples still in memory
+        :return: None
+        """
+        self._condition.acquire()
+        lines = list(self._pending)
+        self._pending.clear()
+        self._condition.release()
+        if len(lines) > 0:
+            self._append_to_spool(lines)
+
+    def _spool_bytes(self):
+        """
+        Size of the unsent spool
+        :return: Bytes
+        """
+        size = 0
+        try:
+            if os.path.exists(self._spool_file):
+                size += os.path.getsize(self._spool_file)
+            if os.path.exists(self._closed_segment):
+                size += os.path.getsize(self._closed_segment) - self._read_position()
+        except OSError:
+            pass
+        return size
+
+    def _read_position(self):
+        try:
+            with open(self._position_file, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_position(self, position):
+        with open(self._position_file, "w") as f:
+            f.write(str(position))
+
+    def _remove_position(self):
+        if os.path.exists(self._position_file):
+            os.remove(self._position_file)
+
+    def _count(self, key, n):
+        self._condition.acquire()
+        self._stats[key] += n
+        self._condition.release()
+
+    def _format_sample(self, mac, data):
+        """
+        Format a sample as one line
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: str
+        """
+        timestamp = data.get("timestamp")
+        if not isinstance(timestamp, datetime.datetime):
+            timestamp = sensor_clock.now()
+        fields = {k: data.get(k) for k in ("temperature", "humidity", "pressure", "battery", "tx_power")
+                  if data.get(k) is not None}
+
+        if self._data_format == SensorForwarder.FORMAT_LINE:
+            tags = f"mac={SensorForwarder._escape_tag(mac)}"
+            if data.get("name"):
+                tags += f",name={SensorForwarder._escape_tag(str(data['name']))}"
+            field_set = ",".join(f"{k}={v}i" if isinstance(v, int) else f"{k}={v}" for k, v in fields.items())
+            return f"ruuvi,{tags} {field_set} {int(timestamp.timestamp() * 1e9)}"
+
+        record = {"mac": mac, "name": data.get("name"), "timestamp": timestamp.isoformat()}
+        record.update(fields)
+        return json.dumps(record, separators=(",", ":"))
+
+    @staticmethod
+    def _escape_tag(value):
+        """
+        Escape a line protocol tag value
+        """
+        value = value.replace("\n", " ")
+        for c in (",", "=", " "):
+            value = value.replace(c, "\\" + c)
+        return value
+
+
+def start_forwarder(data_source):
+    """
+    Start forwarding the samples of a data source if the configuration enables it
+    :param data_source: The sensor data source whose samples are forwarded
+    :return: A running SensorForwarder instance or None
+    """
+    config = Configuration.get_configuration()
+    url = config.get(Configuration.CFG_FORWARD_URL, "")
+    if not url:
+        return None
+    forwarder = SensorForwarder(url,
+                                data_format=config.get(Configuration.CFG_FORWARD_FORMAT,
+                                                       SensorForwarder.FORMAT_JSON).lower(),
+                                batch_size=int(config.get(Configuration.CFG_FORWARD_BATCH_SIZE, 100)),
+                                flush_interval=float(config.get(Configuration.CFG_FORWARD_INTERVAL, 10.0)),
+                                spool_max_bytes=int(config.get(Configuration.CFG_FORWARD_SPOOL_MAX_BYTES,
+                                                               10000000)))
+    forwarder.open()
+    data_source.add_sample_listener(forwarder.handle_sample)
+    return forwarder
@@ -0,0 +1,214 @@
+#
+# sensor_history_cache.py - In-memory cache of sensor history
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The cache remembers the last SensorData record id fetched for each sensor.
+# When a sensor's history is requested again, only records newer than that
+# id are read from the DB and records that have aged out of the history
+# window are discarded. The total number of cached records is capped. When
+# the cap is exceeded, the least recently used sensors are evicted. A sensor
+# whose history alone exceeds the cap is not cached.
+#
+# Like the Configuration class, there is only one active cache instance.
+# Use SensorHistoryCache.get_cache() to access it.
+#
+
+
+import datetime
+import logging
+from collections import OrderedDict
+from threading import Lock
+from configuration import Configuration
+from sensor_db import SensorDB
+from sensor_history_columns import SensorHistoryColumns
+import sensor_clock
+
+
+class SensorHistoryCache:
+    """
+    Per-sensor, incrementally updated sensor history cache
+    """
+    # Essentially a singleton instance of the cache
+    _active_cache = None
+
+    DEFAULT_MAX_ROWS = 100000
+    DEFAULT_WINDOW_HOURS = 24
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, window_hours=DEFAULT_WINDOW_HOURS):
+        """
+        Construct a sensor history cache
+        :param max_rows: The maximum number of history records kept across all sensors
+        :param window_hours: Records older than this are evicted from the cache
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._max_rows = max_rows
+        self._window_hours = window_hours
+        # Keyed by mac, ordered from least to most recently used.
+        # Each entry is a SensorHistoryColumns instance.
+        self._entries = OrderedDict()
+        self._row_count = 0
+        self._lock = Lock()
+        # Sensors whose history alone exceeds max_rows (logged once)
+        self._oversized = set()
+        # Incremented by invalidate(), so a lookup that was querying then doesn't cache stale history
+        self._generation = 0
+
+        # Statistics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rows_fetched = 0
+        self._rows_aged_out = 0
+
+    @classmethod
+    def get_cache(cls):
+        """
+        Return the active cache, creating it on first use
+        :return: The SensorHistoryCache instance
+        """
+        if cls._active_cache is None:
+            config = Configuration.get_configuration()
+            max_rows = config.get(Configuration.CFG_HISTORY_CACHE_MAX_ROWS, cls.DEFAULT_MAX_ROWS)
+            cls._active_cache = SensorHistoryCache(max_rows=int(max_rows))
+        return cls._active_cache
+
+    def get_sensor_history(self, mac, progress_dlg=None):
+        """
+        Return the sensor history for the history window. Only records that are
+        newer than the last cached record are queried from the DB.
+        :param mac: The sensor of interest
+        :param progress_dlg: Optional progress dialog for reporting query progress
+        :return: A SensorHistoryColumns instance or None if the query failed
+        """
+        # The entry is taken out of the cache while it is updated, so the lock
+        # is not held during the query
+        self._lock.acquire()
+        generation = self._generation
+        entry = self._entries.pop(mac, None)
+        if entry is None:
+            self._misses += 1
+            entry = SensorHistoryColumns()
+        else:
+            self._hits += 1
+            self._row_count -= len(entry)
+        self._lock.release()
+
+        new_rows = SensorDB().get_sensor_history_columns(mac, progress_dlg=progress_dlg,
+                                                         since_id=entry.last_id)
+        if new_rows is None:
+            # The query failed. Don't trust what is cached.
+            return None
+
+        if len(entry) > 0 and len(new_rows) > 0 and new_rows.times[0] < entry.times[-1]:
+            # New records older than the cached ones (e.g. imported by sensor_db_sync.py).
+            # Appending them would break the time order, so the history is queried again.
+            new_rows = SensorDB().get_sensor_history_columns(mac, progress_dlg=progress_dlg)
+            if new_rows is None:
+                return None
+            entry = SensorHistoryColumns()
+
+        entry.extend(new_rows)
+
+        self._lock.acquire()
+        try:
+            self._rows_fetched += len(new_rows)
+            self._age_out(entry)
+
+            if len(entry) > self._max_rows:
+                # Caching it would evict everything including itself on every lookup
+                if mac not in self._oversized:
+                    self._oversized.add(mac)
+                    self._logger.warning(f"History of {mac} ({len(entry)} records) exceeds history_cache_max_rows "
+                                         f"({self._max_rows}) and is not cached")
+                return entry
+            if generation != self._generation:
+                return entry
+
+            # Another lookup may have cached the sensor while this one was querying
+            other = self._entries.pop(mac, None)
+            if other is not None:
+                self._row_count -= len(other)
+            # Inserted as most recently used
+            self._entries[mac] = entry
+            self._row_count += len(entry)
+            self._enforce_row_limit(mac)
+
+            # The caller gets its own copy
+            return entry.copy()
+        finally:
+            self._lock.release()
+
+    def invalidate(self, mac=None):
+        """
+        Discard cached history
+        :param mac: The sensor to be discarded. If None, all sensors are discarded.
+        :return: None
+        """
+        self._lock.acquire()
+        self._generation += 1
+        if mac is None:
+            self._entries.clear()
+            self._row_count = 0
+        else:
+            entry = self._entries.pop(mac, None)
+            if entry is not None:
+                self._row_count -= len(entry)
+        self._lock.release()
+
+    @property
+    def stats(self):
+        """
+        Cache statistics
+        :return: A dict of statistic names and values
+        """
+        self._lock.acquire()
+        lookups = self._hits + self._misses
+        s = {
+            "sensors": len(self._entries),
+            "rows": self._row_count,
+            "max_rows": self._max_rows,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": (self._hits / lookups) if lookups > 0 else 0.0,
+            "evictions": self._evictions,
+            "rows_fetched": self._rows_fetched,
+            "rows_aged_out": self._rows_aged_out,
+        }
+        self._lock.release()
+        return s
+
+    def _age_out(self, entry):
+        """
+        Discard records that are older than the history window
+        :param entry: The cache entry to be trimmed
+        :return: None
+        """
+        cutoff = sensor_clock.now() - datetime.timedelta(hours=self._window_hours)
+        self._rows_aged_out += entry.age_out(cutoff)
+
+    def _enforce_row_limit(self, keep_mac):
+        """
+        Evict least recently used sensors until the row limit is satisfied
+        :param keep_mac: The sensor just inserted. It is never evicted.
+        :return: None
+        """
+        while self._row_count > self._max_rows and len(self._entries) > 1:
+            mac = next(iter(self._entries))
+            if mac == keep_mac:
+                break
+            entry = self._entries.pop(mac)
+            self._row_count -= len(entry)
+            self._evictions += 1
+            self._logger.debug(f"Evicted {len(entry)} history records for {mac} from the cache")
@@ -0,0 +1,282 @@
+#
+# sensor_history_columns.py - Columnar sensor history
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# Sensor history is held as columns (one array per metric) instead of a
+# list of record dicts. All of the stored metrics are filled from a single
+# pass over the query result and per-metric min/max/mean are accumulated
+# in the same pass. Missing values (NULL in the DB) are stored as NaN and
+# are left out of the statistics.
+#
+# The data_time of each record is decoded once, when it is appended, into
+# both a datetime and a float (seconds since the epoch, treating the stored
+# local time as UTC like SQLite does). Relative times for plotting are
+# computed from the float column.
+#
+
+
+from array import array
+import datetime
+import math
+
+
+class SensorHistoryColumns:
+    """
+    The history of one sensor, stored by column
+    """
+    # The metrics that are stored for each sample, in query column order
+    METRICS = ("temperature", "humidity", "pressure")
+    METRIC_LABELS = {
+        "temperature": "Temperature",
+        "humidity": "Humidity",
+        "pressure": "Pressure",
+    }
+
+    _EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self):
+        """
+        Create an empty history
+        """
+        self.ids = array("q")
+        # Highest id, kept up to date because records are in time order, not id order
+        self._max_id = 0
+        self.data_times = []
+        self.times = array("d")
+        self.metrics = {}
+        self._stats = {}
+        for metric in SensorHistoryColumns.METRICS:
+            self.metrics[metric] = array("d")
+            self._stats[metric] = SensorHistoryColumns._empty_stats()
+        self._stats_valid = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append_row(self, id, temperature, humidity, pressure, data_time):
+        """
+        Append one SensorData record
+        :param id: Record id
+        :param temperature: Temperature value or None
+        :param humidity: Humidity value or None
+        :param pressure: Pressure value or None
+        :param data_time: Time of the sample as a datetime or as stored in the DB (str)
+        :return: None
+        """
+        if isinstance(data_time, str):
+            data_time = SensorHistoryColumns.parse_data_time(data_time)
+        self.ids.append(id)
+        if id > self._max_id:
+            self._max_id = id
+        self.data_times.append(data_time)
+        self.times.append((data_time - SensorHistoryColumns._EPOCH).total_seconds())
+        for metric, value in (("temperature", temperature), ("humidity", humidity), ("pressure", pressure)):
+            if value is None:
+                self.metrics[metric].append(math.nan)
+            else:
+                self.metrics[metric].append(value)
+                if self._stats_valid:
+                    SensorHistoryColumns._accumulate(self._stats[metric], value)
+
+    def append_rows(self, rows):
+        """
+        Append a batch of SensorData records. This is the fast path for query
+        results. Each column is decoded in one step and the statistics are
+        accumulated with the min/max/sum builtins instead of per record.
+        :param rows: A sequence of (id, temperature, humidity, pressure, data_time)
+        tuples in data_time order. data_time is as stored in the DB (str).
+        :return: None
+        """
+        if len(rows) == 0:
+            return
+        ids, temperatures, humidities, pressures, data_times = zip(*rows)
+        parse = datetime.datetime.fromisoformat
+        decoded = [parse(v) for v in data_times]
+        epoch = SensorHistoryColumns._EPOCH
+        self.ids.extend(ids)
+        self._max_id = max(self._max_id, max(ids))
+        self.data_times.extend(decoded)
+        self.times.extend([(dt - epoch).total_seconds() for dt in decoded])
+        for metric, values in (("temperature", temperatures), ("humidity", humidities), ("pressure", pressures)):
+            if None in values:
+                present = [v for v in values if v is not None]
+                self.metrics[metric].extend([math.nan if v is None else v for v in values])
+            else:
+                present = values
+                self.metrics[metric].extend(values)
+            if self._stats_valid and len(present) > 0:
+                batch = {"count": len(present), "min": min(present), "max": max(present), "sum": math.fsum(present)}
+                SensorHistoryColumns._merge(self._stats[metric], batch)
+
+    def extend(self, other):
+        """
+        Append all of the records of another history
+        :param other: A SensorHistoryColumns instance with newer records
+        :return: None
+        """
+        self.ids.extend(other.ids)
+        self._max_id = max(self._max_id, other._max_id)
+        self.data_times.extend(other.data_times)
+        self.times.extend(other.times)
+        for metric in SensorHistoryColumns.METRICS:
+            self.metrics[metric].extend(other.metrics[metric])
+            if self._stats_valid and other._stats_valid:
+                SensorHistoryColumns._merge(self._stats[metric], other._stats[metric])
+        if not other._stats_valid:
+            self._stats_valid = False
+
+    def copy(self):
+        """
+        Return an independent copy of the history
+        :return: A SensorHistoryColumns instance
+        """
+        c = SensorHistoryColumns()
+        c.extend(self)
+        return c
+
+    def age_out(self, cutoff):
+        """
+        Remove records older than a cutoff time. Records are in time order.
+        :param cutoff: Records with a data_time before this datetime are removed
+        :return: The number of records removed
+        """
+        aged = 0
+        while aged < len(self.data_times) and self.data_times[aged] < cutoff:
+            aged += 1
+        if aged > 0:
+            del self.ids[:aged]
+            self._max_id = max(self.ids) if len(self.ids) > 0 else 0
+            del self.data_times[:aged]
+            del self.times[:aged]
+            for metric in SensorHistoryColumns.METRICS:
+                del self.metrics[metric][:aged]
+            # Min/max can't be backed out, so they are recomputed when next needed
+            self._stats_valid = False
+        return aged
+
+    @property
+    def last_id(self):
+        """
+        The highest record id. Records are in time order, so this is not
+        necessarily the id of the last record.
+        :return: Record id or 0 if there are no records
+        """
+        return self._max_id
+
+    def stats(self, metric):
+        """
+        Statistics for one metric
+        :param metric: One of METRICS
+        :return: A dict with the keys count, min, max and mean. Values are None
+        when there are no samples.
+        """
+        if not self._stats_valid:
+            self._recompute_stats()
+        s = self._stats[metric]
+        return {
+            "count": s["count"],
+            "min": s["min"],
+            "max": s["max"],
+            "mean": (s["sum"] / s["count"]) if s["count"] > 0 else None,
+        }
+
+    def relative_hours(self, origin=None):
+        """
+        The time of each record in hours, relative to an origin
+        :param origin: A datetime used as time zero. The default is the first record.
+        :return: A list of floats
+        """
+        if len(self.times) == 0:
+            return []
+        if origin is None:
+            t0 = self.times[0]
+        else:
+            t0 = (origin - SensorHistoryColumns._EPOCH).total_seconds()
+        return [(t - t0) / 3600.0 for t in self.times]
+
+    def points(self, metric, origin=None):
+        """
+        Plot points for one metric. Missing values are left out.
+        :param metric: One of METRICS
+        :param origin: A datetime used as time zero. The default is the first record.
+        :return: A list of (x, y) pairs where x is the relative time in hours
+        """
+        return [(t, v) for t, v in zip(self.relative_hours(origin=origin), self.metrics[metric])
+                if not math.isnan(v)]
+
+    @staticmethod
+    def parse_data_time(value):
+        """
+        Convert a data_time as stored in the DB to a datetime
+        :param value: The str representation of a datetime, with or
+        without a fraction of a second
+        :return: A datetime
+        """
+        # str(datetime) is ISO format with a space separator. fromisoformat
+        # handles it, with or without microseconds, many times faster than
+        # strptime. See benchmarks/bench_timestamp_decode.py.
+        return datetime.datetime.fromisoformat(value)
+
+    def _recompute_stats(self):
+        """
+        Recompute all statistics from the columns
+        :return: None
+        """
+        for metric in SensorHistoryColumns.METRICS:
+            s = SensorHistoryColumns._empty_stats()
+            for value in self.metrics[metric]:
+                if not math.isnan(value):
+                    SensorHistoryColumns._accumulate(s, value)
+            self._stats[metric] = s
+        self._stats_valid = True
+
+    @staticmethod
+    def _empty_stats():
+        return {"count": 0, "min": None, "max": None, "sum": 0.0}
+
+    @staticmethod
+    def _accumulate(s, value):
+        """
+        Fold a value into running statistics
+        :param s: Running statistics dict
+        :param value: The value
+        :return: None
+        """
+        if s["count"] == 0:
+            s["min"] = value
+            s["max"] = value
+        else:
+            if value < s["min"]:
+                s["min"] = value
+            if value > s["max"]:
+                s["max"] = value
+        s["count"] += 1
+        s["sum"] += value
+
+    @staticmethod
+    def _merge(s, other):
+        """
+        Merge running statistics
+        :param s: Running statistics dict to be updated
+        :param other: Running statistics dict to be merged into s
+        :return: None
+        """
+        if other["count"] == 0:
+            return
+        if s["count"] == 0:
+            s["min"] = other["min"]
+            s["max"] = other["max"]
+        else:
+            s["min"] = min(s["min"], other["min"])
+            s["max"] = max(s["max"], other["max"])
+        s["count"] += other["count"]
+        s["sum"] += other["sum"]
@@ -0,0 +1,209 @@
+#
+# sensor_history_series.py - A sliding window time series of sensor values
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# The series keeps raw samples in flat arrays of doubles. Appending is
+# amortized O(1). When the window slides, a start offset is advanced instead
+# of deleting from the front of the arrays. The dead space is reclaimed only
+# when it is at least half of the array, so trimming is also amortized O(1).
+#
+# Alongside the raw samples, a downsampled (min/max per bucket) version of
+# the series is maintained as each sample is appended. The bucket width is
+# the window length divided by the number of buckets, so plotting cost is
+# bounded regardless of how many samples are in the window.
+#
+
+
+from array import array
+from bisect import bisect_left, bisect_right
+import datetime
+
+
+class SensorHistorySeries:
+    """
+    Sliding window time series of one sensor value (e.g. temperature)
+    """
+    DEFAULT_WINDOW_HOURS = 24
+    DEFAULT_MAX_BUCKETS = 600
+
+    def __init__(self, window_hours=DEFAULT_WINDOW_HOURS, max_buckets=DEFAULT_MAX_BUCKETS):
+        """
+        Create an empty series
+        :param window_hours: Length of the sliding window
+        :param max_buckets: Number of buckets used for the downsampled series
+        """
+        self._window_seconds = window_hours * 3600.0
+        self._bucket_seconds = self._window_seconds / max_buckets
+
+        # Raw samples. Time is in epoch seconds.
+        self._times = array("d")
+        self._values = array("d")
+        self._start = 0
+
+        # Downsampled samples, one entry per occupied bucket
+        self._bucket_keys = array("q")
+        self._bucket_min = array("d")
+        self._bucket_min_t = array("d")
+        self._bucket_max = array("d")
+        self._bucket_max_t = array("d")
+        self._bucket_start = 0
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+    def append(self, timestamp, value):
+        """
+        Append a sample to the series. Samples are expected in time order,
+        but a sample that arrives slightly out of order is inserted in place.
+        Samples older than the window are dropped.
+        :param timestamp: The datetime of the sample
+        :param value: The sample value
+        :return: True if the sample was added
+        """
+        t = timestamp.timestamp()
+        if len(self) > 0 and t < self._times[-1]:
+            if t < self._times[-1] - self._window_seconds:
+                return False
+            i = bisect_right(self._times, t, lo=self._start)
+            self._times.insert(i, t)
+            self._values.insert(i, value)
+            self._add_to_bucket(t, value)
+            return True
+
+        self._times.append(t)
+        self._values.append(value)
+        self._add_to_bucket(t, value)
+        self._slide(t)
+        return True
+
+    def extend_from_history(self, history, metric):
+        """
+        Append sensor history
+        :param history: A SensorHistoryColumns instance
+        :param metric: The metric to be appended (e.g. "temperature")
+        :return: None
+        """
+        for data_time, value in zip(history.data_times, history.metrics[metric]):
+            # Missing values are stored as NaN
+            if value == value:
+                self.append(data_time, value)
+
+    @property
+    def start_time(self):
+        """
+        Time of the oldest sample in the window
+        :return: A datetime or None if the series is empty
+        """
+        if len(self) == 0:
+            return None
+        return datetime.datetime.fromtimestamp(self._times[self._start])
+
+    @property
+    def end_time(self):
+        """
+        Time of the newest sample in the window
+        :return: A datetime or None if the series is empty
+        """
+        if len(self) == 0:
+            return None
+        return datetime.datetime.fromtimestamp(self._times[-1])
+
+    def min_max(self):
+        """
+        The minimum and maximum values in the window, from the downsampled series
+        :return: A 2-tuple (min, max) or None if the series is empty
+        """
+        if len(self) == 0:
+            return None
+        min_value = min(self._bucket_min[self._bucket_start:])
+        max_value = max(self._bucket_max[self._bucket_start:])
+        return min_value, max_value
+
+    def downsampled_points(self, origin=None):
+        """
+        The downsampled series as plot points. The x value is the
+        time in hours relative to the origin.
+        Each bucket contributes its min and max points in time order.
+        :param origin: A datetime used as time zero. The default is the
+        oldest sample in the window. Use a common origin when several
+        series share a time axis.
+        :return: A list of (x, y) pairs
+        """
+        points = []
+        if len(self) == 0:
+            return points
+        t0 = self._times[self._start] if origin is None else origin.timestamp()
+        for i in range(self._bucket_start, len(self._bucket_keys)):
+            min_point = ((self._bucket_min_t[i] - t0) / 3600.0, self._bucket_min[i])
+            max_point = ((self._bucket_max_t[i] - t0) / 3600.0, self._bucket_max[i])
+            if self._bucket_min_t[i] == self._bucket_max_t[i]:
+                points.append(min_point)
+            elif self._bucket_min_t[i] < self._bucket_max_t[i]:
+                points.append(min_point)
+                points.append(max_point)
+            else:
+                points.append(max_point)
+                points.append(min_point)
+        return points
+
+    def _add_to_bucket(self, t, value):
+        """
+        Fold a sample into the downsampled series
+        :param t: Sample time in epoch seconds
+        :param value: Sample value
+        :return: None
+        """
+        key = int(t // self._bucket_seconds)
+        if len(self._bucket_keys) > self._bucket_start and self._bucket_keys[-1] >= key:
+            # Usually the newest bucket, but an out of order sample may land in an older one
+            i = len(self._bucket_keys) - 1
+            if self._bucket_keys[i] != key:
+                i = bisect_left(self._bucket_keys, key, lo=self._bucket_start)
+            if i < len(self._bucket_keys) and self._bucket_keys[i] == key:
+                if value < self._bucket_min[i]:
+                    self._bucket_min[i] = value
+                    self._bucket_min_t[i] = t
+                if value > self._bucket_max[i]:
+                    self._bucket_max[i] = value
+                    self._bucket_max_t[i] = t
+                return
+        else:
+            i = len(self._bucket_keys)
+
+        self._bucket_keys.insert(i, key)
+        self._bucket_min.insert(i, value)
+        self._bucket_min_t.insert(i, t)
+        self._bucket_max.insert(i, value)
+        self._bucket_max_t.insert(i, t)
+
+    def _slide(self, newest_t):
+        """
+        Move the start of the window so that it covers no more than the window length
+        :param newest_t: Time of the newest sample in epoch seconds
+        :return: None
+        """
+        cutoff = newest_t - self._window_seconds
+        while self._start < len(self._times) and self._times[self._start] < cutoff:
+            self._start += 1
+        cutoff_key = int(cutoff // self._bucket_seconds)
+        while self._bucket_start < len(self._bucket_keys) and self._bucket_keys[self._bucket_start] < cutoff_key:
+            self._bucket_start += 1
+
+        # Reclaim dead space once it is at least half of the arrays
+        if self._start > 0 and self._start * 2 >= len(self._times):
+            del self._times[:self._start]
+            del self._values[:self._start]
+            self._start = 0
+        if self._bucket_start > 0 and self._bucket_start * 2 >= len(self._bucket_keys):
+            for a in (self._bucket_keys, self._bucket_min, self._bucket_min_t, self._bucket_max, self._bucket_max_t):
+                del a[:self._bucket_start]
+            self._bucket_start = 0
@@ -0,0 +1,191 @@
+#
+# sensor_history_tiles.py - Level of detail tile cache for zoomable sensor history
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# A zoomed history view only needs about one point per pixel. The visible
+# time range is split into fixed size tiles at a level of detail matched to
+# the pixel width. Level 0 is raw records. The other levels are buckets of
+# a fixed number of seconds, averaged by the DB. Each tile is fetched once
+# and cached by (sensor, level, tile start), so panning or zooming back to
+# a range that was already seen does not touch the DB.
+#
+# Tiles that extend past the current time are still filling up. They are
+# fetched every time and never cached.
+#
+# Like the Configuration class, there is only one active cache instance.
+# Use HistoryTileCache.get_cache() to access it.
+#
+
+
+import datetime
+import logging
+from collections import OrderedDict
+from threading import Lock
+from sensor_db import SensorDB
+from sensor_history_columns import SensorHistoryColumns
+import sensor_clock
+
+
+class HistoryTileCache:
+    """
+    Cache of history tiles keyed by (sensor, level, tile start)
+    """
+    # Essentially a singleton instance of the cache
+    _active_cache = None
+
+    # Bucket length in seconds for each level. Level 0 is raw records.
+    LEVELS = [0, 60, 300, 900, 3600]
+    # Raw records are used while a bucket would be shorter than this
+    RAW_MAX_SECONDS = 20
+    # Time span of a raw (level 0) tile
+    RAW_TILE_SECONDS = 15 * 60
+    # Number of buckets in a tile for all other levels
+    TILE_BUCKETS = 240
+    DEFAULT_MAX_TILES = 400
+
+    _EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, max_tiles=DEFAULT_MAX_TILES):
+        """
+        Construct a tile cache
+        :param max_tiles: Maximum number of tiles kept. Least recently used tiles are evicted.
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def get_cache(cls):
+        """
+        Return the active cache, creating it on first use
+        :return: The HistoryTileCache instance
+        """
+        if cls._active_cache is None:
+            cls._active_cache = HistoryTileCache()
+        return cls._active_cache
+
+    @classmethod
+    def choose_level(cls, start_time, end_time, pixel_width):
+        """
+        Choose the level of detail for a time range shown across a number of pixels
+        :param start_time: Start of the range (datetime)
+        :param end_time: End of the range (datetime)
+        :param pixel_width: Width of the plot in pixels
+        :return: Level index into LEVELS
+        """
+        seconds_per_pixel = (end_time - start_time).total_seconds() / max(pixel_width, 1)
+        if seconds_per_pixel <= cls.RAW_MAX_SECONDS:
+            return 0
+        for level in range(1, len(cls.LEVELS)):
+            if cls.LEVELS[level] >= seconds_per_pixel:
+                return level
+        return len(cls.LEVELS) - 1
+
+    @classmethod
+    def tile_seconds(cls, level):
+        """
+        Time span of one tile at a level
+        :param level: Level index into LEVELS
+        :return: Seconds
+        """
+        if level == 0:
+            return cls.RAW_TILE_SECONDS
+        return cls.LEVELS[level] * cls.TILE_BUCKETS
+
+    def get_range(self, mac, start_time, end_time, pixel_width):
+        """
+        Return a sensor's history for a time range at a resolution matched to the pixel width
+        :param mac: The sensor of interest
+        :param start_time: Start of the range (datetime)
+        :param end_time: End of the range (datetime)
+        :param pixel_width: Width of the plot in pixels
+        :return: A 2-tuple (level, SensorHistoryColumns) or (level, None) if a query failed
+        """
+        level = HistoryTileCache.choose_level(start_time, end_time, pixel_width)
+        span = HistoryTileCache.tile_seconds(level)
+        now = sensor_clock.now()
+
+        first_tile = int((start_time - HistoryTileCache._EPOCH).total_seconds() // span) * span
+        last_tile = int((end_time - HistoryTileCache._EPOCH).total_seconds() // span) * span
+
+        result = SensorHistoryColumns()
+        for tile_start in range(first_tile, last_tile + 1, span):
+            tile = self._get_tile(mac, level, tile_start, span, now)
+            if tile is None:
+                return level, None
+            result.extend(tile)
+        return level, result
+
+    @property
+    def stats(self):
+        """
+        Cache statistics
+        :return: A dict of statistic names and values
+        """
+        self._lock.acquire()
+        s = {"tiles": len(self._tiles), "hits": self._hits, "misses": self._misses}
+        self._lock.release()
+        return s
+
+    def invalidate(self, mac=None):
+        """
+        Discard cached tiles
+        :param mac: The sensor to be discarded. If None, all sensors are discarded.
+        :return: None
+        """
+        self._lock.acquire()
+        if mac is None:
+            self._tiles.clear()
+        else:
+            for key in [k for k in self._tiles.keys() if k[0] == mac]:
+                del self._tiles[key]
+        self._lock.release()
+
+    def _get_tile(self, mac, level, tile_start, span, now):
+        """
+        Return one tile, from the cache if possible
+        :param mac: The sensor of interest
+        :param level: Level index into LEVELS
+        :param tile_start: Tile start in epoch seconds
+        :param span: Tile length in seconds
+        :param now: The current time. Tiles that end after it are not cached.
+        :return: A SensorHistoryColumns instance or None if the query failed
+        """
+        key = (mac, level, tile_start)
+        self._lock.acquire()
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._hits += 1
+            self._tiles.move_to_end(key)
+            self._lock.release()
+            return tile
+        self._misses += 1
+        self._lock.release()
+
+        start_time = HistoryTileCache._EPOCH + datetime.timedelta(seconds=tile_start)
+        end_time = start_time + datetime.timedelta(seconds=span)
+        db = SensorDB()
+        if level == 0:
+            tile = db.get_sensor_history_range(mac, start_time, end_time)
+        else:
+            tile = db.get_sensor_history_buckets(mac, start_time, end_time, HistoryTileCache.LEVELS[level])
+
+        if tile is not None and end_time <= now:
+            self._lock.acquire()
+            self._tiles[key] = tile
+            while len(self._tiles) > self._max_tiles:
+                self._tiles.popitem(last=False)
+            self._lock.release()
+        return tile
@@ -0,0 +1,605 @@
+#
+# sensor_http_api.py - HTTP/JSON API for sensor data
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# A small read only HTTP server so other tools on the LAN (e.g. Home
+# Assistant or scripts) can get sensor data without opening the sensor DB.
+# It is run by the process that collects sensor data and is enabled by
+# setting "http_api_port" to a non-zero port number.
+#
+# Endpoints
+#   GET /sensors                      Latest sample of every sensor
+#   GET /sensors/{mac}                Latest sample of one sensor
+#   GET /sensors/{mac}/history        History of one sensor. Query parameters:
+#       start    ISO date/time or epoch seconds (default end - 24 hours)
+#       end      ISO date/time or epoch seconds (default now)
+#       buckets  Number of time buckets to average into (default raw samples)
+#       An ISO time without an offset is local time. One with an offset (or Z) is
+#       converted to local time.
+#   GET /metrics                      Prometheus text format metrics
+#   GET /export?since_id=&limit=      Raw SensorData records after since_id, for sensor_db_sync.py
+#   GET /events                       Server-Sent Events stream of sensor changes
+#   GET /dashboard                    Browser dashboard fed by /events
+#
+# /sensors and history responses carry an ETag derived from the data
+# source's per-sensor version counters. A request with a matching
+# If-None-Match header gets a 304 without a body. Response bodies are kept
+# in a small cache keyed by ETag, so repeated polls of unchanged data are
+# not serialized (or queried) again.
+#
+# /events first sends a "snapshot" event with every sensor, then "delta"
+# events with only the fields that changed (see sensor_change_feed.py).
+# Slow clients get coalesced deltas from a bounded buffer, so any number of
+# viewers costs little more than one.
+#
+
+
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from urllib.parse import urlsplit, parse_qs, unquote
+from configuration import Configuration
+from sensor_db import SensorDB
+from sensor_history_columns import SensorHistoryColumns
+from sensor_change_feed import SensorChangeFeed
+import sensor_clock
+import sensor_metrics
+
+
+class _ApiError(Exception):
+    """
+    A request that can't be answered. Becomes a JSON error response.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SensorHttpApi:
+    """
+    HTTP server for the latest sensor values and sensor history
+    """
+    DEFAULT_HISTORY_HOURS = 24
+    MAX_BUCKETS = 10000
+    MAX_EXPORT_ROWS = 50000
+    CACHE_SIZE = 128
+    # Seconds between SSE keep alive comments
+    KEEP_ALIVE = 15.0
+    DASHBOARD_FILE = "sensor_dashboard.html"
+
+    def __init__(self, data_source, port, address=""):
+        """
+        :param data_source: The sensor data source (SensorDataSourceHandler or equivalent)
+        :param port: TCP port to listen on
+        :param address: Address to bind to. The default is all interfaces.
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._data_source = data_source
+        self._port = port
+        self._address = address
+        self._sensor_db = SensorDB()
+        self._server = None
+        self._server_thread = None
+        # ETag keyed response cache
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
+        # Counters for /metrics
+        self._counters = {"requests": {}, "not_modified": 0, "cache_hits": 0, "errors": 0, "events_sent": 0}
+        self._counters_lock = Lock()
+        self._change_feed = SensorChangeFeed(data_source)
+        self._dashboard = None
+
+    def start(self):
+        """
+        Start serving requests on a background thread
+        :return: None
+        """
+        dashboard_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SensorHttpApi.DASHBOARD_FILE)
+        with open(dashboard_path, "rb") as f:
+            self._dashboard = f.read()
+        self._change_feed.open()
+        self._server = ThreadingHTTPServer((self._address, self._port), _SensorApiRequestHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._server_thread = Thread(target=self._server.serve_forever, name="SensorHttpApi")
+        self._server_thread.start()
+        self._logger.info(f"HTTP API listening on port {self._port}")
+
+    def stop(self):
+        """
+        Stop serving requests
+        :return: None
+        """
+        if self._server is not None:
+            # Ends the event streams so their threads finish
+            self._change_feed.close()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+            self._logger.info("HTTP API stopped")
+
+    @property
+    def port(self):
+        """
+        The port being served. When constructed with port 0 this is the port the OS chose.
+        """
+        if self._server is not None:
+            return self._server.server_address[1]
+        return self._port
+
+    def handle_get(self, path, query, if_none_match):
+        """
+        Answer a GET request
+        :param path: The URL path
+        :param query: The URL query string
+        :param if_none_match: The If-None-Match header value or None
+        :return: A tuple of (status, headers dict, body bytes)
+        """
+        parts = [unquote(p) for p in path.split("/") if p != ""]
+        try:
+            if parts == ["sensors"]:
+                self._count_request("/sensors")
+                return self._conditional(if_none_match, *self._sensors_response())
+            if len(parts) == 2 and parts[0] == "sensors":
+                self._count_request("/sensors/{mac}")
+                return self._conditional(if_none_match, *self._sensor_response(parts[1]))
+            if len(parts) == 3 and parts[0] == "sensors" and parts[2] == "history":
+                self._count_request("/sensors/{mac}/history")
+                return self._conditional(if_none_match, *self._history_response(parts[1], parse_qs(query)))
+            if parts == ["metrics"]:
+                self._count_request("/metrics")
+                return 200, {"Content-Type": "text/plain; version=0.0.4"}, self._metrics_body()
+            if parts == ["export"]:
+                self._count_request("/export")
+                return 200, {"Content-Type": "application/json"}, self._export_body(parse_qs(query))
+            if parts == ["dashboard"] or len(parts) == 0:
+                self._count_request("/dashboard")
+                return 200, {"Content-Type": "text/html; charset=utf-8"}, self._dashboard
+            self._count_request("other")
+            raise _ApiError(404, f"Unknown endpoint {path}")
+        except _ApiError as ex:
+            self._count("errors")
+            body = json.dumps({"error": str(ex)}).encode("utf-8")
+            return ex.status, {"Content-Type": "application/json"}, body
+        except Exception as ex:
+            self._count("errors")
+            self._logger.error(f"Unhandled exception answering GET {path}")
+            self._logger.error(str(ex))
+            body = json.dumps({"error": "Internal error"}).encode("utf-8")
+            return 500, {"Content-Type": "application/json"}, body
+
+    def stream_events(self, write):
+        """
+        Send Server-Sent Events to one client until it disconnects or the
+        server stops. Runs on the client's request thread.
+        :param write: A callable that writes bytes to the client
+        :return: None
+        """
+        self._count_request("/events")
+        config = Configuration.get_configuration()
+        client = self._change_feed.subscribe()
+        event_id = 0
+        try:
+            write(b"retry: 5000\n\n")
+            while True:
+                closed, needs_snapshot, deltas = client.wait(SensorHttpApi.KEEP_ALIVE)
+                if closed:
+                    break
+                if needs_snapshot:
+                    event_id += 1
+                    snapshot = {
+                        "sensors": self._change_feed.snapshot(),
+                        "temperature_format": config[Configuration.CFG_TEMPERATURE_FORMAT].upper(),
+                        "offline_time": float(config[Configuration.CFG_OFFLINE_TIME]),
+                        "low_battery_threshold": float(config[Configuration.CFG_LOW_BATTERY_THRESHOLD]),
+                    }
+                    write(SensorHttpApi._sse_event("snapshot", event_id, snapshot))
+                    self._count("events_sent")
+                elif len(deltas) > 0:
+                    event_id += 1
+                    write(SensorHttpApi._sse_event("delta", event_id, deltas))
+                    self._count("events_sent")
+                else:
+                    # Keeps proxies and the browser from timing out an idle stream
+                    write(b": keep-alive\n\n")
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+        finally:
+            self._change_feed.unsubscribe(client)
+
+    @staticmethod
+    def _sse_event(event, event_id, data):
+        """
+        Format one Server-Sent Event
+        :param event: Event type
+        :param event_id: Event id
+        :param data: JSON serializable event data
+        :return: Bytes
+        """
+        return f"event: {event}\nid: {event_id}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+    def _conditional(self, if_none_match, etag, build_body):
+        """
+        Answer a request for a versioned resource
+        :param if_none_match: The If-None-Match header value or None
+        :param etag: The current ETag of the resource
+        :param build_body: A callable returning the JSON serializable response
+        :return: A tuple of (status, headers dict, body bytes)
+        """
+        headers = {"Content-Type": "application/json", "ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match is not None and etag in [t.strip() for t in if_none_match.split(",")]:
+            self._count("not_modified")
+            return 304, headers, b""
+
+        self._cache_lock.acquire()
+        body = self._cache.get(etag)
+        if body is not None:
+            self._cache.move_to_end(etag)
+        self._cache_lock.release()
+
+        if body is not None:
+            self._count("cache_hits")
+        else:
+            body = json.dumps(build_body(), default=SensorHttpApi._json_default).encode("utf-8")
+            self._cache_lock.acquire()
+            self._cache[etag] = body
+            while len(self._cache) > SensorHttpApi.CACHE_SIZE:
+                self._cache.popitem(last=False)
+            self._cache_lock.release()
+        return 200, headers, body
+
+    def _sensors_response(self):
+        """
+        Latest sample of every sensor
+        :return: A tuple of (etag, body builder)
+        """
+        data_version, versions = self._data_source.get_sensor_versions()
+        etag = SensorHttpApi._make_etag(f"sensors-{id(self._data_source)}-{data_version}")
+
+        def build_body():
+            sensor_list = self._data_source.lock_sensor_list()
+            sensors = [SensorHttpApi._sensor_json(mac, data, versions.get(mac, 0))
+                       for mac, data in sensor_list.items()]
+            self._data_source.unlock_sensor_list()
+            return {"sensors": sorted(sensors, key=lambda s: s["mac"])}
+
+        return etag, build_body
+
+    def _sensor_response(self, mac):
+        """
+        Latest sample of one sensor
+        :param mac: The mac of the sensor
+        :return: A tuple of (etag, body builder)
+        """
+        mac = mac.upper()
+        _, versions = self._data_source.get_sensor_versions()
+        # Versions outlive reset_sensor_list(), so a removed sensor still has one
+        sensor_list = self._data_source.lock_sensor_list()
+        listed = mac in sensor_list
+        self._data_source.unlock_sensor_list()
+        if mac not in versions or not listed:
+            raise _ApiError(404, f"Unknown sensor {mac}")
+        etag = SensorHttpApi._make_etag(f"sensor-{id(self._data_source)}-{mac}-{versions[mac]}")
+
+        def build_body():
+            sensor_list = self._data_source.lock_sensor_list()
+            data = dict(sensor_list.get(mac, {}))
+            self._data_source.unlock_sensor_list()
+            return SensorHttpApi._sensor_json(mac, data, versions[mac])
+
+        return etag, build_body
+
+    def _history_response(self, mac, params):
+        """
+        History of one sensor
+        :param mac: The mac of the sensor
+        :param params: Parsed query parameters
+        :return: A tuple of (etag, body builder)
+        """
+        mac = mac.upper()
+        if "end" in params:
+            end = SensorHttpApi._parse_time(params["end"][0], "end")
+        else:
+            # Rounded up to the next minute so repeated polls ask for the same range
+            now = sensor_clock.now()
+            end = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        if "start" in params:
+            start = SensorHttpApi._parse_time(params["start"][0], "start")
+        else:
+            try:
+                start = end - datetime.timedelta(hours=SensorHttpApi.DEFAULT_HISTORY_HOURS)
+            except OverflowError:
+                raise _ApiError(400, "end is out of range")
+        if start >= end:
+            raise _ApiError(400, "start must be before end")
+
+        bucket_seconds = None
+        if "buckets" in params:
+            try:
+                buckets = int(params["buckets"][0])
+            except ValueError:
+                raise _ApiError(400, "buckets must be an integer")
+            if buckets < 1 or buckets > SensorHttpApi.MAX_BUCKETS:
+                raise _ApiError(400, f"buckets must be between 1 and {SensorHttpApi.MAX_BUCKETS}")
+            bucket_seconds = max(1, math.ceil((end - start).total_seconds() / buckets))
+
+        # A new sample of the sensor changes its version and so the ETag
+        _, versions = self._data_source.get_sensor_versions()
+        etag = SensorHttpApi._make_etag(f"history-{id(self._data_source)}-{mac}-{versions.get(mac, 0)}-"
+                                        f"{start}-{end}-{bucket_seconds}")
+
+        def build_body():
+            if bucket_seconds is None:
+                history = self._sensor_db.get_sensor_history_range(mac, start, end)
+            else:
+                history = self._sensor_db.get_sensor_history_buckets(mac, start, end, bucket_seconds)
+            if history is None:
+                raise _ApiError(500, f"Unable to query the history of {mac}")
+            body = {
+                "mac": mac,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "bucket_seconds": bucket_seconds,
+                "count": len(history),
+                "time": [dt.isoformat() for dt in history.data_times],
+            }
+            for metric in SensorHistoryColumns.METRICS:
+                body[metric] = [None if math.isnan(v) else v for v in history.metrics[metric]]
+            return body
+
+        return etag, build_body
+
+    def _export_body(self, params):
+        """
+        A chunk of raw SensorData records in id order. Not cached: each
+        chunk is only asked for once.
+        :param params: Parsed query parameters since_id and limit
+        :return: Body bytes
+        """
+        try:
+            since_id = int(params.get("since_id", ["0"])[0])
+            limit = int(params.get("limit", [str(SensorHttpApi.MAX_EXPORT_ROWS)])[0])
+        except ValueError:
+            raise _ApiError(400, "since_id and limit must be integers")
+        limit = max(1, min(limit, SensorHttpApi.MAX_EXPORT_ROWS))
+        rows = self._sensor_db.get_sensor_data_export(since_id, limit)
+        if rows is None:
+            raise _ApiError(500, "Unable to export sensor data")
+        body = {
+            "columns": ["id", "mac", "name", "format", "temperature", "humidity", "pressure",
+                        "tx_power", "battery", "data_time"],
+            "rows": rows,
+            "last_id": rows[-1][0] if len(rows) > 0 else since_id,
+            "more": len(rows) == limit,
+        }
+        return json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+    def _metrics_body(self):
+        """
+        Build the Prometheus text format metrics
+        :return: Body bytes
+        """
+        lines = []
+        sensor_list = self._data_source.lock_sensor_list()
+        sensors = [(mac, dict(data)) for mac, data in sensor_list.items()]
+        self._data_source.unlock_sensor_list()
+
+        gauges = [
+            ("sensor_temperature", "temperature", "Latest temperature"),
+            ("sensor_humidity", "humidity", "Latest relative humidity in percent"),
+            ("sensor_pressure", "pressure", "Latest pressure in hPa"),
+            ("sensor_battery_millivolts", "battery", "Latest battery voltage in mV"),
+            ("sensor_tx_power", "tx_power", "Latest transmit power in dBm"),
+        ]
+        for metric_name, key, help_text in gauges:
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} gauge")
+            for mac, data in sensors:
+                if data.get(key) is not None:
+                    lines.append(f"{metric_name}{SensorHttpApi._labels(mac, data)} {data[key]}")
+
+        lines.append("# HELP sensor_last_sample_timestamp_seconds Time of the latest sample")
+        lines.append("# TYPE sensor_last_sample_timestamp_seconds gauge")
+        for mac, data in sensors:
+            if isinstance(data.get("timestamp"), datetime.datetime):
+                lines.append(f"sensor_last_sample_timestamp_seconds{SensorHttpApi._labels(mac, data)} "
+                             f"{data['timestamp'].timestamp():.3f}")
+
+        self._counters_lock.acquire()
+        requests = dict(self._counters["requests"])
+        counters = {k: v for k, v in self._counters.items() if k != "requests"}
+        self._counters_lock.release()
+        lines.append("# HELP sensor_api_requests_total HTTP API requests by endpoint")
+        lines.append("# TYPE sensor_api_requests_total counter")
+        for endpoint, count in sorted(requests.items()):
+            lines.append(f'sensor_api_requests_total{{endpoint="{endpoint}"}} {count}')
+        for key, help_text in (("not_modified", "Requests answered with 304 Not Modified"),
+                               ("cache_hits", "Responses served from the response cache"),
+                               ("errors", "Requests answered with an error"),
+                               ("events_sent", "Server-Sent Events sent")):
+            lines.append(f"# HELP sensor_api_{key}_total {help_text}")
+            lines.append(f"# TYPE sensor_api_{key}_total counter")
+            lines.append(f"sensor_api_{key}_total {counters[key]}")
+        feed_stats = self._change_feed.stats
+        lines.append("# HELP sensor_api_event_clients Connected event stream clients")
+        lines.append("# TYPE sensor_api_event_clients gauge")
+        lines.append(f"sensor_api_event_clients {feed_stats['clients']}")
+        lines.append("# HELP sensor_api_events_coalesced_total Deltas merged into a delta already pending for a client")
+        lines.append("# TYPE sensor_api_events_coalesced_total counter")
+        lines.append(f"sensor_api_events_coalesced_total {feed_stats['coalesced']}")
+        lines.append("# HELP sensor_api_event_overflows_total Client buffer overflows replaced by a snapshot")
+        lines.append("# TYPE sensor_api_event_overflows_total counter")
+        lines.append(f"sensor_api_event_overflows_total {feed_stats['overflows']}")
+        lines.extend(SensorHttpApi._registry_metrics())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _registry_metrics():
+        """
+        The stage timings, counters and gauges of sensor_metrics in Prometheus text format
+        :return: A list of lines
+        """
+        lines = []
+        for name, snap in sensor_metrics.snapshot().items():
+            metric_name = "sensor_app_" + name.replace(".", "_")
+            if snap["type"] == "histogram":
+                metric_name += "_seconds"
+                lines.append(f"# HELP {metric_name} {snap['description'] or name}")
+                lines.append(f"# TYPE {metric_name} histogram")
+                for bound, count in snap["buckets"]:
+                    lines.append(f'{metric_name}_bucket{{le="{bound}"}} {count}')
+                lines.append(f"{metric_name}_sum {snap['sum']:.9f}")
+                lines.append(f"{metric_name}_count {snap['count']}")
+            elif snap["type"] == "counter":
+                metric_name += "_total"
+                lines.append(f"# HELP {metric_name} {snap['description'] or name}")
+                lines.append(f"# TYPE {metric_name} counter")
+                lines.append(f"{metric_name} {snap['value']}")
+            elif snap["value"] is not None:
+                lines.append(f"# HELP {metric_name} {snap['description'] or name}")
+                lines.append(f"# TYPE {metric_name} gauge")
+                lines.append(f"{metric_name} {snap['value']}")
+        return lines
+
+    def _count_request(self, endpoint):
+        self._counters_lock.acquire()
+        self._counters["requests"][endpoint] = self._counters["requests"].get(endpoint, 0) + 1
+        self._counters_lock.release()
+
+    def _count(self, key):
+        self._counters_lock.acquire()
+        self._counters[key] += 1
+        self._counters_lock.release()
+
+    @staticmethod
+    def _sensor_json(mac, data, version):
+        """
+        Select the JSON representation of a sensor's latest sample
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :param version: The sensor's version counter
+        :return: A dict
+        """
+        result = {"mac": mac, "version": version}
+        for key, value in data.items():
+            if key not in ("mac", "version", "id"):
+                result[key] = value
+        return result
+
+    @staticmethod
+    def _labels(mac, data):
+        name = str(data.get("name", "")).replace("\\", "\\\\").replace('"', '\\"')
+        return f'{{mac="{mac}",name="{name}"}}'
+
+    @staticmethod
+    def _make_etag(key):
+        return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest() + '"'
+
+    @staticmethod
+    def _parse_time(value, name):
+        """
+        Parse a query time parameter
+        :param value: ISO date/time or seconds since the epoch. An ISO time with
+        an offset (or Z) is converted to local time.
+        :param name: Parameter name for error messages
+        :return: A naive local datetime
+        """
+        try:
+            seconds = float(value)
+        except ValueError:
+            seconds = None
+        if seconds is not None:
+            try:
+                return datetime.datetime.fromtimestamp(seconds)
+            except (ValueError, OverflowError, OSError):
+                # nan, inf or out of the platform's range
+                raise _ApiError(400, f"{name} is out of range")
+        try:
+            t = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise _ApiError(400, f"{name} must be an ISO date/time or epoch seconds")
+        if t.tzinfo is not None:
+            # The DB holds local times
+            try:
+                t = t.astimezone().replace(tzinfo=None)
+            except (ValueError, OverflowError, OSError):
+                raise _ApiError(400, f"{name} is out of range")
+        return t
+
+    @staticmethod
+    def _json_default(value):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return str(value)
+
+
+class _SensorApiRequestHandler(BaseHTTPRequestHandler):
+    """
+    Maps HTTP requests onto the SensorHttpApi instance of the server
+    """
+    server_version = "SensorApp"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") == "/events":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.server.api.stream_events(self._write_event)
+            return
+        status, headers, body = self.server.api.handle_get(url.path, url.query,
+                                                           self.headers.get("If-None-Match"))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_event(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # Requests go to the app log instead of stderr
+        logging.getLogger("sensor_app").debug(f"HTTP API {self.address_string()} {format % args}")
+
+
+def start_http_api(data_source):
+    """
+    Start the HTTP API if the configuration enables it
+    :param data_source: The sensor data source to be served
+    :return: A running SensorHttpApi instance or None
+    """
+    config = Configuration.get_configuration()
+    port = int(config.get(Configuration.CFG_HTTP_API_PORT, 0))
+    if port == 0:
+        return None
+    api = SensorHttpApi(data_source, port)
+    try:
+        api.start()
+    except OSError as ex:
+        logging.getLogger("sensor_app").error(f"Unable to start the HTTP API on port {port}")
+        logging.getLogger("sensor_app").error(str(ex))
+        return None
+    return api
@@ -0,0 +1,370 @@
+#
+# sensor_metrics.py - Always-on stage timings, counters and gauges
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# A process wide registry of
+#   histograms  durations of hot path stages in fixed buckets (1 µs to 10 s)
+#   counters    monotonically increasing counts, with a recent rate
+#   gauges      current values, set directly or read from a function
+# Modules look up their metrics once, at import, and time a stage with
+# a start/stop pair on the monotonic perf_counter clock:
+#
+#   _ADD_SENSOR_TIME = sensor_metrics.histogram("db.add_sensor")
+#   ...
+#   t = _ADD_SENSOR_TIME.start()
+#   ... the stage ...
+#   _ADD_SENSOR_TIME.stop(t)
+#
+# A span costs well under 1 µs, so the metrics are always on. Updates are not
+# locked. The GIL makes each update safe, and a rare lost increment between
+# threads does not matter for statistics. sensor_metrics.snapshot() returns
+# everything as a dict, and the HTTP API serves it on /metrics.
+#
+
+
+from bisect import bisect_left
+from threading import Lock
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# Bucket upper bounds in seconds, 1-2-5 steps from 1 µs to 10 s. Longer
+# durations go to an overflow bucket.
+DEFAULT_BUCKETS = tuple(round(m * 10.0 ** e, 6) for e in range(-6, 1) for m in (1, 2, 5)) + (10.0,)
+
+# The window of Counter.rate() in seconds
+RATE_WINDOW = 10.0
+
+
+class Histogram:
+    """
+    Durations in fixed buckets
+    """
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self._bounds = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        # The last count is the overflow bucket
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    # Start a span. Returns the start time to pass to stop().
+    start = staticmethod(time.perf_counter)
+
+    def stop(self, start):
+        """
+        End a span and record its duration
+        :param start: The value returned by start()
+        :return: The duration in seconds
+        """
+        elapsed = time.perf_counter() - start
+        # observe(), inlined to keep spans cheap
+        self._counts[bisect_left(self._bounds, elapsed)] += 1
+        self._count += 1
+        self._sum += elapsed
+        if elapsed > self._max:
+            self._max = elapsed
+        return elapsed
+
+    def observe(self, seconds):
+        """
+        Record a duration
+        :param seconds: The duration
+        :return: None
+        """
+        self._counts[bisect_left(self._bounds, seconds)] += 1
+        self._count += 1
+        self._sum += seconds
+        if seconds > self._max:
+            self._max = seconds
+
+    @property
+    def count(self):
+        return self._count
+
+    def percentile(self, p):
+        """
+        Estimate a percentile from the buckets
+        :param p: 0.0 to 1.0
+        :return: The upper bound of the bucket holding the percentile in seconds,
+        capped at the maximum seen. 0.0 when empty.
+        """
+        counts = list(self._counts)
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = p * total
+        running = 0
+        for i, count in enumerate(counts):
+            running += count
+            if running >= rank and count > 0:
+                if i < len(self._bounds):
+                    return min(self._bounds[i], self._max)
+                break
+        return self._max
+
+    def snapshot(self):
+        """
+        :return: A dict of count, sum, mean, max, p50, p90, p99 (seconds) and
+        buckets, a list of (upper bound, cumulative count) ending with ("+Inf", count)
+        """
+        counts = list(self._counts)
+        count = sum(counts)
+        buckets = []
+        running = 0
+        for bound, bucket_count in zip(self._bounds + ("+Inf",), counts):
+            running += bucket_count
+            buckets.append((bound, running))
+        return {
+            "type": "histogram",
+            "description": self.description,
+            "count": count,
+            "sum": self._sum,
+            "mean": self._sum / count if count > 0 else 0.0,
+            "max": self._max,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Counter:
+    """
+    A count that only goes up
+    """
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        # (time, value) marks for rate(), added when the counter is read
+        self._marks = []
+        self._marks_lock = Lock()
+
+    def inc(self, n=1):
+        self._value += n
+
+    @property
+    def value(self):
+        return self._value
+
+    def rate(self):
+        """
+        The recent rate, over about RATE_WINDOW seconds or since the previous read
+        if that was longer ago
+        :return: Counts per second. 0.0 on the first read.
+        """
+        now = time.monotonic()
+        value = self._value
+        self._marks_lock.acquire()
+        if len(self._marks) == 0 or now - self._marks[-1][0] >= 1.0:
+            self._marks.append((now, value))
+        # Keep one mark at least RATE_WINDOW old
+        while len(self._marks) > 2 and now - self._marks[1][0] >= RATE_WINDOW:
+            del self._marks[0]
+        start_time, start_value = self._marks[0]
+        self._marks_lock.release()
+        if now - start_time <= 0.0:
+            return 0.0
+        return (value - start_value) / (now - start_time)
+
+    def snapshot(self):
+        return {"type": "counter", "description": self.description, "value": self._value, "rate": self.rate()}
+
+
+class Gauge:
+    """
+    A current value. Either set() by the owner or read from a function on demand.
+    """
+    def __init__(self, name, description="", function=None):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._function = function
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """
+        :param function: A callable returning the value, or None to keep the last value
+        :return: None
+        """
+        if function is None and self._function is not None:
+            self._value = self.value
+        self._function = function
+
+    @property
+    def value(self):
+        function = self._function
+        if function is not None:
+            try:
+                return function()
+            except Exception:
+                return None
+        return self._value
+
+    def snapshot(self):
+        return {"type": "gauge", "description": self.description, "value": self.value}
+
+
+class MetricsRegistry:
+    """
+    Metrics keyed by name
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _get(self, name, cls, description, **kwargs):
+        self._lock.acquire()
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, description, **kwargs)
+            self._metrics[name] = metric
+        self._lock.release()
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} is a {type(metric).__name__}, not a {cls.__name__}")
+        return metric
+
+    def histogram(self, name, description=""):
+        return self._get(name, Histogram, description)
+
+    def counter(self, name, description=""):
+        return self._get(name, Counter, description)
+
+    def gauge(self, name, description="", function=None):
+        gauge = self._get(name, Gauge, description)
+        if function is not None:
+            gauge.set_function(function)
+        return gauge
+
+    def metrics(self):
+        """
+        :return: A list of all metrics sorted by name
+        """
+        self._lock.acquire()
+        metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        self._lock.release()
+        return metrics
+
+    def snapshot(self):
+        """
+        :return: A dict of metric snapshots keyed by name
+        """
+        return {metric.name: metric.snapshot() for metric in self.metrics()}
+
+    def reset(self):
+        """
+        Clear the histograms, e.g. at the start of a benchmark. Counters and gauges are kept.
+        :return: None
+        """
+        for metric in self.metrics():
+            if isinstance(metric, Histogram):
+                metric.reset()
+
+
+_registry = MetricsRegistry()
+
+
+def _rss_bytes():
+    """
+    Resident set size of this process. Falls back to the peak where /proc is not available.
+    :return: Bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0
+        # bytes on macOS, KB elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+_registry.gauge("process.rss_bytes", "Resident memory of this process", _rss_bytes)
+
+
+def get_registry():
+    return _registry
+
+
+def histogram(name, description=""):
+    """
+    Get or create a histogram
+    :param name: Dotted stage name, e.g. "db.add_sensor"
+    :param description: One line description
+    :return: The Histogram
+    """
+    return _registry.histogram(name, description)
+
+
+def counter(name, description=""):
+    """
+    Get or create a counter
+    :param name: Dotted name, e.g. "samples.received"
+    :param description: One line description
+    :return: The Counter
+    """
+    return _registry.counter(name, description)
+
+
+def gauge(name, description="", function=None):
+    """
+    Get or create a gauge
+    :param name: Dotted name, e.g. "bus.db_writer.depth"
+    :param description: One line description
+    :param function: If given, the gauge reads its value from this callable
+    :return: The Gauge
+    """
+    return _registry.gauge(name, description, function)
+
+
+def snapshot():
+    """
+    All metrics
+    :return: A dict of metric snapshots keyed by name
+    """
+    return _registry.snapshot()
+
+
+if __name__ == "__main__":
+    # Measure the cost of a span
+    h = histogram("bench.span")
+    n = 1000000
+    start = time.perf_counter()
+    for _ in range(n):
+        t = h.start()
+        h.stop(t)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n):
+        pass
+    elapsed -= time.perf_counter() - start
+    print(f"{elapsed * 1e9 / n:.0f} ns per span")
+    c = counter("bench.counter")
+    start = time.perf_counter()
+    for _ in range(n):
+        c.inc()
+    print(f"{(time.perf_counter() - start) * 1e9 / n:.0f} ns per counter increment")
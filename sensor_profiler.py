@@ -0,0 +1,254 @@
+#
+# sensor_profiler.py - Sampling profiler that can be toggled at run time
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# While running, the profiler samples the stacks of all threads (sensor
+# adapter, bus subscribers, HTTP API, GUI...) "profiler_sample_rate" times a
+# second from its own thread. Nothing is hooked into the profiled code, so
+# the overhead is that of the sampling thread (reported in the log when the
+# profiler stops). Sampling is by wall clock: a thread waiting for work shows
+# up in its wait.
+#
+# The profiler is toggled by SIGUSR1 (see install_signal_handler()) or, in the
+# wx app, View > Start profiling. When it stops, it writes next to the log file
+#   <log name>_profile_<time>.folded  collapsed stacks, one "thread;outer;...;inner count"
+#                                     line per stack, for flamegraph.pl or speedscope
+#   <log name>_profile_<time>.pstats  a cProfile compatible stats file. Times are
+#                                     estimated from the samples. Call counts are
+#                                     sample counts.
+# e.g.
+#   kill -USR1 <pid>   (start)
+#   kill -USR1 <pid>   (stop and write)
+#   flamegraph.pl sensor_app_profile_20230601_120000.folded > profile.svg
+#   python -m pstats sensor_app_profile_20230601_120000.pstats
+#
+
+
+import logging
+import marshal
+import os
+import signal
+import sys
+import threading
+import time
+from configuration import Configuration
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of all other threads until stopped, then writes the results
+    """
+    DEFAULT_RATE = 100.0
+
+    def __init__(self, output_base, rate=None):
+        """
+        :param output_base: Path of the output files, without extension
+        :param rate: Samples per second. The default is the configured profiler_sample_rate.
+        """
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self._logger = logging.getLogger("sensor_app")
+        if rate is None:
+            config = Configuration.get_configuration()
+            rate = config.get(Configuration.CFG_PROFILER_SAMPLE_RATE, SamplingProfiler.DEFAULT_RATE) \
+                if config is not None else SamplingProfiler.DEFAULT_RATE
+        self._rate = max(float(rate), 1.0)
+        self._output_base = output_base
+        self._stop_event = threading.Event()
+        # Sample counts keyed by (thread name, code objects innermost first)
+        self._stacks = {}
+        self._samples = 0
+        self._sampling_time = 0.0
+        self._elapsed = 0.0
+
+    @property
+    def folded_file(self):
+        return self._output_base + ".folded"
+
+    @property
+    def pstats_file(self):
+        return self._output_base + ".pstats"
+
+    def stop(self, wait=False):
+        """
+        Stop sampling. The results are written by the profiler thread.
+        :param wait: Wait until the results are written
+        :return: None
+        """
+        self._stop_event.set()
+        if wait:
+            self.join()
+
+    def run(self):
+        self._logger.info(f"Profiler sampling all threads at {self._rate:g}/s")
+        interval = 1.0 / self._rate
+        own_ident = threading.get_ident()
+        start = time.monotonic()
+        next_sample = start
+        while not self._stop_event.is_set():
+            t = time.perf_counter()
+            self._sample(own_ident)
+            self._sampling_time += time.perf_counter() - t
+            # Samples missed when the machine is busy are skipped, not made up
+            next_sample = max(next_sample + interval, time.monotonic())
+            self._stop_event.wait(next_sample - time.monotonic())
+        self._elapsed = time.monotonic() - start
+        try:
+            self._write()
+        except Exception as ex:
+            self._logger.error("Unable to write the profile")
+            self._logger.error(str(ex))
+
+    def _sample(self, own_ident):
+        """
+        Record the current stack of every other thread
+        :param own_ident: The profiler thread's ident
+        :return: None
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = self._stacks
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)), tuple(codes))
+            stacks[key] = stacks.get(key, 0) + 1
+        self._samples += 1
+
+    @staticmethod
+    def _label(code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    @staticmethod
+    def _func(code):
+        # The function key of cProfile stats
+        return code.co_filename, code.co_firstlineno, code.co_name
+
+    def _write(self):
+        """
+        Write the collapsed stacks and the pstats file
+        :return: None
+        """
+        # Time represented by one sample, from the rate actually achieved
+        interval = self._elapsed / self._samples if self._samples > 0 else 1.0 / self._rate
+
+        with open(self.folded_file, "w") as f:
+            for (thread_name, codes), count in sorted(self._stacks.items(), key=lambda item: -item[1]):
+                frames = [thread_name.replace(";", ":")] + [SamplingProfiler._label(c) for c in reversed(codes)]
+                f.write(";".join(frames) + f" {count}\n")
+
+        # cProfile stats: {func: (primitive calls, calls, own time, cumulative time, {caller: (...)})}
+        stats = {}
+        for (thread_name, codes), count in self._stacks.items():
+            if len(codes) == 0:
+                continue
+            seen = set()
+            for depth, code in enumerate(codes):
+                func = SamplingProfiler._func(code)
+                entry = stats.get(func)
+                if entry is None:
+                    entry = [0, 0, 0.0, 0.0, {}]
+                    stats[func] = entry
+                own = count * interval if depth == 0 else 0.0
+                entry[2] += own
+                # Recursive functions are counted once per stack
+                if func not in seen:
+                    seen.add(func)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += count * interval
+                if depth + 1 < len(codes):
+                    caller = SamplingProfiler._func(codes[depth + 1])
+                    edge = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                    entry[4][caller] = (edge[0] + count, edge[1] + count, edge[2] + own, edge[3] + count * interval)
+        with open(self.pstats_file, "wb") as f:
+            marshal.dump({func: tuple(entry) for func, entry in stats.items()}, f)
+
+        self._logger.info(f"Profile of {self._samples} samples over {self._elapsed:.1f} s written to "
+                          f"{self.folded_file} and {self.pstats_file}. Sampling took "
+                          f"{100.0 * self._sampling_time / max(self._elapsed, 1e-9):.2f}% of a core.")
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def _log_file_base():
+    """
+    Where the profile goes: next to the sensor_app logger's log file
+    :return: A path without extension
+    """
+    for handler in logging.getLogger("sensor_app").handlers:
+        path = getattr(handler, "baseFilename", None)
+        if path is not None:
+            return os.path.splitext(path)[0]
+    return os.path.abspath("sensor_app")
+
+
+def start_profiler(rate=None):
+    """
+    Start profiling if not already profiling
+    :param rate: Samples per second. The default is the configured profiler_sample_rate.
+    :return: The running SamplingProfiler
+    """
+    global _profiler
+    _profiler_lock.acquire()
+    if _profiler is None:
+        output_base = f"{_log_file_base()}_profile_{time.strftime('%Y%m%d_%H%M%S')}"
+        _profiler = SamplingProfiler(output_base, rate=rate)
+        _profiler.start()
+    profiler = _profiler
+    _profiler_lock.release()
+    return profiler
+
+
+def stop_profiler(wait=False):
+    """
+    Stop profiling and write the results
+    :param wait: Wait until the results are written
+    :return: The stopped SamplingProfiler or None if not profiling
+    """
+    global _profiler
+    _profiler_lock.acquire()
+    profiler = _profiler
+    _profiler = None
+    _profiler_lock.release()
+    if profiler is not None:
+        profiler.stop(wait=wait)
+    return profiler
+
+
+def is_profiling():
+    return _profiler is not None
+
+
+def toggle_profiler():
+    """
+    Start profiling, or stop and write the results if already profiling
+    :return: True if profiling was started
+    """
+    if is_profiling():
+        stop_profiler()
+        return False
+    start_profiler()
+    return True
+
+
+def install_signal_handler():
+    """
+    Toggle the profiler on SIGUSR1, where the platform has it
+    :return: None
+    """
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: toggle_profiler())
@@ -0,0 +1,316 @@
+#
+# sensor_reception_stats.py - Per sensor reception quality
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# ReceptionStats is a sample bus subscriber that tracks, per sensor and in
+# O(1) per sample:
+#   packets/min   unique measurements received per minute
+#   loss          measurements missed, from gaps in measurement_sequence_number
+#   duplicates    rebroadcasts of a measurement already received
+#   longest gap   longest time between unique measurements
+#   jitter        mean deviation of the time between measurements from its
+#                 running mean (gain 1/16, as in RFC 3550)
+#   tx_power and RSSI (where the sensor adapter provides it)
+# Every "reception_stats_period" seconds the figures of the period are
+# written to the ReceptionStats table and the period starts over. Running
+#   python sensor_reception_stats.py [--hours 24]
+# ranks the sensors by loss over the last hours, so tags with a weak signal
+# stand out.
+#
+
+
+import argparse
+from threading import Lock
+import sensor_clock
+
+
+# measurement_sequence_number wraps at this value
+SEQUENCE_MODULUS = 65536
+# A forward jump in the sequence number larger than this is taken as a
+# restart of the tag (or a reordered packet), not as lost measurements
+MAX_SEQUENCE_GAP = 1024
+# Gain of the running mean interval and jitter
+JITTER_GAIN = 1.0 / 16.0
+
+
+class SensorReception:
+    """
+    Reception state of one sensor
+    """
+    __slots__ = ("mac", "last_sequence", "last_arrival", "mean_interval", "jitter",
+                 "packets", "duplicates", "lost", "expected", "restarts", "longest_gap",
+                 "tx_power", "rssi_sum", "rssi_count", "rssi_min",
+                 "total_packets", "total_lost", "total_expected", "total_longest_gap")
+
+    def __init__(self, mac):
+        self.mac = mac
+        self.last_sequence = None
+        self.last_arrival = None
+        self.mean_interval = None
+        self.jitter = 0.0
+        self.tx_power = None
+        self.total_packets = 0
+        self.total_lost = 0
+        self.total_expected = 0
+        self.total_longest_gap = 0.0
+        self.start_period()
+
+    def start_period(self):
+        """
+        Reset the figures of the current period
+        :return: None
+        """
+        self.packets = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.expected = 0
+        self.restarts = 0
+        self.longest_gap = 0.0
+        self.rssi_sum = 0
+        self.rssi_count = 0
+        self.rssi_min = None
+
+    def add(self, sequence, arrival, tx_power, rssi):
+        """
+        Account for a received sample
+        :param sequence: The measurement sequence number or None
+        :param arrival: Reception time in seconds
+        :param tx_power: Transmit power in dBm or None
+        :param rssi: Received signal strength in dBm or None
+        :return: None
+        """
+        if sequence is not None and self.last_sequence is not None:
+            delta = (sequence - self.last_sequence) % SEQUENCE_MODULUS
+            if delta == 0:
+                self.duplicates += 1
+                return
+            if delta <= MAX_SEQUENCE_GAP:
+                self.expected += delta
+                self.lost += delta - 1
+                self.total_expected += delta
+                self.total_lost += delta - 1
+            else:
+                self.restarts += 1
+                self.expected += 1
+                self.total_expected += 1
+        elif sequence is not None:
+            self.expected += 1
+            self.total_expected += 1
+        self.last_sequence = sequence
+
+        if self.last_arrival is not None:
+            interval = arrival - self.last_arrival
+            if interval > self.longest_gap:
+                self.longest_gap = interval
+            if interval > self.total_longest_gap:
+                self.total_longest_gap = interval
+            if self.mean_interval is None:
+                self.mean_interval = interval
+            else:
+                self.jitter += (abs(interval - self.mean_interval) - self.jitter) * JITTER_GAIN
+                self.mean_interval += (interval - self.mean_interval) * JITTER_GAIN
+        self.last_arrival = arrival
+
+        self.packets += 1
+        self.total_packets += 1
+        if tx_power is not None:
+            self.tx_power = tx_power
+        if rssi is not None:
+            self.rssi_sum += rssi
+            self.rssi_count += 1
+            if self.rssi_min is None or rssi < self.rssi_min:
+                self.rssi_min = rssi
+
+    def summary(self, period_seconds):
+        """
+        The figures of the current period
+        :param period_seconds: Length of the period
+        :return: A dict like the columns of the ReceptionStats table
+        """
+        return {
+            "mac": self.mac,
+            "packets": self.packets,
+            "duplicates": self.duplicates,
+            "lost": self.lost,
+            "expected": self.expected,
+            "restarts": self.restarts,
+            "packets_per_minute": self.packets * 60.0 / period_seconds if period_seconds > 0 else None,
+            "loss_pct": 100.0 * self.lost / self.expected if self.expected > 0 else None,
+            "longest_gap": self.longest_gap,
+            "jitter": self.jitter,
+            "tx_power": self.tx_power,
+            "rssi_avg": self.rssi_sum / self.rssi_count if self.rssi_count > 0 else None,
+            "rssi_min": self.rssi_min,
+        }
+
+
+class ReceptionStats:
+    """
+    Reception quality of all sensors. A batch subscriber of the sample bus.
+    """
+    def __init__(self, sensor_db, interval):
+        """
+        :param sensor_db: The SensorDB the period summaries are written to
+        :param interval: Length of a summary period in seconds
+        """
+        self._sensor_db = sensor_db
+        self._interval = interval
+        self._sensors = {}
+        self._lock = Lock()
+        self._period_start = sensor_clock.now()
+
+    def add_samples(self, samples):
+        """
+        Bus handler
+        :param samples: A list of (mac, data) tuples
+        :return: None
+        """
+        self._lock.acquire()
+        for mac, data in samples:
+            reception = self._sensors.get(mac)
+            if reception is None:
+                reception = SensorReception(mac)
+                self._sensors[mac] = reception
+            reception.add(data.get("measurement_sequence_number"), data["timestamp"].timestamp(),
+                          data.get("tx_power"), data.get("rssi"))
+        self._lock.release()
+
+        if (sensor_clock.now() - self._period_start).total_seconds() >= self._interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the summary of the current period and start a new one
+        :return: The number of sensor summaries written
+        """
+        now = sensor_clock.now()
+        self._lock.acquire()
+        period_seconds = (now - self._period_start).total_seconds()
+        rows = []
+        for reception in self._sensors.values():
+            if reception.packets > 0 or reception.duplicates > 0:
+                row = reception.summary(period_seconds)
+                row["period_start"] = self._period_start
+                row["period_end"] = now
+                rows.append(row)
+            reception.start_period()
+        self._period_start = now
+        self._lock.release()
+        if len(rows) == 0:
+            return 0
+        return self._sensor_db.add_reception_stats(rows)
+
+    def snapshot(self):
+        """
+        The figures of the current period and since the start
+        :return: A list of dicts sorted by mac. Each dict is a period summary plus
+        total_packets, total_lost, total_loss_pct and total_longest_gap.
+        """
+        now = sensor_clock.now()
+        self._lock.acquire()
+        period_seconds = (now - self._period_start).total_seconds()
+        result = []
+        for mac in sorted(self._sensors.keys()):
+            reception = self._sensors[mac]
+            row = reception.summary(period_seconds)
+            row["total_packets"] = reception.total_packets
+            row["total_lost"] = reception.total_lost
+            row["total_loss_pct"] = 100.0 * reception.total_lost / reception.total_expected \
+                if reception.total_expected > 0 else None
+            row["total_longest_gap"] = reception.total_longest_gap
+            result.append(row)
+        self._lock.release()
+        return result
+
+
+def summarize(rows):
+    """
+    Combine period summaries per sensor
+    :param rows: ReceptionStats records as returned by SensorDB.get_reception_stats()
+    :return: A list of dicts, one per sensor, sorted by loss (worst first)
+    """
+    sensors = {}
+    for row in rows:
+        s = sensors.get(row["mac"])
+        if s is None:
+            s = {"mac": row["mac"], "name": row["name"], "periods": 0, "minutes": 0.0, "packets": 0,
+                 "duplicates": 0, "lost": 0, "expected": 0, "restarts": 0, "longest_gap": 0.0,
+                 "jitter_sum": 0.0, "rssi_sum": 0.0, "rssi_periods": 0, "rssi_min": None, "tx_power": None}
+            sensors[row["mac"]] = s
+        s["periods"] += 1
+        if row["packets_per_minute"]:
+            s["minutes"] += row["packets"] / row["packets_per_minute"]
+        for key in ("packets", "duplicates", "lost", "expected", "restarts"):
+            s[key] += row[key]
+        s["longest_gap"] = max(s["longest_gap"], row["longest_gap"] or 0.0)
+        s["jitter_sum"] += row["jitter"] or 0.0
+        if row["rssi_avg"] is not None:
+            s["rssi_sum"] += row["rssi_avg"]
+            s["rssi_periods"] += 1
+        if row["rssi_min"] is not None and (s["rssi_min"] is None or row["rssi_min"] < s["rssi_min"]):
+            s["rssi_min"] = row["rssi_min"]
+        if row["tx_power"] is not None:
+            s["tx_power"] = row["tx_power"]
+
+    result = []
+    for s in sensors.values():
+        result.append({
+            "mac": s["mac"],
+            "name": s["name"],
+            "periods": s["periods"],
+            "packets": s["packets"],
+            "packets_per_minute": s["packets"] / s["minutes"] if s["minutes"] > 0 else None,
+            "duplicates": s["duplicates"],
+            "lost": s["lost"],
+            "loss_pct": 100.0 * s["lost"] / s["expected"] if s["expected"] > 0 else None,
+            "restarts": s["restarts"],
+            "longest_gap": s["longest_gap"],
+            "jitter": s["jitter_sum"] / s["periods"],
+            "tx_power": s["tx_power"],
+            "rssi_avg": s["rssi_sum"] / s["rssi_periods"] if s["rssi_periods"] > 0 else None,
+            "rssi_min": s["rssi_min"],
+        })
+    result.sort(key=lambda s: (-(s["loss_pct"] or 0.0), s["rssi_avg"] if s["rssi_avg"] is not None else 0.0))
+    return result
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+if __name__ == "__main__":
+    # Rank the sensors by reception quality
+    import datetime
+    from configuration import Configuration
+    from sensor_db import SensorDB
+
+    parser = argparse.ArgumentParser(description="Reception quality of the sensors")
+    parser.add_argument("--hours", type=float, default=24.0, help="Summarize this many past hours")
+    parser.add_argument("--db", default=None, help="Sensor DB. The default is the configured sensor DB.")
+    args = parser.parse_args()
+
+    Configuration.load_configuration()
+    since = sensor_clock.now() - datetime.timedelta(hours=args.hours)
+    records = SensorDB(db_path=args.db).get_reception_stats(since)
+    if records is None or len(records) == 0:
+        print(f"No reception statistics in the last {args.hours:g} hours")
+    else:
+        print(f"{'name':16s} {'mac':17s} {'pkt/min':>8s} {'loss %':>7s} {'lost':>7s} {'dups':>7s} "
+              f"{'restarts':>8s} {'gap s':>7s} {'jitter s':>8s} {'tx dBm':>6s} {'rssi':>6s} {'min':>5s}")
+        for s in summarize(records):
+            print(f"{s['name'][:16]:16s} {s['mac']:17s} {_fmt(s['packets_per_minute'], '8.1f')} "
+                  f"{_fmt(s['loss_pct'], '7.2f')} {s['lost']:7d} {s['duplicates']:7d} {s['restarts']:8d} "
+                  f"{s['longest_gap']:7.1f} {s['jitter']:8.3f} {_fmt(s['tx_power'], '6d')} "
+                  f"{_fmt(s['rssi_avg'], '6.1f')} {_fmt(s['rssi_min'], '5d')}")
@@ -9,13 +9,15 @@
 # See the LICENSE file for more details.
 #
 
-from datetime import datetime
+import time
 from threading import Thread, Lock
 from json import dumps, dump
 import logging
 import copy
 from configuration import Configuration
-from sensor_utils import to_fahrenheit
+from sensor_utils import to_fahrenheit, prepare_sensor_data
+from sensor_capture import CaptureWriter
+import sensor_clock
 
 from ruuvitag_sensor.ruuvi import RuuviTagSensor, RunFlag
 
@@ -31,12 +33,16 @@ class SensorThread(Thread):
         self._data_point_count = 0
         self._runflag = RunFlag()
         self._logger = logging.getLogger("sensor_app")
-        super().__init__()
+        super().__init__(name="SensorThread")
 
         # Get access to the ruuvitags configuration (mac to name)
         self._config = Configuration.get_configuration()
         self._temperature_format = self._config[Configuration.CFG_TEMPERATURE_FORMAT].lower()
 
+        # Record raw sensor data for replay if configured
+        capture_file = self._config.get(Configuration.CFG_CAPTURE_FILE, "")
+        self._capture = CaptureWriter(capture_file) if capture_file else None
+
     def open(self):
         """
         Start data collection on the thread
@@ -55,6 +61,9 @@ class SensorThread(Thread):
         self.terminate()
         self._logger.info("Waiting for SensorThread to terminate")
         self.join()
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
 
     def run(self):
         try:
@@ -80,14 +89,11 @@ class SensorThread(Thread):
             mac = received_data[0]
             data = received_data[1]
 
-            # Make sure the mac is the same. The one in the data is lower case, no delimiters
-            data["mac"] = mac
+            # Record the data as received
+            if self._capture is not None:
+                self._capture.record(mac, data, time.time())
 
-            # Record when the data was received
-            data["timestamp"] = datetime.now()
-            # Convert temperature as required
-            if self._temperature_format == "f":
-                data["temperature"] = to_fahrenheit(float(data["temperature"]))
+            prepare_sensor_data(mac, data, self._temperature_format)
 
             # Pass data sample to receiver/observer
             if self._handle_sensor_data is not None:
@@ -113,7 +119,7 @@ class SensorThread(Thread):
 
         line_pre = str.format('Pressure:    {0:.2f} hPa', data['pressure'])
 
-        line_tod = f"TOD:         {str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}"
+        line_tod = f"TOD:         {str(sensor_clock.now().strftime('%Y-%m-%d %H:%M:%S'))}"
         line_count = f"Count:       {self._data_point_count}"
 
         # Print/log sensor data
@@ -0,0 +1,92 @@
+#
+# sensor_top.py - top style terminal view of the latest sensor values
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Reads the shared memory table published by sensor_collector.py and
+# redraws it every update_interval seconds. It never touches the sensor DB.
+#
+# Usage:
+#   python sensor_top.py [--once]
+#
+
+
+import sys
+import time
+from configuration import Configuration
+from shared_sensor_table import SharedSensorTable
+import sensor_clock
+
+
+def format_table(sensors, offline_time):
+    """
+    Format the latest sensor values as lines of text
+    :param sensors: A dict keyed by mac of sensor data dicts
+    :param offline_time: Age in seconds after which a sensor is marked offline
+    :return: A list of str
+    """
+    now = sensor_clock.now()
+    lines = [f"sensor_top - {now.strftime('%Y-%m-%d %H:%M:%S')} - {len(sensors)} sensors",
+             "",
+             f"{'NAME':20s} {'MAC':17s} {'TEMP':>7s} {'HUM':>6s} {'PRESS':>8s} {'BATT':>5s} {'AGE':>6s} {'SAMPLES':>8s}"]
+    for data in sorted(sensors.values(), key=lambda d: d["name"]):
+        age = (now - data["timestamp"]).total_seconds()
+        flag = " offline" if age > offline_time else ""
+        lines.append(f"{data['name'][:20]:20s} {data['mac']:17s} {data['temperature']:7.1f} "
+                     f"{data['humidity']:6.1f} {data['pressure']:8.1f} {data['battery']:5d} "
+                     f"{age:6.0f} {data['sample_count']:8d}{flag}")
+    return lines
+
+
+def main():
+    Configuration.load_configuration()
+    config = Configuration.get_configuration()
+    name = config.get(Configuration.CFG_SHARED_TABLE_NAME, SharedSensorTable.DEFAULT_NAME)
+    interval = float(config[Configuration.CFG_UPDATE_INTERVAL])
+    offline_time = float(config[Configuration.CFG_OFFLINE_TIME])
+    once = "--once" in sys.argv
+
+    table = None
+    try:
+        while True:
+            if table is None or not table.live:
+                if table is not None:
+                    table.close()
+                    table = None
+                try:
+                    table = SharedSensorTable.attach(name=name)
+                except (FileNotFoundError, ValueError):
+                    pass
+
+            if table is None:
+                lines = [f"Waiting for sensor_collector.py to publish {name}..."]
+            else:
+                lines = format_table(table.read_all(), offline_time)
+
+            if once:
+                print("\n".join(lines))
+                break
+            # Clear the screen and home the cursor
+            sys.stdout.write("\x1b[2J\x1b[H" + "\n".join(lines) + "\n")
+            sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if table is not None:
+            table.close()
+
+
+if __name__ == "__main__":
+    main()
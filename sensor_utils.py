@@ -15,19 +15,44 @@
 # along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import datetime
+import sensor_clock
+import sensor_metrics
+
+_DECODE_TIME = sensor_metrics.histogram("sample.decode", "Preparing a raw sample from the sensor adapter")
 
 
 def to_fahrenheit(centigrade):
     return 32.0 + (centigrade * 1.8)
 
 
+def prepare_sensor_data(mac, data, temperature_format):
+    """
+    Turn raw data from ruuvitag_sensor into a sample for handle_sensor_data.
+    Used by SensorThread and ReplaySensorAdapter.
+    :param mac: The mac of the sensor
+    :param data: The raw data dict. It is updated in place.
+    :param temperature_format: The configured temperature format, "f" or "c"
+    :return: The updated data dict
+    """
+    t = _DECODE_TIME.start()
+    # Make sure the mac is the same. The one in the data is lower case, no delimiters
+    data["mac"] = mac
+
+    # Record when the data was received
+    data["timestamp"] = sensor_clock.now()
+    # Convert temperature as required
+    if temperature_format == "f":
+        data["temperature"] = to_fahrenheit(float(data["temperature"]))
+    _DECODE_TIME.stop(t)
+    return data
+
+
 def now_str():
     """
     Return a formatted string containing the current date and time
     :return:
     """
-    now_dt = datetime.datetime.now()
+    now_dt = sensor_clock.now()
     # custom format to remove unwanted leading zeros
     ampm = "am"
     if now_dt.hour >= 12:
@@ -0,0 +1,233 @@
+#
+# shared_sensor_table.py - Latest sensor values in shared memory
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# The collector publishes the latest sample of each sensor into a fixed
+# layout table in a multiprocessing.shared_memory block. Any number of local
+# viewers can read the table without touching the sensor DB.
+#
+# Layout (all little endian):
+#   header: magic (4s), layout version (I), capacity (I), row count (I),
+#           live (I, 1 while the collector has the table open)
+#   rows:   sequence (I), mac (17s), name (32s), data_format (i),
+#           temperature (d), humidity (d), pressure (d), tx_power (i),
+#           battery (i), timestamp (d, epoch seconds), sample count (Q)
+#
+# Each row is protected by a seqlock. There is exactly one writer (the
+# collector). It makes the row's sequence number odd, writes the row, then
+# makes the sequence number even again. A reader copies the row and accepts
+# it only if the sequence number was even and unchanged across the copy.
+# Otherwise, it tries again. The sequence number divided by 2 is the number
+# of times the row has been written, which readers can use as a version.
+#
+# When the collector stops, it clears the live flag before removing the
+# table. A reader that sees the flag cleared should attach again to pick up
+# the table of a restarted collector.
+#
+
+
+import datetime
+import logging
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedSensorTable:
+    """
+    Fixed layout table of the latest sample of each sensor
+    """
+    MAGIC = b"SNSR"
+    LAYOUT_VERSION = 1
+    DEFAULT_NAME = "sensor_app_latest"
+    DEFAULT_CAPACITY = 64
+
+    _HEADER = struct.Struct("<4sIIII")
+    _SEQUENCE = struct.Struct("<I")
+    _ROW = struct.Struct("<I17s32sidddiidQ")
+    _READ_RETRIES = 100
+
+    def __init__(self, shm, owner):
+        """
+        Use SharedSensorTable.create() or SharedSensorTable.attach() instead
+        :param shm: A SharedMemory instance
+        :param owner: True if this instance created the shared memory
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._shm = shm
+        self._owner = owner
+        magic, version, self._capacity, _, _ = SharedSensorTable._HEADER.unpack_from(shm.buf, 0)
+        if magic != SharedSensorTable.MAGIC or version != SharedSensorTable.LAYOUT_VERSION:
+            raise ValueError(f"{shm.name} is not a version {SharedSensorTable.LAYOUT_VERSION} sensor table")
+        # Writer side only. Keyed by mac.
+        self._row_index = {}
+        self._sample_counts = {}
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, capacity=DEFAULT_CAPACITY):
+        """
+        Create the table (collector side). An existing table with the
+        same name, e.g. left behind by a crash, is replaced.
+        :param name: Name of the shared memory block
+        :param capacity: Maximum number of sensors
+        :return: A SharedSensorTable instance
+        """
+        size = cls._HEADER.size + (cls._ROW.size * capacity)
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        cls._HEADER.pack_into(shm.buf, 0, cls.MAGIC, cls.LAYOUT_VERSION, capacity, 0, 1)
+        return SharedSensorTable(shm, True)
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME):
+        """
+        Attach to an existing table (viewer side)
+        :param name: Name of the shared memory block
+        :return: A SharedSensorTable instance. Raises FileNotFoundError if there is no table.
+        """
+        # The resource tracker would otherwise unlink the block when this
+        # process exits, out from under the collector and other viewers.
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return SharedSensorTable(shm, False)
+
+    def close(self):
+        """
+        Detach from the table. The owner also removes it.
+        :return: None
+        """
+        if self._owner:
+            self._write_header(live=0)
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def live(self):
+        """
+        Answers the question: Is the collector still publishing to this table
+        :return: True if the table is live
+        """
+        return SharedSensorTable._HEADER.unpack_from(self._shm.buf, 0)[4] == 1
+
+    def publish(self, mac, data):
+        """
+        Write the latest sample of a sensor (writer side)
+        :param mac: The mac of the sensor
+        :param data: A dict of sensor data keys and values
+        :return: True if the sample was written, False if the table is full
+        """
+        index = self._row_index.get(mac)
+        if index is None:
+            index = len(self._row_index)
+            if index >= self._capacity:
+                return False
+            self._row_index[mac] = index
+            self._sample_counts[mac] = 0
+            new_row = True
+        else:
+            new_row = False
+        self._sample_counts[mac] += 1
+
+        offset = SharedSensorTable._HEADER.size + (index * SharedSensorTable._ROW.size)
+        buf = self._shm.buf
+        sequence = SharedSensorTable._SEQUENCE.unpack_from(buf, offset)[0]
+        # Odd means a write is in progress
+        SharedSensorTable._SEQUENCE.pack_into(buf, offset, (sequence + 1) & 0xFFFFFFFF)
+        SharedSensorTable._ROW.pack_into(
+            buf, offset,
+            (sequence + 1) & 0xFFFFFFFF,
+            mac.encode("utf-8"),
+            str(data.get("name", "")).encode("utf-8")[:32],
+            int(data.get("data_format") or 0),
+            float(data.get("temperature") or 0.0),
+            float(data.get("humidity") or 0.0),
+            float(data.get("pressure") or 0.0),
+            int(data.get("tx_power") or 0),
+            int(data.get("battery") or 0),
+            data["timestamp"].timestamp(),
+            self._sample_counts[mac],
+        )
+        SharedSensorTable._SEQUENCE.pack_into(buf, offset, (sequence + 2) & 0xFFFFFFFF)
+
+        if new_row:
+            self._write_header(live=1)
+        return True
+
+    def _write_header(self, live):
+        """
+        Write the table header (writer side)
+        :param live: 1 while the table is in use, 0 when the collector stops
+        :return: None
+        """
+        SharedSensorTable._HEADER.pack_into(self._shm.buf, 0, SharedSensorTable.MAGIC,
+                                            SharedSensorTable.LAYOUT_VERSION, self._capacity,
+                                            len(self._row_index), live)
+
+    def read_all(self):
+        """
+        Read the latest sample of every sensor (reader side)
+        :return: A dict keyed by mac of sensor data dicts. Each dict has a
+        "version" key that changes every time the sensor's row is written.
+        """
+        buf = self._shm.buf
+        row_count = SharedSensorTable._HEADER.unpack_from(buf, 0)[3]
+        result = {}
+        for index in range(min(row_count, self._capacity)):
+            data = self._read_row(buf, index)
+            if data is not None:
+                result[data["mac"]] = data
+        return result
+
+    def _read_row(self, buf, index):
+        """
+        Read one row, retrying while the writer is updating it
+        :param buf: The shared memory buffer
+        :param index: Row index
+        :return: A sensor data dict or None if a consistent copy could not be read
+        """
+        offset = SharedSensorTable._HEADER.size + (index * SharedSensorTable._ROW.size)
+        for _ in range(SharedSensorTable._READ_RETRIES):
+            row = SharedSensorTable._ROW.unpack_from(buf, offset)
+            sequence = SharedSensorTable._SEQUENCE.unpack_from(buf, offset)[0]
+            if row[0] == sequence and sequence % 2 == 0 and sequence != 0:
+                return {
+                    "mac": row[1].rstrip(b"\0").decode("utf-8"),
+                    "name": row[2].rstrip(b"\0").decode("utf-8", errors="replace"),
+                    "data_format": row[3],
+                    "temperature": row[4],
+                    "humidity": row[5],
+                    "pressure": row[6],
+                    "tx_power": row[7],
+                    "battery": row[8],
+                    "timestamp": datetime.datetime.fromtimestamp(row[9]),
+                    "sample_count": row[10],
+                    "version": sequence // 2,
+                }
+        self._logger.debug(f"Unable to read a consistent copy of shared sensor table row {index}")
+        return None
@@ -0,0 +1,114 @@
+#
+# test_sensor_http_api.py - Tests of the HTTP API time parameters
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+# Run from the repo root with: python -m unittest discover tests
+#
+
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from configuration import Configuration
+from sensor_data_source import SensorDataSource
+from sensor_http_api import SensorHttpApi
+
+
+class TestHistoryTimes(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._saved_config = Configuration._active_config
+        Configuration._active_config = {
+            Configuration.CFG_SENSOR_DATABASE: os.path.join(self._dir.name, "sensor_db.sqlite3"),
+            Configuration.CFG_DATABASE_TIMEOUT: 5.0,
+        }
+        self._api = SensorHttpApi(SensorDataSource(), 0)
+
+    def tearDown(self):
+        Configuration._active_config = self._saved_config
+        self._dir.cleanup()
+
+    def _get_history(self, query):
+        status, _, body = self._api.handle_get("/sensors/AA:BB:CC:DD:EE:FF/history", query, None)
+        return status, json.loads(body)
+
+    @staticmethod
+    def _local(value):
+        return datetime.datetime.fromisoformat(value).astimezone().replace(tzinfo=None)
+
+    def test_z_is_converted_to_local_time(self):
+        t = SensorHttpApi._parse_time("2026-10-18T00:00:00Z", "start")
+        self.assertIsNone(t.tzinfo)
+        self.assertEqual(t, self._local("2026-10-18T00:00:00+00:00"))
+
+    def test_offset_is_converted_to_local_time(self):
+        t = SensorHttpApi._parse_time("2026-10-18T12:00:00+02:00", "start")
+        self.assertIsNone(t.tzinfo)
+        self.assertEqual(t, self._local("2026-10-18T10:00:00+00:00"))
+
+    def test_naive_time_is_unchanged(self):
+        t = SensorHttpApi._parse_time("2026-10-18T12:00:00", "start")
+        self.assertEqual(t, datetime.datetime(2026, 10, 18, 12))
+
+    def test_mixed_naive_and_aware(self):
+        status, _ = self._get_history("start=2026-10-18T00:00:00Z&end=2026-10-19T00:00:00")
+        self.assertEqual(status, 200)
+        status, _ = self._get_history("start=2026-10-18T00:00:00&end=2026-10-19T00:00:00%2B02:00")
+        self.assertEqual(status, 200)
+
+    def test_both_aware(self):
+        status, _ = self._get_history("start=2026-10-18T00:00:00Z&end=2026-10-18T02:00:00%2B02:00")
+        self.assertEqual(status, 400)
+        status, _ = self._get_history("start=2026-10-18T00:00:00Z&end=2026-10-18T02:00:01%2B02:00")
+        self.assertEqual(status, 200)
+
+    def test_aware_out_of_range(self):
+        status, body = self._get_history("start=0001-01-01T00:00:00%2B05:00&end=2026-10-19T00:00:00")
+        self.assertEqual(status, 400)
+        self.assertEqual(body["error"], "start is out of range")
+
+
+class TestSensorAfterReset(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._saved_config = Configuration._active_config
+        Configuration._active_config = {
+            Configuration.CFG_SENSOR_DATABASE: os.path.join(self._dir.name, "sensor_db.sqlite3"),
+            Configuration.CFG_DATABASE_TIMEOUT: 5.0,
+        }
+        self._data_source = SensorDataSource()
+        self._api = SensorHttpApi(self._data_source, 0)
+
+    def tearDown(self):
+        Configuration._active_config = self._saved_config
+        self._dir.cleanup()
+
+    def test_removed_sensor_is_not_found(self):
+        self._data_source._record_samples([("AA:BB:CC:DD:EE:FF", {"mac": "AA:BB:CC:DD:EE:FF", "name": "Test"})])
+        status, _, _ = self._api.handle_get("/sensors/AA:BB:CC:DD:EE:FF", "", None)
+        self.assertEqual(status, 200)
+        self._data_source.reset_sensor_list()
+        status, _, _ = self._api.handle_get("/sensors/AA:BB:CC:DD:EE:FF", "", None)
+        self.assertEqual(status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#
+# tk_app_stats_dlg.py - A window showing live app statistics
+# Copyright © 2023 Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+from tkinter import Toplevel, Frame, Button, Label
+from tkinter import font
+from sensor_app_stats import AppStats
+
+
+class AppStatsDlg(Toplevel):
+    """
+    Ingest rates, stage latencies, queue and storage figures, refreshed
+    while the window is open
+    """
+    # Refresh interval in ms. A refresh only reads in-memory metrics.
+    REFRESH_INTERVAL_MS = 1000
+
+    def __init__(self, parent, data_source):
+        """
+        Create the app stats window
+        :param parent: Parent of this window
+        :param data_source: The app's sensor data source
+        """
+        super(AppStatsDlg, self).__init__(parent)
+        self.title("App Stats")
+        self._stats = AppStats(data_source)
+        self._heading_font = font.Font(family="Arial", size=12, weight="bold")
+
+        self._overall_frame = Frame(self)
+        self._overall_frame.grid(row=0, column=0, sticky="nw", padx=10, pady=5)
+        self._sensors_frame = Frame(self)
+        self._sensors_frame.grid(row=1, column=0, sticky="nw", padx=10, pady=5)
+        btn = Button(self, text="Close", width=6, command=self.destroy)
+        btn.grid(row=2, column=0, pady=10)
+
+        # Value labels, rebuilt only when the number of rows changes
+        self._overall_labels = []
+        self._sensor_labels = []
+
+        self._after_id = None
+        self._refresh()
+
+        # Close window on enter/return or esc
+        self.bind("<Return>", lambda event: self.destroy())
+        self.bind("<Escape>", lambda event: self.destroy())
+
+    def _refresh(self):
+        """
+        Show the latest figures and schedule the next refresh
+        :return: None
+        """
+        self._stats.refresh()
+        self._overall_labels = self._update_grid(self._overall_frame, self._overall_labels,
+                                                 self._stats.rows, headings=None)
+        self._sensor_labels = self._update_grid(self._sensors_frame, self._sensor_labels,
+                                                self._stats.sensors,
+                                                headings=("Sensor", "Mac", "Samples/s", "Samples", "Loss %", "RSSI"))
+        self._after_id = self.after(AppStatsDlg.REFRESH_INTERVAL_MS, self._refresh)
+
+    def _update_grid(self, frame, labels, rows, headings=None):
+        """
+        Show rows in a grid of labels. Existing labels are updated in place.
+        :param frame: The frame holding the grid
+        :param labels: The current list of label lists, one per row
+        :param rows: A list of row tuples. A (label, "") row is shown as a heading.
+        :param headings: Optional column headings
+        :return: The new list of label lists
+        """
+        if len(labels) != len(rows):
+            for child in frame.winfo_children():
+                child.destroy()
+            first_row = 0
+            if headings is not None:
+                for column, text in enumerate(headings):
+                    Label(frame, text=text, font=self._heading_font).grid(row=0, column=column, sticky="W", padx=5)
+                first_row = 1
+            labels = []
+            for index, row in enumerate(rows):
+                row_labels = []
+                for column, value in enumerate(row):
+                    lbl = Label(frame, text=value)
+                    lbl.grid(row=first_row + index, column=column, sticky="W", padx=5)
+                    row_labels.append(lbl)
+                labels.append(row_labels)
+
+        for row, row_labels in zip(rows, labels):
+            # A statistic with no value is a section heading
+            heading = headings is None and row[1] == ""
+            for value, lbl in zip(row, row_labels):
+                if lbl.cget("text") != value:
+                    lbl.config(text=value)
+                if heading:
+                    lbl.config(font=self._heading_font)
+        return labels
+
+    def destroy(self):
+        """
+        Stop refreshing and close the window
+        :return: None
+        """
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super(AppStatsDlg, self).destroy()
@@ -17,7 +17,6 @@
 # Icons
 # https://stackoverflow.com/questions/12306223/how-to-manually-create-icns-files-using-iconutil
 #
-import datetime
 from tkinter import VERTICAL
 from tkinter import Tk, Button, Label, Menu
 from tkinter import font
@@ -30,8 +29,11 @@ from settings_frame import SettingsFrame
 from tkmacos_utils import set_menubar_app_name
 from display_controller import DisplayController
 from sensor_utils import now_str
+import sensor_clock
 from modal_dialog import ModalDialog
-from sensor_db import SensorDB
+from tk_app_stats_dlg import AppStatsDlg
+import sensor_profiler
+from sensor_data_source_handler import create_data_source
 import version
 
 
@@ -79,16 +81,10 @@ class SensorApp(Tk):
             self.geometry(geo)
             self.resizable(width=False, height=False)
 
-        # Start up the sensor data DB
-        self._sensor_db = SensorDB()
-
-        # Start sensor data source
-        if self._config[Configuration.CFG_USE_TEST_DATA].lower() == "true":
-            from dummy_sensor_adapter import DummySensorAdapter as SensorThread
-        else:
-            from sensor_thread import SensorThread
-        self._sensor_data_source = SensorThread(handle_sensor_data=self._handle_sensor_data)
-        self._sensor_data_source.open()
+        # Start sensor data source (local or a separate collector process)
+        self._sensor_data_source = create_data_source()
+        self._sensor_data_source.open_data_source()
+        self._app_stats_dlg = None
 
         # Create menu
         self._create_menu()
@@ -183,9 +179,9 @@ class SensorApp(Tk):
         # Check again in a minute
         self.after(60 * 1000, self._trim_sensor_db)
         # On the hour, trim the database
-        now = datetime.datetime.now()
+        now = sensor_clock.now()
         if now.minute == 0:
-            self._sensor_db.trim_sensor_data()
+            self._sensor_data_source.trim_sensor_data()
 
     def _reset_backlight_controller(self, event):
         self._display_controller.reset_count_down()
@@ -218,17 +214,6 @@ class SensorApp(Tk):
         self._time_of_day_label = new_tod_label
         self.after(self._update_tod_interval, self._update_tod)
 
-    def _handle_sensor_data(self, mac, data):
-        """
-        Handle (log) a sensor data sample
-        :param mac: The mac of the sensor
-        :param data: A dict of sensor data keys and values
-        :return: None
-        """
-        # print(f"Handling data for mac: {mac}")
-        self._sensor_db.add_sensor(mac, data["name"])
-        self._sensor_db.add_sensor_data(mac, data)
-
     def _show_sensor_details(self):
         self._overview_frame.show_selected_sensor_details()
 
@@ -236,7 +221,14 @@ class SensorApp(Tk):
         pass
 
     def _show_app_stats(self):
-        pass
+        """
+        Show the app stats window. It stays open, refreshing, alongside the sensors.
+        :return:
+        """
+        if self._app_stats_dlg is not None and self._app_stats_dlg.winfo_exists():
+            self._app_stats_dlg.lift()
+            return
+        self._app_stats_dlg = AppStatsDlg(self, self._sensor_data_source)
 
     def _show_about(self):
         """
@@ -271,8 +263,10 @@ class SensorApp(Tk):
         App is closing. Warn user if unsaved changes.
         :return:
         """
-        # Shutdown sensor data thread
-        self._sensor_data_source.close()
+        # Shutdown sensor data source
+        self._sensor_data_source.close_data_source()
+        # Write the profile if one is running
+        sensor_profiler.stop_profiler(wait=True)
         super(SensorApp, self).destroy()
         return True
 
@@ -283,6 +277,8 @@ if __name__ == '__main__':
     app_logger.start("sensor_app")
     logger = logging.getLogger("sensor_app")
     logger.info("sensor_app starting...")
+    # kill -USR1 <pid> toggles the profiler
+    sensor_profiler.install_signal_handler()
 
     # Fix macos menu bar
     set_menubar_app_name("Sensor App")
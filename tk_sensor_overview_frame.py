@@ -21,6 +21,10 @@ from tkinter import font
 from configuration import Configuration
 import logging
 from sensor_widget import SensorWidget
+import sensor_metrics
+
+
+_UPDATE_SENSORS_TIME = sensor_metrics.histogram("ui.update_sensors", "Refreshing the sensor widgets")
 
 
 class SensorOverviewFrame(Frame):
@@ -111,6 +115,7 @@ class SensorOverviewFrame(Frame):
         :return:
         """
         self._logger.debug("Updating sensor frames")
+        t = _UPDATE_SENSORS_TIME.start()
 
         # Safely access the current sensor list
         sensor_list = self._sensor_data_source.lock_sensor_list()
@@ -148,6 +153,7 @@ class SensorOverviewFrame(Frame):
 
         # Release the sensor list lock
         self._sensor_data_source.unlock_sensor_list()
+        _UPDATE_SENSORS_TIME.stop(t)
 
     def show_selected_sensor_details(self):
         if self._selected_sensor_widget is not None:
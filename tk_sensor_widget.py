@@ -13,7 +13,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
 #
-from datetime import datetime
 import tkinter
 from tkinter import Tk, Frame, Button, Label, LabelFrame, messagebox, Toplevel
 from tkinter import Text, INSERT
@@ -21,6 +20,7 @@ from tkinter import Label
 from tkinter import font
 from sensor_details_dlg import SensorDetailsDlg
 from configuration import Configuration
+import sensor_clock
 
 
 class SensorWidget(LabelFrame):
@@ -73,7 +73,7 @@ class SensorWidget(LabelFrame):
 
         # Elapsed time since last data
         last = sensor_data["timestamp"]
-        delta = datetime.now() - last
+        delta = sensor_clock.now() - last
         sec = delta.seconds
 
         label = Label(self, text=f"last", font=self._lbl_font, bg=self._bg)
@@ -104,7 +104,7 @@ class SensorWidget(LabelFrame):
             bg = self._config[Configuration.CFG_NORMAL_BACKGROUND_COLOR]
 
         # Time out check (elapsed time since last sensor data was received)
-        dt = datetime.now() - sensor_data["timestamp"]
+        dt = sensor_clock.now() - sensor_data["timestamp"]
         if dt.seconds >= self._config[Configuration.CFG_OFFLINE_TIME]:
             bg = self._config[Configuration.CFG_OFFLINE_COLOR]
 
@@ -161,7 +161,7 @@ class SensorWidget(LabelFrame):
 
         # Elapsed time since last data
         last = sensor_data["timestamp"]
-        delta = datetime.now() - last
+        delta = sensor_clock.now() - last
         sec = delta.seconds
 
         self._sensor_labels["last"].config(bg=bg)
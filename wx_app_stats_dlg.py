@@ -0,0 +1,139 @@
+#
+# wx_app_stats_dlg.py - a dialog showing live app statistics
+# Copyright © 2023 by Dave Hocker (AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE.md file for more details.
+#
+
+
+import wx
+from sensor_app_stats import AppStats
+
+
+class AppStatsDlg(wx.Dialog):
+    """
+    Ingest rates, stage latencies, queue and storage figures, refreshed
+    while the dialog is open
+    """
+    REFRESH_TIMER_ID = 1
+    # Refresh interval in ms. A refresh only reads in-memory metrics.
+    REFRESH_INTERVAL_MS = 1000
+
+    def __init__(self, parent, data_source):
+        """
+        Create the dialog box
+        @param parent: Parent of the dialog (usually a wx.Frame)
+        @param data_source: The app's sensor data source
+        """
+        # Layout
+        border_width = 10
+        half_border_width = int(border_width / 2)
+        c1_width = 270
+        c2_width = 280
+        dlg_width = c1_width + c2_width + (border_width * 2)
+        dlg_height = 700
+        lc_width = c1_width + c2_width - border_width
+
+        super().__init__(parent,
+                         title="App Stats",
+                         size=wx.Size(dlg_width, dlg_height),
+                         style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.Center()
+
+        self._stats = AppStats(data_source)
+
+        widget_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        self._overall = wx.ListCtrl(self, style=wx.LC_REPORT, size=(lc_width, 400))
+        self._overall.AppendColumn("Statistic", width=c1_width)
+        self._overall.AppendColumn("Value", width=c2_width)
+        widget_sizer.Add(self._overall, 3, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, border=half_border_width)
+
+        self._sensors = wx.ListCtrl(self, style=wx.LC_REPORT, size=(lc_width, 200))
+        self._sensors.AppendColumn("Sensor", width=120)
+        self._sensors.AppendColumn("Mac", width=150)
+        self._sensors.AppendColumn("Samples/s", width=80)
+        self._sensors.AppendColumn("Samples", width=80)
+        self._sensors.AppendColumn("Loss %", width=60)
+        self._sensors.AppendColumn("RSSI", width=50)
+        widget_sizer.Add(self._sensors, 2, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, border=half_border_width)
+
+        ok_button = wx.Button(self, 1, label="Close")
+        widget_sizer.Add(ok_button, flag=wx.ALIGN_CENTER | wx.TOP | wx.BOTTOM, border=border_width)
+
+        self.SetSizer(widget_sizer)
+
+        self._refresh()
+
+        # Catch the Close button and the closer
+        self.Bind(wx.EVT_BUTTON, self._on_ok)
+        self.Bind(wx.EVT_CLOSE, self._on_close)
+
+        # Catch ESC
+        self.Bind(wx.EVT_CHAR_HOOK, self._on_escape)
+
+        self._refresh_timer = wx.Timer(self, AppStatsDlg.REFRESH_TIMER_ID)
+        self._refresh_timer.Start(AppStatsDlg.REFRESH_INTERVAL_MS, oneShot=wx.TIMER_CONTINUOUS)
+        self.Bind(wx.EVT_TIMER, self._on_refresh_timer)
+
+    def _refresh(self):
+        """
+        Show the latest figures
+        @return: None
+        """
+        self._stats.refresh()
+        AppStatsDlg._update_list(self._overall, self._stats.rows)
+        AppStatsDlg._update_list(self._sensors, self._stats.sensors)
+
+    @staticmethod
+    def _update_list(list_ctrl, rows):
+        """
+        Update a list in place, so it does not flicker or lose its scroll position
+        @param list_ctrl: The wx.ListCtrl
+        @param rows: A list of row tuples
+        @return: None
+        """
+        if list_ctrl.GetItemCount() != len(rows):
+            list_ctrl.DeleteAllItems()
+            for row in rows:
+                list_ctrl.Append(list(row))
+            return
+        for index, row in enumerate(rows):
+            for column, value in enumerate(row):
+                if list_ctrl.GetItemText(index, column) != value:
+                    list_ctrl.SetItem(index, column, value)
+
+    def _on_refresh_timer(self, evt):
+        self._refresh()
+
+    def _on_ok(self, evt):
+        """
+        Close the dialog
+        @param evt: Not used
+        @return: None
+        """
+        self.Close()
+
+    def _on_close(self, evt):
+        """
+        Stop refreshing and close
+        @param evt: Close event
+        @return: None
+        """
+        self._refresh_timer.Stop()
+        self.Destroy()
+
+    def _on_escape(self, evt):
+        """
+        Treat the ESC key like the Close button
+        :param evt: Key event
+        :return: None
+        """
+        if evt.GetKeyCode() == wx.WXK_ESCAPE:
+            self._on_ok(evt)
+        else:
+            evt.Skip()
@@ -15,7 +15,8 @@ import wx
 import logging
 import app_logger
 from wx_utils import set_menubar_app_name
-from sensor_data_source_handler import SensorDataSourceHandler
+from sensor_data_source_handler import create_data_source
+import sensor_profiler
 
 
 if __name__ == "__main__":
@@ -26,12 +27,14 @@ if __name__ == "__main__":
     app_logger.start("sensor_app")
     logger = logging.getLogger("sensor_app")
     logger.info("sensor_app starting...")
+    # kill -USR1 <pid> toggles the profiler
+    sensor_profiler.install_signal_handler()
 
     # Fix macos menu bar
     set_menubar_app_name("Sensor App")
 
-    # Create the data source
-    data_source = SensorDataSourceHandler()
+    # Create the data source (local or a separate collector process)
+    data_source = create_data_source()
     data_source.open_data_source()
 
     # Create a wx.App(), which handles the windowing system event loop
@@ -58,4 +61,6 @@ if __name__ == "__main__":
         # Since on_close did not run, try to save the current configuration
         Configuration.save_configuration()
 
+    # Write the profile if one is running
+    sensor_profiler.stop_profiler(wait=True)
     logger.info("sensor_app ended")
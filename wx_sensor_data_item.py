@@ -54,3 +54,11 @@ class SensorDataItem(wx.Panel):
         @return: None
         """
         self._value_widget.SetLabel(value)
+
+    def set_label(self, label):
+        """
+        Update the label of the sensor data item.
+        @param label: New label for the data item (should be a string).
+        @return: None
+        """
+        self._label_widget.SetLabel(label)
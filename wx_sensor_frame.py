@@ -9,22 +9,28 @@
 #
 
 
-import datetime
 import logging
 from configuration import Configuration
 from wx_utils import show_info_message, show_error_message
 import wx
 from wx_sensor_widget import SensorWidget
 from wx_sensor_details_dlg import SensorDetailsDlg
-from wx_sensor_history_dlg import SensorHistoryDlg
 from wx_sensor_names_dlg import SensorNamesDlg
-from sensor_db import SensorDB
-from wx_sensor_history import show_sensor_history
+from wx_app_stats_dlg import AppStatsDlg
+from sensor_history_cache import SensorHistoryCache
+from sensor_history_tiles import HistoryTileCache
+from wx_sensor_history import show_sensor_history, show_sensor_overlay
+import sensor_clock
+import sensor_metrics
+import sensor_profiler
 
 # import standard libraries
 from os.path import basename, join as joined
 
 
+_UPDATE_SENSORS_TIME = sensor_metrics.histogram("ui.update_sensors", "Refreshing the sensor widgets")
+
+
 class SensorFrame(wx.Frame):
     """
     The frame contains a single panel which in turn contains all of the
@@ -48,6 +54,7 @@ class SensorFrame(wx.Frame):
         self._logger = logging.getLogger("sensor_app")
         self._sensor_widgets = {}
         self._selected_sensor_widget = None
+        self._app_stats_dlg = None
 
         self._config = Configuration.get_configuration()
         self._sensor_update_interval_ms = int(self._config[Configuration.CFG_UPDATE_INTERVAL] * 1000)
@@ -134,6 +141,14 @@ class SensorFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self._show_selected_sensor_details, id=20)
         self._view_menu.Append(21, "Sensor &history", "Sensor history")
         self.Bind(wx.EVT_MENU, self._show_sensor_history, id=21)
+        self._view_menu.Append(23, "&Compare sensors", "Compare sensor history")
+        self.Bind(wx.EVT_MENU, self._compare_sensors, id=23)
+        self._view_menu.Append(24, "App &stats", "App statistics")
+        self.Bind(wx.EVT_MENU, self._show_app_stats, id=24)
+        self._view_menu.Append(25, "Start &profiling", "Sample all threads until stopped")
+        self.Bind(wx.EVT_MENU, self._toggle_profiler, id=25)
+        # SIGUSR1 can toggle the profiler too
+        self.Bind(wx.EVT_MENU_OPEN, self._update_profiler_menu)
         # self._view_menu.Append(22, "&Sensor names", "Sensor names")
         # self.Bind(wx.EVT_MENU, self._edit_sensor_names, id=22)
 
@@ -199,11 +214,10 @@ class SensorFrame(wx.Frame):
         """
         self._logger.debug("Checking for DB trim")
         # On the hour, trim the database
-        now = datetime.datetime.now()
+        now = sensor_clock.now()
         if now.minute == 0:
             self._logger.debug("Starting DB trimming")
-            db = SensorDB()
-            db.trim_sensor_data()
+            self._sensor_data_source.trim_sensor_data()
 
     def _create_sensor_frame(self, mac, sensor_data):
         sensor_frame = SensorWidget(self._panel, mac, sensor_data["name"], sensor_data,
@@ -232,6 +246,7 @@ class SensorFrame(wx.Frame):
         :return:
         """
         self._logger.debug("Updating sensor frames")
+        t = _UPDATE_SENSORS_TIME.start()
 
         # Safely access the current sensor list
         sensor_list = self._sensor_data_source.lock_sensor_list()
@@ -264,6 +279,7 @@ class SensorFrame(wx.Frame):
 
         # Release the sensor list lock
         self._sensor_data_source.unlock_sensor_list()
+        _UPDATE_SENSORS_TIME.stop(t)
 
     def _on_sensor_widget_selected(self, sensor_widget, widget_state):
         # Unselect all but the newly selected widget
@@ -277,6 +293,14 @@ class SensorFrame(wx.Frame):
 
         self._update_sensors()
 
+    @property
+    def data_source(self):
+        """
+        The sensor data source feeding this frame
+        :return: The data source instance
+        """
+        return self._sensor_data_source
+
     def on_close(self):
         """
         Save app state at close
@@ -321,8 +345,8 @@ class SensorFrame(wx.Frame):
 
     def _show_sensor_history(self, evt):
         """
-        Show the sensor history dialog. This is a graph of the last
-        24 hours of sensor temperature data points.
+        Show the sensor history window. This is a graph of the last
+        24 hours of sensor data points.
         :param evt: Not used
         :return: None
         """
@@ -333,7 +357,62 @@ class SensorFrame(wx.Frame):
                                "View Sensor History")
             return
 
-        show_sensor_history(self._selected_sensor_widget)
+        show_sensor_history(self._selected_sensor_widget, data_source=self._sensor_data_source)
+
+    def _compare_sensors(self, evt):
+        """
+        Choose several sensors and show their history on one graph
+        :param evt: Not used
+        :return: None
+        """
+        sensor_list = self._sensor_data_source.lock_sensor_list()
+        sorted_mac_list = self._create_sorted_mac_list(sensor_list)
+        self._sensor_data_source.unlock_sensor_list()
+
+        macs = list(sorted_mac_list.keys())
+        names = list(sorted_mac_list.values())
+        dlg = wx.MultiChoiceDialog(self, "Choose the sensors to compare", "Compare Sensors", names)
+        if dlg.ShowModal() == wx.ID_OK:
+            selections = dlg.GetSelections()
+            if len(selections) > 0:
+                show_sensor_overlay(self, {macs[i]: names[i] for i in selections})
+        dlg.Destroy()
+
+    def _show_app_stats(self, evt):
+        """
+        Show the app stats dialog. It stays open, refreshing, alongside the sensors.
+        :param evt: Not used
+        :return: None
+        """
+        # A destroyed dialog tests False
+        if self._app_stats_dlg:
+            self._app_stats_dlg.Raise()
+            return
+        self._app_stats_dlg = AppStatsDlg(self, self._sensor_data_source)
+        self._app_stats_dlg.Show()
+
+    def _toggle_profiler(self, evt):
+        """
+        Start the sampling profiler, or stop it and write the profile
+        :param evt: Not used
+        :return: None
+        """
+        if sensor_profiler.is_profiling():
+            profiler = sensor_profiler.stop_profiler()
+            show_info_message(self,
+                              f"The profile is written to\n{profiler.folded_file}\nand\n{profiler.pstats_file}",
+                              "Profiling")
+        else:
+            sensor_profiler.start_profiler()
+
+    def _update_profiler_menu(self, evt):
+        """
+        Label the profiler menu item for the profiler's current state
+        :param evt: Menu open event
+        :return: None
+        """
+        self._view_menu.SetLabel(25, "Stop &profiling" if sensor_profiler.is_profiling() else "Start &profiling")
+        evt.Skip()
 
     def _edit_sensor_names(self, evt):
         """
@@ -351,4 +430,7 @@ class SensorFrame(wx.Frame):
             self._panel_sizer.Layout()
             self._sensor_widgets = {}
             self._sensor_data_source.reset_sensor_list()
+            # Deleted sensors take their history with them
+            SensorHistoryCache.get_cache().invalidate()
+            HistoryTileCache.get_cache().invalidate()
             self._update_sensors()
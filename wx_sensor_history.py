@@ -16,36 +16,71 @@
 #
 
 
+import logging
 import wx
 from wx_utils import show_info_message
 from sensor_db import SensorDB
-from wx_sensor_history_dlg import SensorHistoryDlg
+from sensor_history_cache import SensorHistoryCache
+from wx_sensor_history_frame import SensorHistoryFrame, LiveSampleQueue
+from wx_sensor_overlay_dlg import SensorOverlayDlg
 
 
-def show_sensor_history(sensor_widget):
+def show_sensor_history(sensor_widget, data_source):
     """
-    Show the sensor history dialog. This is a graph of the last
-    24 hours of sensor temperature data points.
+    Show the sensor history. This is a graph of the last
+    24 hours of sensor data points (temperature, humidity and pressure).
+    The history is shown in a non-modal window that is kept up to date
+    with live samples from the data source.
     :param sensor_widget: The WX widget for the sensor.
+    :param data_source: The data source delivering live samples
     :return: None
     """
     data = sensor_widget.current_sensor_data
-    db = SensorDB()
+    # Subscribe before the seed history is queried, so no live sample is missed
+    live_samples = LiveSampleQueue(data_source, data["mac"])
+    cache = SensorHistoryCache.get_cache()
     dlg = wx.GenericProgressDialog(f"Sensor History", f"Querying database...")
     dlg.Pulse("Querying database...")
-    sensor_history = db.get_sensor_history(data["mac"], progress_dlg=dlg)
+    sensor_history = cache.get_sensor_history(data["mac"], progress_dlg=dlg)
     dlg.Destroy()
+    logging.getLogger("sensor_app").debug(f"History cache stats: {cache.stats}")
 
     if sensor_history is None or len(sensor_history) == 0:
+        live_samples.close()
         show_info_message(sensor_widget,
                           f"No history data for sensor {data['name']} {data['mac']}",
                           "View Sensor History")
     else:
-        # Determine relative time (in seconds) of each data point
-        start_time = sensor_history[0]["data_time"]
-        for r in sensor_history:
-            dt = r["data_time"] - start_time
-            r["t"] = float((dt.days * 3600.0 * 24.0) + dt.seconds) / 3600.0
+        frame = SensorHistoryFrame(sensor_widget.GetTopLevelParent(), data["mac"], data["name"],
+                                   sensor_history, live_samples)
+        frame.Show()
+
 
-        dlg = SensorHistoryDlg(sensor_widget, data["name"], sensor_history)
+def show_sensor_overlay(parent, sensors):
+    """
+    Show the history of several sensors on one graph. The history of
+    all of the sensors is fetched with a single query.
+    :param parent: Parent window for the dialog
+    :param sensors: A dict of sensor macs and their names
+    :return: None
+    """
+    db = SensorDB()
+    dlg = wx.GenericProgressDialog(f"Sensor History", f"Querying database...")
+    dlg.Pulse("Querying database...")
+    histories = db.get_multi_sensor_history(list(sensors.keys()), progress_dlg=dlg)
+    dlg.Destroy()
+
+    if histories is None:
+        show_info_message(parent, "Unable to query sensor history", "Compare Sensor History")
+        return
+
+    sensor_histories = {}
+    for mac, sensor_history in histories.items():
+        if len(sensor_history) > 0:
+            sensor_histories[mac] = sensor_history
+
+    if len(sensor_histories) == 0:
+        show_info_message(parent, "No history data for the selected sensors", "Compare Sensor History")
+    else:
+        dlg = SensorOverlayDlg(parent, sensor_histories, sensors)
         dlg.ShowModal()
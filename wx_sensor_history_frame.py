@@ -0,0 +1,441 @@
+#
+# wx_sensor_history_frame.py - a non-modal, live updating sensor history window
+# Copyright © 2023 by Dave Hocker (AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE.md file for more details.
+#
+# The window stays open alongside the main frame. It receives the live sample stream of the data source through a
+# LiveSampleQueue and appends new samples to its series as they arrive.
+# The queue is subscribed before the seed history is queried, so no sample
+# falls between the two. Repainting is driven by a timer, so the plot is
+# redrawn at most once per update interval no matter how fast samples arrive.
+#
+# The plot can be zoomed and panned. A zoomed view is a fixed time range.
+# Only that range is queried, at a level of detail matched to the plot
+# width, through the history tile cache. "All" returns to the live view of
+# the whole history.
+#
+
+
+import datetime
+import logging
+from threading import Lock
+import wx
+from wx.lib import plot as wxplot
+from configuration import Configuration
+from wx_sensor_data_item import SensorDataItem
+from sensor_history_series import SensorHistorySeries
+from sensor_history_columns import SensorHistoryColumns
+from sensor_history_tiles import HistoryTileCache
+
+
+class LiveSampleQueue:
+    """
+    Collects the live samples of one sensor until the history window takes them
+    """
+    def __init__(self, data_source, mac):
+        """
+        Subscribe to the live samples of a sensor
+        @param data_source: The data source whose live samples are collected
+        @param mac: The sensor's mac
+        """
+        self._data_source = data_source
+        self._mac = mac
+        self._samples = []
+        self._lock = Lock()
+        # Samples up to this time are already part of the seed history
+        self._seed_end_time = None
+        self._data_source.add_sample_listener(self._on_sample)
+
+    def set_seed_end_time(self, seed_end_time):
+        """
+        Drop samples received up to the end of the seed history
+        @param seed_end_time: data_time of the last seed history record
+        @return: None
+        """
+        self._lock.acquire()
+        self._seed_end_time = seed_end_time
+        if seed_end_time is not None:
+            self._samples = [s for s in self._samples if s[0] > seed_end_time]
+        self._lock.release()
+
+    def take(self):
+        """
+        Take the samples received since the last call
+        @return: A list of (timestamp, metric values) tuples
+        """
+        self._lock.acquire()
+        samples = self._samples
+        self._samples = []
+        self._lock.release()
+        return samples
+
+    def close(self):
+        """
+        Stop collecting samples
+        @return: None
+        """
+        self._data_source.remove_sample_listener(self._on_sample)
+
+    def _on_sample(self, mac, data):
+        """
+        Live sample observer. This runs on the data source thread, so
+        the sample is only queued here.
+        @param mac: The mac of the sensor
+        @param data: A dict of sensor data keys and values
+        @return: None
+        """
+        if mac != self._mac:
+            return
+        timestamp = data["timestamp"]
+        self._lock.acquire()
+        if self._seed_end_time is None or timestamp > self._seed_end_time:
+            self._samples.append((timestamp, [data.get(m) for m in SensorHistoryColumns.METRICS]))
+        self._lock.release()
+
+
+class SensorHistoryFrame(wx.Frame):
+    """
+    A live updating graph of a sensor's history. Each metric (temperature,
+    humidity, pressure) is shown on its own tab. One series is kept per
+    metric, so every tab is up to date when it is selected.
+    """
+    REPAINT_TIMER_ID = 1
+    # Zoom and pan button ids
+    ZOOM_IN_ID = 10
+    ZOOM_OUT_ID = 11
+    PAN_LEFT_ID = 12
+    PAN_RIGHT_ID = 13
+    ZOOM_RESET_ID = 14
+    # Zooming in stops at this span
+    MIN_VIEW_SPAN = datetime.timedelta(minutes=10)
+
+    def __init__(self, parent, mac, name, sensor_history, live_samples):
+        """
+        Create the history window
+        @param parent: Parent of the window (usually the main wx.Frame)
+        @param mac: The sensor's mac
+        @param name: Sensor's human-readable name
+        @param sensor_history: A SensorHistoryColumns instance used to seed the graph.
+        @param live_samples: A LiveSampleQueue subscribed before sensor_history was queried.
+        The window closes it.
+        """
+        self._logger = logging.getLogger("sensor_app")
+        self._config = Configuration.get_configuration()
+        self._mac = mac
+
+        self._series = {}
+        for metric in SensorHistoryColumns.METRICS:
+            self._series[metric] = SensorHistorySeries()
+            self._series[metric].extend_from_history(sensor_history, metric)
+        # Live samples up to the end of the seed history are dropped
+        self._live_samples = live_samples
+        self._live_samples.set_seed_end_time(sensor_history.data_times[-1] if len(sensor_history) > 0 else None)
+        # Plot time is in hours from the start of the seed history, so zooming keeps the axis
+        self._origin = sensor_history.data_times[0] if len(sensor_history) > 0 else None
+        # The visible (start, end) time range when zoomed, None for the live view of the whole history
+        self._view = None
+
+        # Layout
+        border_width = 10
+
+        display = wx.Display()
+        client_rect = display.GetClientArea()
+        width = client_rect.width
+        height = client_rect.height
+        if width > 600:
+            width = 600
+        if height > 450:
+            height = 450
+
+        frame_width = width + (border_width * 2)
+        frame_height = height
+        gr_width = frame_width - 10
+        gr_height = int(frame_height * .75)
+
+        super().__init__(parent,
+                         title=f"{name} Sensor History",
+                         size=wx.Size(frame_width, frame_height))
+        self.Center()
+
+        panel = wx.Panel(self)
+        widget_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        # One tab per metric. Tabs are drawn when they are shown.
+        self._notebook = wx.Notebook(panel)
+        self._metric_pages = []
+        for metric in SensorHistoryColumns.METRICS:
+            page = self._create_metric_page(metric, gr_width, gr_height)
+            self._notebook.AddPage(page, SensorHistoryColumns.METRIC_LABELS[metric])
+        widget_sizer.Add(self._notebook, 1, wx.EXPAND | wx.ALL, 5)
+
+        # Zoom and pan controls
+        zoom_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        for button_id, label in ((SensorHistoryFrame.PAN_LEFT_ID, "<"),
+                                 (SensorHistoryFrame.ZOOM_IN_ID, "Zoom in"),
+                                 (SensorHistoryFrame.ZOOM_OUT_ID, "Zoom out"),
+                                 (SensorHistoryFrame.ZOOM_RESET_ID, "All"),
+                                 (SensorHistoryFrame.PAN_RIGHT_ID, ">")):
+            button = wx.Button(panel, button_id, label=label, style=wx.BU_EXACTFIT)
+            zoom_sizer.Add(button, flag=wx.LEFT | wx.RIGHT, border=2)
+            self.Bind(wx.EVT_BUTTON, self._on_zoom_button, button)
+        widget_sizer.Add(zoom_sizer, flag=wx.ALIGN_CENTER)
+
+        self._resolution = SensorDataItem(panel, "Resolution", "")
+        widget_sizer.Add(self._resolution,
+                         flag=wx.ALIGN_TOP | wx.LEFT | wx.RIGHT | wx.EXPAND,
+                         border=5)
+
+        self._time_range = SensorDataItem(panel, "", "")
+        widget_sizer.Add(self._time_range,
+                         flag=wx.ALIGN_TOP | wx.TOP | wx.BOTTOM | wx.LEFT | wx.RIGHT | wx.EXPAND,
+                         border=5)
+
+        close_button = wx.Button(panel, 1, label="Close")
+        widget_sizer.Add(close_button, flag=wx.ALIGN_CENTER | wx.TOP | wx.BOTTOM, border=border_width)
+
+        panel.SetSizer(widget_sizer)
+
+        self._draw_metric_page(0)
+
+        # Draw a tab when it is selected
+        self._notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self._on_page_changed)
+
+        # Catch the Close button and the closer
+        self.Bind(wx.EVT_BUTTON, self._on_close_button, close_button)
+        self.Bind(wx.EVT_CLOSE, self._on_close_frame)
+
+        # Catch ESC
+        self.Bind(wx.EVT_CHAR_HOOK, self._on_escape)
+
+        # Repaint at a bounded rate
+        repaint_interval_ms = int(self._config[Configuration.CFG_UPDATE_INTERVAL] * 1000)
+        self._repaint_timer = wx.Timer(self, SensorHistoryFrame.REPAINT_TIMER_ID)
+        self._repaint_timer.Start(repaint_interval_ms, oneShot=wx.TIMER_CONTINUOUS)
+        self.Bind(wx.EVT_TIMER, self._on_repaint_timer)
+
+    def _create_metric_page(self, metric, gr_width, gr_height):
+        """
+        Create a notebook page for one metric: a plot and its min/max values
+        @param metric: The metric shown on the page
+        @param gr_width: Plot width
+        @param gr_height: Plot height
+        @return: The page panel
+        """
+        page = wx.Panel(self._notebook)
+        page_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        plot_canvas = wxplot.PlotCanvas(page, size=wx.Size(gr_width, gr_height))
+        plot_canvas.axesPen = wx.Pen(wx.BLACK, 1, wx.PENSTYLE_SOLID)
+        page_sizer.Add(plot_canvas, 1, wx.EXPAND | wx.ALL, 5)
+
+        value_min_max = SensorDataItem(page, "", "")
+        page_sizer.Add(value_min_max,
+                       flag=wx.ALIGN_TOP | wx.TOP | wx.BOTTOM | wx.LEFT | wx.RIGHT | wx.EXPAND,
+                       border=5)
+
+        page.SetSizer(page_sizer)
+        # stale is True when the series changed after the page was last drawn.
+        # drawn is the view the page was last drawn for, at tile cache level.
+        self._metric_pages.append({"metric": metric, "canvas": plot_canvas, "min_max": value_min_max,
+                                   "stale": True, "drawn": None, "level": None})
+        return page
+
+    def _on_repaint_timer(self, evt):
+        """
+        Move pending samples into the series and redraw the selected tab if it changed
+        @param evt: Not used
+        @return: None
+        """
+        appended = 0
+        for timestamp, values in self._live_samples.take():
+            for page, value in zip(self._metric_pages, values):
+                if value is not None and self._series[page["metric"]].append(timestamp, value):
+                    page["stale"] = True
+                    appended += 1
+
+        # A zoomed view is a fixed time range
+        if appended > 0 and self._view is None:
+            self._draw_metric_page(self._notebook.GetSelection())
+
+    def _on_page_changed(self, evt):
+        """
+        A metric tab was selected. Its series is already up to date.
+        @param evt: Notebook event
+        @return: None
+        """
+        self._draw_metric_page(evt.GetSelection())
+        evt.Skip()
+
+    def _draw_metric_page(self, page_index):
+        """
+        Show a metric page for the current view
+        @param page_index: Index of the notebook page
+        @return: None
+        """
+        if self._view is None:
+            self._draw_live_page(self._metric_pages[page_index])
+        else:
+            self._draw_zoomed_page(self._metric_pages[page_index])
+
+    def _draw_live_page(self, page):
+        """
+        Show the time range of a metric page, and draw its downsampled series
+        and min/max values if they changed since the page was last drawn
+        @param page: The metric page
+        @return: None
+        """
+        self._resolution.set_value("live")
+        series = self._series[page["metric"]]
+        if len(series) == 0:
+            page["canvas"].Clear()
+            return
+
+        start_time = series.start_time.strftime("%Y-%m-%d %H:%M:%S")
+        end_time = series.end_time.strftime("%Y-%m-%d %H:%M:%S")
+        self._time_range.set_label(start_time)
+        self._time_range.set_value(end_time)
+
+        if not page["stale"] and page["drawn"] is None:
+            return
+        page["stale"] = False
+        page["drawn"] = None
+
+        line = wxplot.PolySpline(
+            series.downsampled_points(origin=self._origin),
+            colour=wx.Colour(255, 0, 0),   # Color: red
+            width=1,
+        )
+        page["canvas"].Draw(wxplot.PlotGraphics([line]))
+
+        min_value, max_value = series.min_max()
+        page["min_max"].set_label(f"Min: {min_value:5.1f}")
+        page["min_max"].set_value(f"Max: {max_value:5.1f}")
+
+    def _draw_zoomed_page(self, page):
+        """
+        Draw a metric page for the zoomed time range if it has not been drawn
+        for that range. Only the range is fetched, at a resolution matched to
+        the plot width.
+        @param page: The metric page
+        @return: None
+        """
+        view_start, view_end = self._view
+        self._time_range.set_label(view_start.strftime("%Y-%m-%d %H:%M:%S"))
+        self._time_range.set_value(view_end.strftime("%Y-%m-%d %H:%M:%S"))
+
+        if page["drawn"] == self._view:
+            self._show_resolution(page["level"])
+            return
+
+        canvas = page["canvas"]
+        pixel_width = canvas.GetClientSize().width
+        level, history = HistoryTileCache.get_cache().get_range(self._mac, view_start, view_end, pixel_width)
+        self._show_resolution(level)
+        if history is None:
+            return
+
+        xy_data = history.points(page["metric"], origin=self._origin)
+        if len(xy_data) > 0:
+            line = wxplot.PolySpline(
+                xy_data,
+                colour=wx.Colour(255, 0, 0),   # Color: red
+                width=1,
+            )
+            x_axis = ((view_start - self._origin).total_seconds() / 3600.0,
+                      (view_end - self._origin).total_seconds() / 3600.0)
+            canvas.Draw(wxplot.PlotGraphics([line]), xAxis=x_axis)
+        else:
+            canvas.Clear()
+        page["drawn"] = self._view
+        page["level"] = level
+
+        stats = history.stats(page["metric"])
+        if stats["count"] > 0:
+            page["min_max"].set_label(f"Min: {stats['min']:5.1f}")
+            page["min_max"].set_value(f"Max: {stats['max']:5.1f}")
+
+    def _show_resolution(self, level):
+        """
+        Show the resolution of a tile cache level
+        @param level: Level index into HistoryTileCache.LEVELS
+        @return: None
+        """
+        bucket_seconds = HistoryTileCache.LEVELS[level]
+        if bucket_seconds == 0:
+            self._resolution.set_value("raw")
+        else:
+            self._resolution.set_value(f"{bucket_seconds // 60} min average")
+
+    def _on_zoom_button(self, evt):
+        """
+        Zoom or pan the visible time range and redraw the selected tab
+        @param evt: Button event
+        @return: None
+        """
+        series = self._series[self._metric_pages[self._notebook.GetSelection()]["metric"]]
+        if len(series) == 0:
+            return
+        full_start = series.start_time
+        # A single data point still gets a visible range
+        full_end = max(series.end_time, full_start + datetime.timedelta(minutes=1))
+        view_start, view_end = self._view if self._view is not None else (full_start, full_end)
+
+        span = view_end - view_start
+        center = view_start + (span / 2)
+        button_id = evt.GetId()
+        if button_id == SensorHistoryFrame.ZOOM_IN_ID:
+            span = max(span / 2, SensorHistoryFrame.MIN_VIEW_SPAN)
+        elif button_id == SensorHistoryFrame.ZOOM_OUT_ID:
+            span = span * 2
+        elif button_id == SensorHistoryFrame.PAN_LEFT_ID:
+            center -= span / 2
+        elif button_id == SensorHistoryFrame.PAN_RIGHT_ID:
+            center += span / 2
+        else:
+            span = full_end - full_start
+
+        if span >= full_end - full_start:
+            # Back to the live view of the whole history
+            self._view = None
+        else:
+            # Keep the view inside of the history
+            start = max(center - (span / 2), full_start)
+            start = min(start, full_end - span)
+            self._view = (start, start + span)
+
+        self._draw_metric_page(self._notebook.GetSelection())
+
+    def _on_close_button(self, evt):
+        """
+        Close the window
+        @param evt: Not used
+        @return: None
+        """
+        self.Close()
+
+    def _on_close_frame(self, evt):
+        """
+        Stop receiving live samples and destroy the window
+        @param evt: Not used
+        @return: None
+        """
+        self._repaint_timer.Stop()
+        self._live_samples.close()
+        self.Destroy()
+
+    def _on_escape(self, evt):
+        """
+        Treat the ESC key like the Close button
+        :param evt: Key event
+        :return: None
+        """
+        if evt.GetKeyCode() == wx.WXK_ESCAPE:
+            self._on_close_button(evt)
+        else:
+            # Continue handling the key
+            evt.Skip(True)
@@ -0,0 +1,139 @@
+#
+# wx_sensor_overlay_dlg.py - a dialog for comparing the history of several sensors
+# Copyright © 2023 by Dave Hocker (AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE.md file for more details.
+#
+
+
+import wx
+from wx.lib import plot as wxplot
+from wx_sensor_data_item import SensorDataItem
+from sensor_history_series import SensorHistorySeries
+
+
+class SensorOverlayDlg(wx.Dialog):
+    """
+    A custom dialog for displaying the history of several sensors on one graph
+    """
+    # Line colors, assigned to sensors in order
+    _LINE_COLOURS = [
+        wx.Colour(255, 0, 0),
+        wx.Colour(0, 0, 255),
+        wx.Colour(0, 160, 0),
+        wx.Colour(255, 128, 0),
+        wx.Colour(160, 0, 160),
+        wx.Colour(0, 160, 160),
+        wx.Colour(128, 128, 128),
+        wx.Colour(0, 0, 0),
+    ]
+
+    def __init__(self, parent, sensor_histories, names):
+        """
+        Create the dialog box
+        @param parent: Parent of the dialog (usually a wx.Frame)
+        @param sensor_histories: A dict keyed by sensor mac where each value
+        is the sensor's history as a SensorHistoryColumns instance.
+        @param names: A dict of sensor macs and their names, for the legend
+        """
+        # Layout
+        border_width = 10
+
+        display = wx.Display()
+        client_rect = display.GetClientArea()
+        width = client_rect.width
+        height = client_rect.height
+        if width > 600:
+            width = 600
+        if height > 450:
+            height = 450
+
+        dlg_width = width + (border_width * 2)
+        dlg_height = height
+        gr_width = dlg_width - 10
+        gr_height = int(dlg_height * .85)
+
+        super().__init__(parent,
+                         title="Sensor History Comparison",
+                         size=wx.Size(dlg_width, dlg_height))
+        self.Center()
+
+        widget_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        # Each sensor is downsampled on its own
+        series_list = {}
+        for mac, sensor_history in sensor_histories.items():
+            series = SensorHistorySeries()
+            series.extend_from_history(sensor_history, "temperature")
+            if len(series) > 0:
+                series_list[mac] = series
+
+        # Sensors sharing a name (e.g. the default "N/A") are told apart by mac
+        name_list = [names.get(mac, mac) for mac in series_list.keys()]
+
+        # All of the series share a time axis starting at the oldest sample
+        start_time = min([series.start_time for series in series_list.values()])
+        end_time = max([series.end_time for series in series_list.values()])
+
+        lines = []
+        for i, (mac, series) in enumerate(series_list.items()):
+            name = names.get(mac, mac)
+            if name_list.count(name) > 1:
+                name = f"{name} ({mac})"
+            line = wxplot.PolyLine(
+                series.downsampled_points(origin=start_time),
+                colour=SensorOverlayDlg._LINE_COLOURS[i % len(SensorOverlayDlg._LINE_COLOURS)],
+                width=1,
+                legend=name,
+            )
+            lines.append(line)
+
+        plot_canvas = wxplot.PlotCanvas(self, size=wx.Size(gr_width, gr_height))
+        plot_canvas.axesPen = wx.Pen(wx.BLACK, 1, wx.PENSTYLE_SOLID)
+        plot_canvas.enableLegend = True
+        plot_canvas.Draw(wxplot.PlotGraphics(lines))
+        widget_sizer.Add(plot_canvas, 1, wx.EXPAND | wx.ALL, 10)
+
+        # Display time range
+        time_range = SensorDataItem(self,
+                                    start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    end_time.strftime("%Y-%m-%d %H:%M:%S"))
+        widget_sizer.Add(time_range,
+                         flag=wx.ALIGN_TOP | wx.TOP | wx.BOTTOM | wx.LEFT | wx.RIGHT | wx.EXPAND,
+                         border=5)
+
+        ok_button = wx.Button(self, 1, label="OK")
+        widget_sizer.Add(ok_button, flag=wx.ALIGN_CENTER | wx.TOP | wx.BOTTOM, border=border_width)
+
+        self.SetSizer(widget_sizer)
+
+        # Catch the OK button
+        self.Bind(wx.EVT_BUTTON, self._on_ok)
+
+        # Catch ESC
+        self.Bind(wx.EVT_CHAR_HOOK, self._on_escape)
+
+    def _on_ok(self, evt):
+        """
+        Close the dialog
+        @param evt: Not used
+        @return: None
+        """
+        self.Close()
+
+    def _on_escape(self, evt):
+        """
+        Treat the ESC key like the OK button
+        :param evt: Key event
+        :return: None
+        """
+        if evt.GetKeyCode() == wx.WXK_ESCAPE:
+            self._on_ok(evt)
+            evt.Skip()
+        else:
+            # Continue handling the key
+            evt.Skip(True)
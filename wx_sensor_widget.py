@@ -16,10 +16,10 @@
 #
 
 
-from datetime import datetime
 import wx
 # from sensor_details_dlg import SensorDetailsDlg
 from configuration import Configuration
+import sensor_clock
 from wx_sensor_data_item import SensorDataItem
 from wx_widget_popup_menu import WidgetPopupMenu
 
@@ -152,7 +152,7 @@ class SensorWidget(wx.StaticBox):
             bg = self._config[Configuration.CFG_NORMAL_BACKGROUND_COLOR]
 
         # Time out check (elapsed time since last sensor data was received)
-        dt = datetime.now() - sensor_data["timestamp"]
+        dt = sensor_clock.now() - sensor_data["timestamp"]
         if dt.seconds >= self._config[Configuration.CFG_OFFLINE_TIME]:
             bg = self._config[Configuration.CFG_OFFLINE_COLOR]
 
@@ -169,5 +169,5 @@ class SensorWidget(wx.StaticBox):
         :param last_timestamp:
         :return:
         """
-        delta = datetime.now() - last_timestamp
+        delta = sensor_clock.now() - last_timestamp
         return delta.seconds
@@ -49,7 +49,9 @@ class WidgetPopupMenu(wx.Menu):
         :param evt: Not used
         :return: None
         """
-        show_sensor_history(self._parent)
+        # The main frame owns the data source
+        data_source = self._parent.GetTopLevelParent().data_source
+        show_sensor_history(self._parent, data_source=data_source)
 
     def _show_sensor_details(self, evt):
         """